@@ -2,7 +2,7 @@ import os
 import asyncio
 import logging
 from types import TracebackType
-from typing import Optional, Any, Union, Type, Tuple
+from typing import Optional, Any, Union, Type, Tuple, List, Dict
 from enum import Enum
 
 from bleak import BleakClient, BleakScanner
@@ -11,9 +11,8 @@ from bleak.backends.device import BLEDevice
 from bleak.backends.scanner import AdvertisementData
 from bleak.uuids import normalize_uuid_str
 
-import httpx
-
 from commands import AnovaCommand
+from .proxy import BLEProxy, BLE_PROXY_URL
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -27,6 +26,7 @@ ANOVA_DEVICE_NAME = "Anova"
 # Command Constants
 MAX_COMMAND_LENGTH = 20
 COMMAND_DELIMITER = "\r"
+PROXY_TIMEOUT_BUFFER = 5  # seconds on top of a command or scan timeout, for the round trip to the proxy
 
 class AnovaException(Exception):
     """Base exception for Anova-related errors."""
@@ -102,48 +102,67 @@ class GetTargetTemperature:
             logger.error(f"Invalid response for target temperature: {response}")
             raise ValueError(f"Could not decode target temperature: {response}")
 
+_proxies: Dict[str, BLEProxy] = {}
+
+
+def proxy_at(url: str) -> BLEProxy:
+    """The client of the proxy at `url`, shared by all clients that weren't given one."""
+    if url not in _proxies:
+        _proxies[url] = BLEProxy(url)
+    return _proxies[url]
+
+
+async def close_proxies() -> None:
+    """Close the proxy clients made by `proxy_at`, once no client needs them anymore."""
+    proxies = list(_proxies.values())
+    _proxies.clear()
+    for proxy in proxies:
+        await proxy.close()
+
 class AnovaBluetoothClient:
     _client: Optional[BleakClient]
     command_lock: asyncio.Lock
     device: Union[BLEDevice, str, dict, object]
-
-    def __init__(self, device: Union[BLEDevice, str, dict, object]):
+    proxy: Optional[BLEProxy]
+
+    def __init__(self, device: Union[BLEDevice, str, dict, object], proxy: Optional[BLEProxy] = None,
+                 proxy_url: Optional[str] = None):
+        """
+        :param device: The device, or the proxy's description of it to reach it through the proxy
+        :param proxy: The proxy to send commands through
+        :param proxy_url: Where to find the proxy if none is given, `BLE_PROXY_URL` from the environment by default
+        """
         self.command_lock = asyncio.Lock()
         self.device = device
+        if proxy is None and self._is_proxy():
+            proxy = proxy_at(proxy_url or os.environ.get("BLE_PROXY_URL", BLE_PROXY_URL))
+        self.proxy = proxy
 
     @staticmethod
-    async def scan(timeout: float = 5.0) -> Tuple[Optional[Union[BLEDevice, dict]], Optional[Union[AdvertisementData, dict]]]:
-		   
-																				   
-																			
-		   
+    async def scan(timeout: float = 5.0, proxy: Optional[BLEProxy] = None) -> Tuple[Optional[Union[BLEDevice, dict]], Optional[Union[AdvertisementData, dict]]]:
         ble_proxy_url = os.environ.get("BLE_PROXY_URL")
-        if ble_proxy_url:
-            url = ble_proxy_url.rstrip("/") + "/scan"
-            logger.info(f"Using BLE proxy for scan at {url}")
+        if ble_proxy_url and not proxy:
+            proxy = proxy_at(ble_proxy_url)
+        if proxy:
+            logger.info(f"Using BLE proxy for scan at {proxy.url}")
             try:
-                async with httpx.AsyncClient() as client:
-                    resp = await client.get(url, timeout=timeout + 5)
-                    resp.raise_for_status()
-                    devices = resp.json()
-                    for dev in devices:
-                        logger.debug(f"Proxy found device: {dev}")
-                        if dev.get("name") == ANOVA_DEVICE_NAME:
-                            for uuid in dev.get("service_uuids", []):
-                                if normalize_uuid_str(ANOVA_SERVICE_UUID) == uuid.lower():
-                                    logger.info(f"Anova device found via proxy: {dev.get('name')}")
-																					
-                                    return dev, {
-                                        "local_name": dev.get("name"),
-                                        "service_uuids": dev.get("service_uuids", [])
-                                    }
-                    logger.warning("No Anova devices found via BLE proxy.")
-                    return None, None
+                devices = await proxy.scan(timeout=timeout + PROXY_TIMEOUT_BUFFER)
+                for dev in devices:
+                    logger.debug(f"Proxy found device: {dev}")
+                    if dev.get("name") == ANOVA_DEVICE_NAME:
+                        for uuid in dev.get("service_uuids", []):
+                            if normalize_uuid_str(ANOVA_SERVICE_UUID) == uuid.lower():
+                                logger.info(f"Anova device found via proxy: {dev.get('name')}")
+                                return dev, {
+                                    "local_name": dev.get("name"),
+                                    "service_uuids": dev.get("service_uuids", [])
+                                }
+                logger.warning("No Anova devices found via BLE proxy.")
+                return None, None
             except Exception as e:
                 logger.error(f"BLE proxy scan failed: {e}")
                 return None, None
 
-										   
         logger.debug("Starting BLE scan for Anova devices (local/bleak).")
         devs = await BleakScanner.discover(timeout=timeout, return_adv=True)
         for dev, adv in devs.values():
@@ -218,17 +237,41 @@ class AnovaBluetoothClient:
                     logger.error(f"Device {device.id_card} disconnected after repeated heartbeat failures.")
                     self.remove_device(device.id_card)
 
-    @retry_async
-    async def send_command(self, command: Union[AnovaCommand, str], timeout: float = 10.0) -> Any:
+    async def send_commands(self, commands: List[AnovaCommand], timeout: float = 10.0) -> List[Any]:
+        """
+        Run several commands over one connection: a single request to the proxy, or the open BLE connection
+        :param commands: The commands, run in order
+        :param timeout: Seconds to wait for each command
+        :return: Their decoded responses
+        """
+        if not self._is_proxy():
+            return [await self.send_command(command, timeout) for command in commands]
+
+        proxy = self.proxy
+        assert proxy is not None  # resolved in __init__
+        address = getattr(self.device, "address", None) or (self.device.get("address") if isinstance(self.device, dict) else None)
+        logger.info(f"Proxy BLE batch: url={proxy.url}, address={address}, commands={commands}")
+        try:
+            responses = await proxy.run(address, [command.encode() for command in commands],
+                                        timeout=timeout * len(commands) + PROXY_TIMEOUT_BUFFER)
+        except Exception as e:
+            logger.error(f"BLE proxy batch failed: {e}")
+            raise AnovaCommandError(f"BLE proxy batch failed: {e}")
+        return [command.decode(response) for command, response in zip(commands, responses)]
+
+    def _is_proxy(self) -> bool:
         # PROXY MODE: Use HTTP POST to proxy if self.device is not a real BLEDevice
-        is_proxy = (
+        return (
             isinstance(self.device, dict)
             or type(self.device).__name__.startswith("BLEDev")
             or hasattr(self.device, "address") and not hasattr(self.device, "metadata")
         )
-        if is_proxy:
-            ble_proxy_url = os.environ.get("BLE_PROXY_URL", "http://localhost:5000")
-            url = ble_proxy_url.rstrip("/") + "/write"
+
+    @retry_async
+    async def send_command(self, command: Union[AnovaCommand, str], timeout: float = 10.0) -> Any:
+        if self._is_proxy():
+            proxy = self.proxy
+            assert proxy is not None  # resolved in __init__
             address = getattr(self.device, "address", None) or (self.device.get("address") if isinstance(self.device, dict) else None)
             # Always convert to string for proxy!
             if isinstance(command, AnovaCommand):
@@ -238,16 +281,9 @@ class AnovaBluetoothClient:
             else:
                 logger.error(f"Unsupported command type for BLE proxy: {type(command)}")
                 raise AnovaCommandError("Unsupported command type for BLE proxy")
-            logger.info(f"Proxy BLE write: url={url}, address={address}, command={cmd_str!r}")
+            logger.info(f"Proxy BLE write: url={proxy.url}, address={address}, command={cmd_str!r}")
             try:
-                async with httpx.AsyncClient() as client:
-                    resp = await client.post(url, json={
-                        "address": address,
-                        "command": cmd_str
-                    }, timeout=timeout)
-                    resp.raise_for_status()
-                    result = resp.json()
-                    return result.get("result")
+                return await proxy.write(address, cmd_str, timeout=timeout + PROXY_TIMEOUT_BUFFER)
             except Exception as e:
                 logger.error(f"BLE proxy write failed: {e}")
                 raise AnovaCommandError(f"BLE proxy write failed: {e}")
@@ -0,0 +1,140 @@
+import logging
+from types import TracebackType
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Type, Union
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+logger = logging.getLogger(__name__)
+
+BLE_PROXY_URL = "http://localhost:5000"
+BLE_PROXY_TIMEOUT = 15.0  # seconds for a command, which includes connecting to the device over BLE
+BLE_PROXY_SCAN_TIMEOUT = 15.0  # seconds for a scan, which takes the proxy about 5 seconds
+BLE_PROXY_CONNECTIONS = 10
+
+
+class BLEProxyError(Exception):
+    """A command run by the proxy failed."""
+
+
+class BatchResult(NamedTuple):
+    command: str
+    result: Optional[str]
+    error: Optional[str]
+    elapsed: float  # seconds
+
+
+class BLEProxy:
+    """
+    Client of a BLE proxy (`ble_proxy/ble_server.py`) that bridges to devices the server can't reach over BLE itself.
+    All requests share one pool of keep-alive connections, so only the first one pays for connecting to the proxy.
+    HTTP/2 is used when the `h2` package is installed and the proxy supports it.
+    """
+
+    def __init__(self, url: str = BLE_PROXY_URL, timeout: float = BLE_PROXY_TIMEOUT,
+                 scan_timeout: float = BLE_PROXY_SCAN_TIMEOUT, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.url = url.rstrip("/")
+        self.scan_timeout = scan_timeout
+        self._client = httpx.AsyncClient(
+            base_url=self.url,
+            timeout=timeout,
+            http2=HTTP2,
+            limits=httpx.Limits(max_connections=BLE_PROXY_CONNECTIONS, max_keepalive_connections=BLE_PROXY_CONNECTIONS),
+            transport=transport,
+        )
+
+    async def __aenter__(self) -> 'BLEProxy':
+        return self
+
+    async def __aexit__(self, exc_type: Optional[Type[BaseException]], exc_val: Optional[BaseException],
+                        exc_tb: Optional[TracebackType]) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def scan(self, max_age: Optional[float] = None, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Get the Anova devices near the proxy, which it keeps track of in the background
+        :param max_age: Have the proxy scan first unless it saw a device within this many seconds
+        :param timeout: Seconds to wait for the proxy, `scan_timeout` by default
+        :return: The address, name, RSSI, service UUIDs and age in seconds of every device, most recently seen first
+        """
+        params = {} if max_age is None else {"max_age": max_age}
+        response = await self._client.get("/scan", params=params,
+                                          timeout=self.scan_timeout if timeout is None else timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def write(self, address: str, command: str, timeout: Optional[float] = None) -> str:
+        """
+        Send a command to a device and wait for its response
+        :param address: The BLE address of the device
+        :param command: The encoded command, without the terminating `\\r`
+        :param timeout: Seconds to wait for the proxy, the client's timeout by default
+        :return: The response
+        """
+        response = await self._client.post("/write", json={"address": address, "command": command},
+                                           timeout=self._timeout(timeout))
+        response.raise_for_status()
+        data = response.json()
+        return data.get("result") or data.get("response", "")
+
+    async def batch(self, address: str, commands: List[str], stop_on_error: bool = False,
+                    timeout: Optional[float] = None) -> List[BatchResult]:
+        """
+        Send several commands to a device over one BLE connection
+        :param address: The BLE address of the device
+        :param commands: The encoded commands, run in order
+        :param stop_on_error: Don't run the commands after the first one that fails
+        :param timeout: Seconds to wait for the proxy, the client's timeout by default
+        :return: The outcome of every command that ran
+        """
+        response = await self._client.post(
+            "/batch", json={"address": address, "commands": commands, "stop_on_error": stop_on_error},
+            timeout=self._timeout(timeout),
+        )
+        response.raise_for_status()
+        return [BatchResult(**result) for result in response.json()["results"]]
+
+    async def run(self, address: str, commands: List[str], timeout: Optional[float] = None) -> List[str]:
+        """
+        Like `batch`, stopping at the first failure
+        :return: The responses
+        :raises BLEProxyError: If a command failed
+        """
+        results = await self.batch(address, commands, stop_on_error=True, timeout=timeout)
+        for result in results:
+            if result.error is not None:
+                raise BLEProxyError(f"Command {result.command!r} failed: {result.error}")
+        return [result.result for result in results]  # type: ignore
+
+    def _timeout(self, timeout: Optional[float]) -> Union[float, httpx.Timeout]:
+        # None would disable the timeout altogether, rather than leave the client's in place
+        return self._client.timeout if timeout is None else timeout
+
+    async def notifications(self, address: str) -> AsyncIterator[str]:
+        """
+        Follow the messages a device sends, until it disconnects
+        :param address: The BLE address of the device
+        :return: The messages, without the terminating `\\r`
+        """
+        async with self._client.stream("GET", f"/notifications/{address}", timeout=httpx.Timeout(
+            self._client.timeout.connect, read=None
+        )) as response:
+            response.raise_for_status()
+            event = "message"
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: ") and event == "message":
+                    yield line[len("data: "):]
+                elif not line:
+                    if event == "disconnected":
+                        return
+                    event = "message"
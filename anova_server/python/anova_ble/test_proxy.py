@@ -0,0 +1,108 @@
+import asyncio
+import json
+from typing import List
+
+import httpx
+import pytest
+
+from commands import GetIDCard, GetSpeakerStatus, GetTemperatureUnit, GetVersion
+from .client import AnovaBluetoothClient, AnovaCommandError, close_proxies
+from .proxy import BLEProxy
+from .testing import batch_response
+
+DEVICES = [{"address": "AA:BB", "name": "Anova", "rssi": -60, "service_uuids": ["0000ffe0-0000-1000-8000-00805f9b34fb"]}]
+
+
+def test_requests_share_the_connection_pool() -> None:
+    async def run() -> None:
+        requests: List[httpx.Request] = []
+
+        def handle(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            if request.url.path == "/scan":
+                return httpx.Response(200, json=DEVICES)
+            return httpx.Response(200, json={"result": json.loads(request.content)["command"].upper()})
+
+        transport = httpx.MockTransport(handle)
+        async with BLEProxy("http://proxy:5000/", timeout=3, scan_timeout=7, transport=transport) as proxy:
+            assert await proxy.scan() == DEVICES
+            client = AnovaBluetoothClient({"address": "AA:BB"}, proxy=proxy)
+            assert await client.send_command("read unit") == "READ UNIT"
+            assert await client.send_command("read temp", timeout=2) == "READ TEMP"
+            dev, adv = await AnovaBluetoothClient.scan(proxy=proxy)
+            assert dev == DEVICES[0] and adv == {"local_name": "Anova", "service_uuids": DEVICES[0]["service_uuids"]}
+            await proxy.scan(max_age=2.5)
+            client_of_pool = proxy._client
+
+        assert [str(r.url) for r in requests] == [
+            "http://proxy:5000/scan", "http://proxy:5000/write", "http://proxy:5000/write", "http://proxy:5000/scan",
+            "http://proxy:5000/scan?max_age=2.5",
+        ]
+        # The client's own timeouts reach the proxy, plus a buffer for the round trip to it
+        assert [r.extensions["timeout"]["read"] for r in requests] == [7, 15, 7, 10, 7]
+        assert client_of_pool.is_closed
+
+    asyncio.run(run())
+
+
+def test_clients_resolve_the_proxy_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def run() -> None:
+        monkeypatch.setenv("BLE_PROXY_URL", "http://first:5000")
+        first = AnovaBluetoothClient({"address": "AA:BB"})
+        second = AnovaBluetoothClient({"address": "CC:DD"})
+        monkeypatch.setenv("BLE_PROXY_URL", "http://second:5000")
+        assert first.proxy is second.proxy
+        assert first.proxy is not None and first.proxy.url == "http://first:5000"
+        third = AnovaBluetoothClient({"address": "AA:BB"}, proxy_url="http://third:5000")
+        assert third.proxy is not None and third.proxy.url == "http://third:5000"
+
+        await close_proxies()
+        assert first.proxy._client.is_closed
+        assert AnovaBluetoothClient({"address": "AA:BB"}).proxy is not first.proxy
+        await close_proxies()
+
+    asyncio.run(run())
+
+def test_commands_share_one_session() -> None:
+    async def run() -> None:
+        requests: List[httpx.Request] = []
+        replies = {"get id card": "anova f56-0123456789", "version": "VM 1.2", "speaker status": "speaker is on"}
+
+        def handle(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return httpx.Response(200, json=batch_response(json.loads(request.content)["commands"], replies))
+
+        async with BLEProxy(transport=httpx.MockTransport(handle)) as proxy:
+            client = AnovaBluetoothClient({"address": "AA:BB"}, proxy=proxy)
+            assert await client.send_commands([GetIDCard(), GetVersion(), GetSpeakerStatus()]) == [
+                "f56-0123456789", "VM 1.2", True
+            ]
+            with pytest.raises(AnovaCommandError, match="'read unit' failed: No response from device"):
+                await client.send_commands([GetVersion(), GetTemperatureUnit(), GetSpeakerStatus()])
+            results = await proxy.batch("AA:BB", ["read unit", "version"])
+            assert [(r.command, r.result, r.error) for r in results] == [
+                ("read unit", None, "No response from device"), ("version", "VM 1.2", None)
+            ]
+
+        assert len(requests) == 3
+        assert json.loads(requests[0].content) == {
+            "address": "AA:BB", "commands": ["get id card", "version", "speaker status"], "stop_on_error": True
+        }
+        assert json.loads(requests[2].content)["stop_on_error"] is False
+
+    asyncio.run(run())
+
+
+def test_notifications_are_followed_until_the_device_disconnects() -> None:
+    async def run() -> None:
+        stream = b"data: temp reached\n\n: keepalive\n\ndata: 28.5\n\nevent: disconnected\ndata: \n\ndata: never\n\n"
+
+        def handle(request: httpx.Request) -> httpx.Response:
+            assert request.url.path == "/notifications/AA:BB"
+            assert request.extensions["timeout"]["read"] is None
+            return httpx.Response(200, content=stream, headers={"content-type": "text/event-stream"})
+
+        async with BLEProxy(transport=httpx.MockTransport(handle)) as proxy:
+            assert [message async for message in proxy.notifications("AA:BB")] == ["temp reached", "28.5"]
+
+    asyncio.run(run())
@@ -0,0 +1,11 @@
+from typing import Any, Dict, List
+
+
+def batch_response(commands: List[str], replies: Dict[str, str]) -> Dict[str, Any]:
+    """What the proxy answers to /batch, where a command without a reply fails."""
+    results = []
+    for command in commands:
+        reply = replies.get(command)
+        results.append({"command": command, "result": reply, "error": None if reply else "No response from device",
+                        "elapsed": 0.1})
+    return {"results": results, "elapsed": 0.1 * len(results)}
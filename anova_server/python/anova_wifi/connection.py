@@ -1,40 +1,112 @@
 import asyncio
 import logging
-from typing import Optional, Callable, Coroutine
+import time
+from collections import deque
+from typing import Optional, Callable, Coroutine, List, Deque, Sequence, Tuple, Union
 
-from .encoding import Encoder
+from .encoding import Encoder, FrameDecoder
 from .event import AnovaEvent
 
 logger = logging.getLogger(__name__)
 
+COMMAND_TIMEOUT = 10  # seconds
+PIPELINE_DEPTH = 6  # commands in flight per connection, enough for a full heartbeat
+RATE_WINDOW = 60  # seconds over which the command rate is measured
 
-class AnovaConnection:
-    event_callback: Optional[Callable[[AnovaEvent], Coroutine[None, None, None]]] = None
-    listen_task: Optional[asyncio.Task[None]] = None
-    response_queue: asyncio.Queue[str] = asyncio.Queue(maxsize=1)
-    cmd_lock = asyncio.Lock()
 
-    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+class AnovaConnection:
+    """
+    A single cooker's TCP connection.
+    The protocol has no request ids, but the cooker answers commands strictly in the order it received them.
+    Outstanding commands are therefore kept in a FIFO and every reply resolves the oldest one, which lets up to
+    `pipeline_depth` commands share the wire instead of waiting for each other's round trip. A command that gets no
+    reply within `COMMAND_TIMEOUT` means the FIFO can no longer be trusted, so the connection is dropped.
+    """
+    event_callback: Optional[Callable[[AnovaEvent], Coroutine[None, None, None]]]
+    close_callback: Optional[Callable[[], Coroutine[None, None, None]]]
+    listen_task: Optional[asyncio.Task[None]]
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 pipeline_depth: int = PIPELINE_DEPTH):
+        if pipeline_depth < 1:
+            raise ValueError("Pipeline depth must be at least 1")
         self.reader = reader
         self.writer = writer
+        self.event_callback = None
+        self.close_callback = None
+        self.listen_task = None
+        self.closed = False
+        self.decoder = FrameDecoder()
+        self.pipeline_depth = pipeline_depth
+        self._pipeline = asyncio.Semaphore(pipeline_depth)
+        self._pending: Deque[Tuple[str, asyncio.Future[str]]] = deque()
+        self._sent_at: Deque[float] = deque()
+
+    @property
+    def in_flight(self) -> int:
+        """Number of commands sent that have not been answered yet."""
+        return len(self._pending)
+
+    @property
+    def command_rate(self) -> float:
+        """Commands sent per second, averaged over the last `RATE_WINDOW` seconds."""
+        self._expire_sent(time.monotonic())
+        return len(self._sent_at) / RATE_WINDOW
+
+    def _expire_sent(self, now: float) -> None:
+        horizon = now - RATE_WINDOW
+        while self._sent_at and self._sent_at[0] < horizon:
+            self._sent_at.popleft()
 
     async def send_command(self, message: str) -> str:
-        async with self.cmd_lock:
-            async with asyncio.timeout(10):
-                encoded = Encoder.encode(message)
-                self.writer.write(encoded)
-                self.writer.write(b'\x16')
-                await self.writer.drain()
-                logger.debug(f"--> Sent message: {message}")
-                resp = await self.response_queue.get()
-                logger.debug(f"<-- Received response: {resp}")
-                return resp
+        return await self._send(message, Encoder.encode(message))
+
+    async def send_commands(self, messages: Sequence[str]) -> List[Union[str, BaseException]]:
+        """
+        Send several commands back-to-back, encoding them in one batch, and wait for all of their replies
+        :param messages: The commands, written to the wire in this order
+        :return: The reply to every command, or the exception it failed with
+        """
+        frames = Encoder.encode_many(messages)
+        return await asyncio.gather(
+            *(self._send(message, frame) for message, frame in zip(messages, frames)), return_exceptions=True
+        )
+
+    async def _send(self, message: str, frame: bytes) -> str:
+        async with self._pipeline:
+            if self.closed or self.writer.is_closing():
+                raise ConnectionResetError("Connection closed")
+            future: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+            # Writing and queueing must not be separated by an await, so the FIFO matches the order on the wire
+            self.writer.write(frame + b'\x16')
+            self._pending.append((message, future))
+            now = time.monotonic()
+            self._expire_sent(now)
+            self._sent_at.append(now)
+            logger.debug(f"--> Sent message: {message}")
+
+            try:
+                async with asyncio.timeout(COMMAND_TIMEOUT):
+                    await self.writer.drain()
+                    resp = await future
+            except TimeoutError:
+                # The reply was lost or is very late, and without request ids there is no telling which of the replies
+                # still to come belongs to which command. Rather than have every later reply resolve the wrong command,
+                # drop the connection so the cooker reconnects with nothing in flight.
+                logger.error(f"No response to {message!r} within {COMMAND_TIMEOUT} seconds, dropping the connection")
+                self.closed = True
+                self._fail_pending(ConnectionResetError(f"Connection dropped after a lost reply to {message!r}"))
+                self.writer.close()
+                raise
+            logger.debug(f"<-- Received response: {resp}")
+            return resp
 
     def start_listening(self) -> None:
         if not self.listen_task:
             self.listen_task = asyncio.create_task(self._listen())
 
     async def _listen(self) -> None:
+        lost = True
         try:
             while True:
                 await self.receive()
@@ -42,44 +114,73 @@ class AnovaConnection:
             logger.debug("Connection closed by remote host")
         except asyncio.CancelledError:
             logger.debug("Listening task cancelled")
+            lost = False
         except Exception as e:
-            logger.error(f"Error in listening task: {e}")
-
-    async def receive(self) -> Optional[str]:
+            logger.error(f"Error in listening task: {e!r}")
+        finally:
+            # Nothing more can be read, so commands sent from now on fail at once instead of waiting out their timeout
+            self.closed = True
+            self._fail_pending(ConnectionResetError("Connection closed"))
+            self.writer.close()
+        if lost and self.close_callback:
+            await self.close_callback()
+
+    async def receive(self) -> List[str]:
         data = await self.reader.read(1024)
         if not data:
             logger.error("Connection closed by remote host")
             raise ConnectionResetError("Connection closed by remote host")
 
-        msg = Encoder.decode(data)
-
-        if "invalid command" in msg.lower():
-            logger.error(f"Received invalid command, skipping: {msg}")
-            return None
+        messages = self.decoder.feed(data)
+        for msg in messages:
+            await self._handle_message(msg)
+        return messages
 
+    async def _handle_message(self, msg: str) -> None:
         if AnovaEvent.is_event(msg):
             if self.event_callback:
                 await self.event_callback(AnovaEvent.parse_event(msg))
             else:
                 logger.warning(f"Received event message but no event callback set: {msg}")
-        elif self.cmd_lock.locked():
-            await self.response_queue.put(msg)
+        elif self._pending:
+            command, future = self._pending.popleft()
+            if future.done():
+                logger.debug(f"Discarding late response to {command!r}: {msg}")
+            elif "invalid command" in msg.lower():
+                logger.error(f"Device rejected command {command!r}: {msg}")
+                future.set_exception(ValueError(f"Invalid command: {command}"))
+            else:
+                future.set_result(msg)
         else:
-            logger.warning(f"Received unexpected message while not locked: {msg}")
+            logger.warning(f"Received unexpected message with no command pending: {msg}")
 
-        return msg
+    def _fail_pending(self, exc: BaseException) -> None:
+        while self._pending:
+            _, future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(exc)
 
     def set_event_callback(self, callback: Callable[[AnovaEvent], Coroutine[None, None, None]]) -> None:
         self.event_callback = callback
 
+    def set_close_callback(self, callback: Callable[[], Coroutine[None, None, None]]) -> None:
+        """
+        Set a callback to run when the connection is lost, rather than closed by calling `close`
+        :param callback: The callback function of the form `async def callback()`
+        """
+        self.close_callback = callback
+
     async def close(self) -> None:
-        if self.listen_task:
+        self.closed = True
+        # The close callback may close the connection from within the listening task, which must not await itself
+        if self.listen_task and self.listen_task is not asyncio.current_task():
             self.listen_task.cancel()
             try:
                 await self.listen_task
             except asyncio.CancelledError:
                 pass
 
+        self._fail_pending(ConnectionResetError("Connection closed"))
         self.writer.close()
         await self.writer.wait_closed()
         logger.info("Connection closed")
@@ -1,7 +1,9 @@
+import asyncio
 import logging
-from typing import Callable, Coroutine, Type, Optional, Any
+import time
+from typing import Callable, Coroutine, Type, Optional, Any, Dict, Iterable, Set, FrozenSet
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from commands import (
     AnovaCommand,
@@ -24,11 +26,22 @@ from commands import (
 )
 from .connection import AnovaConnection
 from .event import AnovaEvent, EventType
+from .history import TemperatureHistory, TemperatureSample
 
 logger = logging.getLogger(__name__)
 
 
+class DeviceStateDelta(BaseModel):
+    revision: int
+    changes: Dict[str, Any]
+
+
 class DeviceState(BaseModel):
+    """
+    The last known state of a device.
+    Assigning a field a different value bumps the state's revision, records it as that field's version and marks
+    the field dirty; assigning the value it already has is a no-op. `take_delta` collects the dirty fields.
+    """
     status: DeviceStatus = DeviceStatus.STOPPED
     current_temperature: float = 0.0
     target_temperature: float = 0.0
@@ -37,16 +50,85 @@ class DeviceState(BaseModel):
     unit: Optional[TemperatureUnit] = None
     speaker_status: bool = False
 
+    _revision: int = PrivateAttr(default=0)
+    _versions: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _dirty: Set[str] = PrivateAttr(default_factory=set)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in type(self).model_fields:
+            if getattr(self, name) == value:
+                return
+            super().__setattr__(name, value)
+            self._revision += 1
+            self._versions[name] = self._revision
+            self._dirty.add(name)
+        else:
+            super().__setattr__(name, value)
+
+    @property
+    def revision(self) -> int:
+        """Incremented on every field change."""
+        return self._revision
+
+    @property
+    def dirty(self) -> FrozenSet[str]:
+        """Fields changed since the last `take_delta`."""
+        return frozenset(self._dirty)
+
+    def field_version(self, name: str) -> int:
+        """The revision at which a field last changed, 0 if it never did."""
+        return self._versions.get(name, 0)
+
+    def take_delta(self) -> Optional[DeviceStateDelta]:
+        """
+        Collect the fields changed since the last call and clear their dirty bits
+        :return: The changed fields and their new values, or None if nothing changed
+        """
+        if not self._dirty:
+            return None
+        changes = self.model_dump(mode="json", include=self._dirty)
+        self._dirty.clear()
+        return DeviceStateDelta(revision=self._revision, changes=changes)
+
+
+# The command that refreshes each independently pollable part of the device state
+POLL_COMMANDS: Dict[str, Type[AnovaCommand]] = {
+    "status": GetDeviceStatus,
+    "target_temperature": GetTargetTemperature,
+    "current_temperature": GetCurrentTemperature,
+    "unit": GetTemperatureUnit,
+    "timer": GetTimerStatus,
+    "speaker_status": GetSpeakerStatus,
+}
+
+# The part of the state that a reply to each command brings up to date
+_REFRESHES: Dict[Type[AnovaCommand], str] = {
+    **{command: field for field, command in POLL_COMMANDS.items()},
+    SetTargetTemperature: "target_temperature",
+    SetTemperatureUnit: "unit",
+}
+
 
 class AnovaDevice:
     id_card: Optional[str]
     version: Optional[str]
     secret_key: Optional[str]
-    _state_change_callback: Optional[Callable[[str, DeviceState], Coroutine[None, None, None]]]
-    _state: DeviceState = DeviceState()
+    _state_change_callback: Optional[Callable[[str, DeviceState, DeviceStateDelta], Coroutine[None, None, None]]]
+    _state: DeviceState
     _event_callback: Optional[Callable[[str, AnovaEvent], Coroutine[None, None, None]]]
+    _sample_callback: Optional[Callable[[str, TemperatureSample], None]]
+    _refreshed: Dict[str, float]
 
     def __init__(self, connection: AnovaConnection):
+        self.id_card = None
+        self.version = None
+        self.secret_key = None
+        self._state = DeviceState()
+        self.history = TemperatureHistory()
+        self._state_change_callback = None
+        self._event_callback = None
+        self._sample_callback = None
+        self._refreshed = {}
         self.connection = connection
         self.connection.set_event_callback(self.handle_event)
 
@@ -54,7 +136,9 @@ class AnovaDevice:
     def state(self) -> DeviceState:
         return self._state
 
-    def add_state_change_callback(self, callback: Callable[[str, DeviceState], Coroutine[None, None, None]]) -> None:
+    def add_state_change_callback(
+            self, callback: Callable[[str, DeviceState, DeviceStateDelta], Coroutine[None, None, None]]
+    ) -> None:
         self._state_change_callback = callback
 
     def remove_state_change_callback(self) -> None:
@@ -66,11 +150,20 @@ class AnovaDevice:
     def remove_event_callback(self) -> None:
         self._event_callback = None
 
+    def add_sample_callback(self, callback: Callable[[str, TemperatureSample], None]) -> None:
+        """Call `callback(device_id, sample)` for every sample recorded in the history; it must not block."""
+        self._sample_callback = callback
+
+    def remove_sample_callback(self) -> None:
+        self._sample_callback = None
+
     async def perform_handshake(self) -> None:
         try:
-            self.id_card = await self.send_command(GetIDCard())
-            self.version = await self.send_command(GetVersion())
-            self.secret_key = await self.send_command(GetSecretKey())
+            self.id_card, self.version, self.secret_key = await asyncio.gather(
+                self.send_command(GetIDCard()),
+                self.send_command(GetVersion()),
+                self.send_command(GetSecretKey()),
+            )
 
             try:
                 await self.send_command(GetDeviceStatus())
@@ -86,12 +179,7 @@ class AnovaDevice:
     async def heartbeat(self) -> None:
         logger.debug("❤️Heartbeat -- start")
         try:
-            await self.send_command(GetDeviceStatus())
-            await self.send_command(GetTargetTemperature())
-            await self.send_command(GetCurrentTemperature())
-            await self.send_command(GetTemperatureUnit())
-            await self.send_command(GetTimerStatus())
-            await self.send_command(GetSpeakerStatus())
+            await self.snapshot()
         except ConnectionResetError as e:
             logger.error(f"Connection reset during heartbeat: {repr(e)}")
         except Exception as e:
@@ -99,13 +187,70 @@ class AnovaDevice:
             raise
         logger.debug("❤️Heartbeat -- end")
 
+    async def snapshot(self, fields: Iterable[str] = POLL_COMMANDS) -> DeviceState:
+        """
+        Refresh several parts of the device state in a single round trip.
+        All commands are written back-to-back and their replies gathered, then applied to the state in one go
+        (without yielding to the event loop in between), followed by at most one state change notification.
+        Snapshots that read the current temperature successfully are also recorded in `history`.
+        :param fields: Keys of `POLL_COMMANDS`, all of them by default
+        :return: The updated state
+        """
+        fields = list(fields)
+        commands = [POLL_COMMANDS[field]() for field in fields]
+        replies = await self.connection.send_commands([command.encode() for command in commands])
+
+        error: Optional[BaseException] = None
+        sampled = False
+        for command, reply in zip(commands, replies):
+            try:
+                if isinstance(reply, BaseException):
+                    raise reply
+                self._apply_response(type(command), command.decode(reply))
+                sampled = sampled or isinstance(command, GetCurrentTemperature)
+            except Exception as e:
+                error = error or e
+
+        if sampled:
+            sample = TemperatureSample(time.time(), self._state.current_temperature,
+                                       self._state.target_temperature, self._state.status)
+            self.history.append(*sample)
+            if self._sample_callback is not None and self.id_card is not None:
+                self._sample_callback(self.id_card, sample)
+        await self._notify_state_change()
+        if error:
+            raise error
+        return self.state
+
+    def state_age(self, field: str) -> Optional[float]:
+        """
+        How long ago part of the state was last read from (or set on) the device
+        :param field: A key of `POLL_COMMANDS`
+        :return: The age in seconds, or None if it never was
+        """
+        refreshed = self._refreshed.get(field)
+        return None if refreshed is None else time.monotonic() - refreshed
+
+    async def refresh(self, max_age: float, fields: Iterable[str] = POLL_COMMANDS) -> DeviceState:
+        """
+        Snapshot the parts of the state that are older than `max_age` seconds, if any
+        :param max_age: The oldest a part may be before it is read from the device again
+        :param fields: Keys of `POLL_COMMANDS`, all of them by default
+        :return: The state
+        """
+        stale = [field for field in fields if (age := self.state_age(field)) is None or age > max_age]
+        if stale:
+            await self.snapshot(stale)
+        return self.state
+
     async def send_command(self, command: AnovaCommand) -> Any:
         if not command.supports_wifi():
             raise ValueError(f"Command {command} does not support WiFi")
 
         response_data = await self.connection.send_command(command.encode())
         response = command.decode(response_data)
-        await self._update_state(type(command), response)
+        self._apply_response(type(command), response)
+        await self._notify_state_change()
         return response
 
     async def handle_event(self, event: AnovaEvent) -> None:
@@ -136,7 +281,9 @@ class AnovaDevice:
     async def get_id_card(self) -> str:
         return await self.send_command(GetIDCard())
 
-    async def _update_state(self, command_class: Type[AnovaCommand], response: Any) -> None:
+    def _apply_response(self, command_class: Type[AnovaCommand], response: Any) -> None:
+        if command_class in _REFRESHES:
+            self._refreshed[_REFRESHES[command_class]] = time.monotonic()
         if command_class == GetDeviceStatus:
             self._state.status = response
         elif command_class == GetCurrentTemperature:
@@ -153,13 +300,18 @@ class AnovaDevice:
             self._state.speaker_status = response
 
     async def _notify_state_change(self) -> None:
+        """Tell the state change callback about the fields that changed since the last notification, if any."""
         if self.id_card is None:
-            logger.warning("Device ID is None when notifying state change")
+            # Still handshaking; the changes stay dirty and go out with the first notification after it
             return
-        if self._state_change_callback is not None:
-            await self._state_change_callback(self.id_card, self.state)
+        delta = self._state.take_delta()
+        if delta is not None and self._state_change_callback is not None:
+            await self._state_change_callback(self.id_card, self.state, delta)
 
     async def close(self) -> None:
+        self.remove_state_change_callback()
+        self.remove_event_callback()
+        self.remove_sample_callback()
         await self.connection.close()
 
     async def start_cooking(self) -> bool:
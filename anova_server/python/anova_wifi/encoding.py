@@ -1,3 +1,67 @@
+import logging
+from operator import add
+from typing import List, Optional, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+HEADER = ord('h')
+SYN = 0x16
+
+# Byte i of the payload is rotated left by (i + 1) % 7 bits, so there are only seven distinct rotations.
+# `_ROTATE_TABLES` / `_REVERSE_ROTATE_TABLES` (built below `Encoder`) hold one 256 byte lookup table per rotation,
+# in the form `bytes.translate` expects.
+_ROTATIONS = 7
+# Offset of the table row used at each payload position when the seven tables are laid out back to back
+_ROW_OFFSETS = tuple(((i + 1) % _ROTATIONS) * 256 for i in range(256))
+# Below this many bytes a single lookup per byte beats seven strided `translate` calls
+_SHORT_PAYLOAD = 32
+# Below this many frames the scalar codec beats NumPy, whose fixed cost per call outweighs its per-frame savings
+# (measured break-even: about 24 frames to encode and 16 to 24 to decode; a heartbeat is 6)
+_MIN_NUMPY_BATCH = 24
+
+
+def _translate(payload: Union[bytes, memoryview], tables: Sequence[bytes], flat_table: bytes) -> bytes:
+    """Apply the position dependent rotation to a whole payload."""
+    if len(payload) <= _SHORT_PAYLOAD:
+        return bytes(map(flat_table.__getitem__, map(add, _ROW_OFFSETS, payload)))
+
+    result = bytearray(len(payload))
+    for offset in range(_ROTATIONS):
+        result[offset::_ROTATIONS] = bytes(payload[offset::_ROTATIONS]).translate(tables[(offset + 1) % _ROTATIONS])
+    return bytes(result)
+
+
+def _decode_frame(frame: Union[bytes, memoryview]) -> str:
+    """
+    Decode the frame at the start of `frame`, which is sized by its length byte; anything after its checksum (such as
+    a SYN separator) is ignored. A checksum byte that happens to equal SYN is still just the checksum.
+    """
+    header = frame[0]
+    if header != HEADER:
+        raise ValueError(f"Invalid header byte: {header:02X}")
+
+    length = frame[1]
+    if len(frame) < length + 3:  # header + length + payload + checksum
+        raise ValueError(f"Truncated frame: {len(frame)} bytes for a {length} byte payload")
+    payload = frame[2:2 + length]
+    checksum_byte = frame[2 + length]
+
+    calculated_checksum = sum(payload)
+    if checksum_byte != calculated_checksum & 0xFF:
+        raise ValueError(f"Checksum mismatch. Expected: {checksum_byte:02X}, Calculated: {calculated_checksum:02X}")
+
+    # Every decoded byte maps to exactly one character, which is what latin-1 does
+    decoded_message = _translate(payload, _REVERSE_ROTATE_TABLES, _REVERSE_ROTATE_FLAT).decode('latin-1')
+
+    # Remove trailing newline if present
+    return decoded_message.rstrip('\r')
+
+
 class Encoder:
     @staticmethod
     def encode(message: str) -> bytes:
@@ -11,29 +75,11 @@ class Encoder:
         if not message.endswith('\r'):
             message += '\r'
 
-        # Convert message to bytes
         message_bytes = message.encode('utf-8')
+        payload = _translate(message_bytes, _ROTATE_TABLES, _ROTATE_FLAT)
 
-        # Calculate length
-        length = len(message_bytes)
-
-        # Initialize result with header and length
-        result = bytearray([ord('h'), length])
-
-        # Initialize checksum
-        checksum = 0
-
-        # Process each byte of the message
-        for i, byte in enumerate(message_bytes):
-            n = (i + 1) % 7
-            encoded_byte = Encoder.roll_shift(byte, n)
-            result.append(encoded_byte)
-            checksum += encoded_byte
-
-        # Append checksum
-        result.append(checksum & 0xFF)
-
-        return bytes(result)
+        # header + length + payload + checksum
+        return bytes((HEADER, len(message_bytes))) + payload + bytes((sum(payload) & 0xFF,))
 
     @staticmethod
     def roll_shift(byte: int, n: int) -> int:
@@ -44,39 +90,222 @@ class Encoder:
         return (byte >> n) | ((byte & ((1 << n) - 1)) << (8 - n))
 
     @staticmethod
-    def decode(data: bytes) -> str:
+    def decode(data: Union[bytes, memoryview]) -> str:
         """
         Decodes bytes to a message.
         If the message ends with \r, it will be removed.
-        :param data: The data to decode
+        :param data: The data to decode, a frame optionally followed by a SYN byte
         :return: The decoded message as a string
         """
-        if data[-1:] == b'\x16':  # Remove SYN character if present
-            data = data[:-1]
+        return _decode_frame(data)
+
+    @staticmethod
+    def encode_many(messages: Sequence[str]) -> List[bytes]:
+        """
+        Encodes a batch of messages.
+        Uses NumPy to rotate all payloads in a single pass when it is installed and the batch is large enough to
+        benefit.
+        :param messages: The messages to encode
+        :return: The encoded messages, in the same order
+        """
+        if np is None or len(messages) < _MIN_NUMPY_BATCH:
+            return [Encoder.encode(message) for message in messages]
+
+        raw = [(m if m.endswith('\r') else m + '\r').encode('utf-8') for m in messages]
+        lengths = np.fromiter((len(r) for r in raw), dtype=np.intp, count=len(raw))
+        if lengths.max(initial=0) > 0xFF:
+            raise ValueError("bytes must be in range(0, 256)")
 
-        header = data[0]
-        if header != ord('h'):
-            raise ValueError(f"Invalid header byte: {header:02X}")
+        matrix, mask = _pack(raw, lengths)
+        encoded = np.where(mask, _NP_ROTATE[_np_positions(matrix.shape[1]), matrix], 0).astype(np.uint8)
+        checksums = encoded.sum(axis=1, dtype=np.uint64) & 0xFF
 
-        length = data[1]
+        result = []
+        for row, length, checksum in zip(encoded, lengths.tolist(), checksums.tolist()):
+            result.append(bytes((HEADER, length)) + row[:length].tobytes() + bytes((checksum,)))
+        return result
 
-        # Process all bytes except the very last one (which is likely a newline)
-        payload = data[2:2 + length + 1]  # header + length + payload + checksum
-        checksum_byte = payload[-1]  # The last byte of the payload is the checksum
+    @staticmethod
+    def decode_many(frames: Sequence[bytes]) -> List[str]:
+        """
+        Decodes a batch of frames.
+        Uses NumPy to validate and rotate all payloads in a single pass when it is installed and the batch is large
+        enough to benefit.
+        :param frames: The frames to decode, each optionally followed by a SYN byte
+        :return: The decoded messages, in the same order
+        :raises ValueError: If any frame has an invalid header or checksum
+        """
+        if np is None or len(frames) < _MIN_NUMPY_BATCH:
+            return [Encoder.decode(frame) for frame in frames]
+
+        payloads = []
+        checksums = []
+        for frame in frames:
+            if frame[0] != HEADER or len(frame) < frame[1] + 3:
+                # Let the scalar path raise the error for it
+                return [Encoder.decode(f) for f in frames]
+            payloads.append(frame[2:2 + frame[1]])
+            checksums.append(frame[2 + frame[1]])
+
+        lengths = np.fromiter((len(p) for p in payloads), dtype=np.intp, count=len(payloads))
+        matrix, mask = _pack(payloads, lengths)
+
+        calculated = np.where(mask, matrix, 0).sum(axis=1, dtype=np.uint64)
+        bad = np.flatnonzero((calculated & 0xFF) != np.asarray(checksums, dtype=np.uint64))
+        if bad.size:
+            i = int(bad[0])
+            raise ValueError(f"Checksum mismatch. Expected: {checksums[i]:02X}, Calculated: {int(calculated[i]):02X}")
+
+        decoded = _NP_REVERSE_ROTATE[_np_positions(matrix.shape[1]), matrix]
+        return [
+            row[:length].tobytes().decode('latin-1').rstrip('\r')
+            for row, length in zip(decoded, lengths.tolist())
+        ]
+
+
+class FrameDecoder:
+    """
+    Incremental decoder for the byte stream of a single connection.
+    TCP may coalesce several frames into one read or split a frame across reads, so incoming data is appended to a
+    reusable buffer and every complete frame in it is decoded in order. Incomplete trailing data is kept for the next
+    call, SYN separators are skipped, and corrupt frames are dropped by resynchronising on the next header byte.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    def __len__(self) -> int:
+        """Number of buffered bytes that do not form a complete frame yet."""
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> List[str]:
+        """
+        Add received data to the buffer and decode every complete frame in it.
+        Replies to pipelined commands tend to arrive together, so the complete frames are decoded as one batch; only
+        if one of them is corrupt are they decoded one at a time, to drop just the corrupt ones.
+        :param data: The bytes received from the connection
+        :return: The decoded messages, in the order they were received
+        """
+        self._buffer += data
+
+        with memoryview(self._buffer) as view:
+            frames, pos = self._split(view)
+            try:
+                messages = Encoder.decode_many([view[start:end] for start, end in frames])
+            except ValueError:
+                messages, pos = self._decode_each(view)
+
+        del self._buffer[:pos]
+        return messages
+
+    def reset(self) -> None:
+        """Discard any buffered partial frame."""
+        self._buffer.clear()
+
+    def _split(self, view: memoryview) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        Find the boundaries of the complete frames in the buffer, assuming none of them is corrupt.
+        :return: The start and end of every frame, and the position up to which the buffer was consumed
+        """
+        frames: List[Tuple[int, int]] = []
+        pos = 0
+        size = len(view)
+        while pos < size:
+            start = self._buffer.find(HEADER, pos)
+            if start < 0:
+                self._log_skipped(view[pos:size])
+                return frames, size
+            self._log_skipped(view[pos:start])
+
+            if start + 2 > size:
+                return frames, start
+            end = start + 2 + view[start + 1] + 1  # header + length + payload + checksum
+            if end > size:
+                resync = self._resync(view, start)
+                if resync is None:
+                    return frames, start
+                pos = resync
+                continue
+            frames.append((start, end))
+            pos = end
+        return frames, pos
+
+    def _decode_each(self, view: memoryview) -> Tuple[List[str], int]:
+        """
+        Decode the complete frames in the buffer one at a time, dropping corrupt ones.
+        :return: The decoded messages, and the position up to which the buffer was consumed
+        """
+        messages: List[str] = []
+        pos = 0
+        size = len(view)
+        while pos < size:
+            start = self._buffer.find(HEADER, pos)
+            if start < 0 or start + 2 > size:
+                return messages, size if start < 0 else start
+            end = start + 2 + view[start + 1] + 1
+            if end > size:
+                resync = self._resync(view, start)
+                if resync is None:
+                    return messages, start
+                pos = resync
+                continue
+
+            try:
+                messages.append(_decode_frame(view[start:end]))
+                pos = end
+            except ValueError as e:
+                logger.warning(f"Dropping corrupt frame: {e}")
+                # A SYN right behind the frame means its boundaries were right and only the content is bad,
+                # otherwise the header byte was bogus and the next one may start anywhere after it
+                pos = end if end == size or view[end] == SYN else start + 1
+        return messages, pos
+
+    def _resync(self, view: memoryview, start: int) -> Optional[int]:
+        """
+        Check whether the incomplete frame at `start` is really a bogus header byte, whose length byte could otherwise
+        hold up every frame behind it: it is when a complete, valid frame follows a SYN within the claimed length.
+        :return: Where that frame starts, or None to keep waiting for the rest of the frame at `start`
+        """
+        size = len(view)
+        syn = self._buffer.find(SYN, start + 2)
+        while 0 <= syn < size - 2:
+            candidate = syn + 1
+            end = candidate + 2 + view[candidate + 1] + 1
+            if view[candidate] == HEADER and end <= size:
+                try:
+                    _decode_frame(view[candidate:end])
+                except ValueError:
+                    pass
+                else:
+                    logger.warning(f"Dropping {candidate - start} bytes of a bogus frame: {view[start:candidate].hex()}")
+                    return candidate
+            syn = self._buffer.find(SYN, candidate)
+        return None
+
+    @staticmethod
+    def _log_skipped(skipped: memoryview) -> None:
+        if any(byte != SYN for byte in skipped):
+            logger.warning(f"Skipping {len(skipped)} bytes of unframed data: {skipped.hex()}")
 
-        chars = []
-        calculated_checksum = 0
 
-        for i, byte in enumerate(payload[:-1]):  # Exclude the checksum byte from processing
-            calculated_checksum += byte
-            n = (i + 1) % 7
-            decoded_byte = Encoder.reverse_roll_shift(byte, n)
-            chars.append(chr(decoded_byte))
+_ROTATE_TABLES = tuple(bytes(Encoder.roll_shift(b, n) for b in range(256)) for n in range(_ROTATIONS))
+_REVERSE_ROTATE_TABLES = tuple(bytes(Encoder.reverse_roll_shift(b, n) for b in range(256)) for n in range(_ROTATIONS))
+_ROTATE_FLAT = b''.join(_ROTATE_TABLES)
+_REVERSE_ROTATE_FLAT = b''.join(_REVERSE_ROTATE_TABLES)
 
-        if checksum_byte != calculated_checksum & 0xFF:
-            raise ValueError(f"Checksum mismatch. Expected: {checksum_byte:02X}, Calculated: {calculated_checksum:02X}")
+if np is not None:
+    _NP_ROTATE = np.frombuffer(_ROTATE_FLAT, dtype=np.uint8).reshape(_ROTATIONS, 256)
+    _NP_REVERSE_ROTATE = np.frombuffer(_REVERSE_ROTATE_FLAT, dtype=np.uint8).reshape(_ROTATIONS, 256)
 
-        decoded_message = ''.join(chars)
+    def _np_positions(width: int) -> "np.ndarray":
+        """Rotation amount for every column of a packed payload matrix."""
+        return (np.arange(1, width + 1) % _ROTATIONS)[np.newaxis, :]
 
-        # Remove trailing newline if present
-        return decoded_message.rstrip('\r')
+    def _pack(payloads: Sequence[bytes], lengths: "np.ndarray") -> "tuple[np.ndarray, np.ndarray]":
+        """Pack variable length payloads into a zero padded matrix plus a mask of the valid cells."""
+        width = int(lengths.max(initial=0))
+        flat = np.frombuffer(b''.join(payloads), dtype=np.uint8)
+        mask = np.arange(width)[np.newaxis, :] < lengths[:, np.newaxis]
+        matrix = np.zeros((len(payloads), width), dtype=np.uint8)
+        matrix[mask] = flat
+        return matrix, mask
@@ -0,0 +1,108 @@
+import math
+from array import array
+from typing import List, NamedTuple, Optional
+
+from commands import DeviceStatus
+
+HISTORY_SIZE = 4096  # samples per device, a few hours while cooking and over a day when idle
+
+_STATUSES = list(DeviceStatus)
+_STATUS_CODES = {status: code for code, status in enumerate(_STATUSES)}
+
+
+class TemperatureSample(NamedTuple):
+    timestamp: float
+    current_temperature: float
+    target_temperature: float
+    status: DeviceStatus
+
+
+class TemperatureHistory:
+    """
+    Fixed-size ring buffer of temperature samples.
+    Each column lives in its own preallocated `array`, so appending is O(1), memory use is bounded by the capacity,
+    and range queries binary-search the timestamps and read only the samples they return.
+    Samples are expected to be appended in timestamp order.
+    """
+
+    def __init__(self, capacity: int = HISTORY_SIZE):
+        if capacity < 1:
+            raise ValueError("History capacity must be at least 1")
+        self.capacity = capacity
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._current = array('d', bytes(8 * capacity))
+        self._target = array('d', bytes(8 * capacity))
+        self._status = array('B', bytes(capacity))
+        self._start = 0  # physical index of the oldest sample
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, timestamp: float, current_temperature: float, target_temperature: float,
+               status: DeviceStatus) -> None:
+        """Add a sample, overwriting the oldest one once the buffer is full."""
+        if self._size < self.capacity:
+            i = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            i = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._timestamps[i] = timestamp
+        self._current[i] = current_temperature
+        self._target[i] = target_temperature
+        self._status[i] = _STATUS_CODES[status]
+
+    def query(self, start: Optional[float] = None, end: Optional[float] = None,
+              max_points: Optional[int] = None) -> List[TemperatureSample]:
+        """
+        Get the samples in a time range, oldest first
+        :param start: Only samples at or after this timestamp
+        :param end: Only samples at or before this timestamp
+        :param max_points: Downsample by taking every n-th sample so that at most this many are returned
+        :return: The samples
+        """
+        lo = 0 if start is None else self._bisect_left(start)
+        hi = self._size if end is None else self._bisect_right(end)
+        if hi <= lo:
+            return []
+
+        step = 1
+        if max_points is not None:
+            if max_points < 1:
+                raise ValueError("max_points must be at least 1")
+            step = math.ceil((hi - lo) / max_points)
+        return [self._sample(j) for j in range(lo, hi, step)]
+
+    def latest(self) -> Optional[TemperatureSample]:
+        return self._sample(self._size - 1) if self._size else None
+
+    def oldest(self) -> Optional[TemperatureSample]:
+        return self._sample(0) if self._size else None
+
+    def _physical(self, logical: int) -> int:
+        return (self._start + logical) % self.capacity
+
+    def _sample(self, logical: int) -> TemperatureSample:
+        i = self._physical(logical)
+        return TemperatureSample(self._timestamps[i], self._current[i], self._target[i], _STATUSES[self._status[i]])
+
+    def _bisect_left(self, timestamp: float) -> int:
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamps[self._physical(mid)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _bisect_right(self, timestamp: float) -> int:
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamps[self._physical(mid)] <= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
@@ -1,29 +1,44 @@
-import asyncio
 import logging
+import time
+from functools import partial
 from typing import Dict, List, Callable, Coroutine, Any, Optional
 
-from .connection import AnovaConnection
-from .device import AnovaDevice, DeviceState
+from .connection import AnovaConnection, PIPELINE_DEPTH
+from .device import AnovaDevice, DeviceState, DeviceStateDelta
 from .event import AnovaEvent
+from .scheduler import HeartbeatScheduler
 from .server import AnovaServer
+from .telemetry import TelemetryLog
 
 logger = logging.getLogger(__name__)
 
-HEARTBEAT_INTERVAL = 3  # seconds
-
 
 class AnovaManager:
     server: AnovaServer
-    devices: Dict[str, AnovaDevice] = {}
-    _monitoring_tasks: Dict[str, asyncio.Task[None]] = {}
-
-    device_connected_callbacks: List[Optional[Callable[[AnovaDevice], Coroutine[None, None, None]]]] = []
-    device_disconnected_callbacks: Dict[str, Optional[Callable[[str], Coroutine[None, None, None]]]] = {}
-    device_state_change_callbacks: Dict[str, Optional[Callable[[str, DeviceState], Coroutine[None, None, None]]]] = {}
-    device_event_callbacks: Dict[str, Optional[Callable[[str, AnovaEvent], Coroutine[None, None, None]]]] = {}
-
-    def __init__(self, host: str = "0.0.0.0", port: int = 8080):
-        self.server = AnovaServer(host, port)
+    devices: Dict[str, AnovaDevice]
+    scheduler: HeartbeatScheduler
+    telemetry: Optional[TelemetryLog]
+    generation: int
+
+    device_connected_callbacks: List[Optional[Callable[[AnovaDevice], Coroutine[None, None, None]]]]
+    device_disconnected_callbacks: Dict[str, Optional[Callable[[str], Coroutine[None, None, None]]]]
+    device_state_change_callbacks: Dict[
+        str, Optional[Callable[[str, DeviceState, DeviceStateDelta], Coroutine[None, None, None]]]
+    ]
+    device_event_callbacks: Dict[str, Optional[Callable[[str, AnovaEvent], Coroutine[None, None, None]]]]
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080, pipeline_depth: int = PIPELINE_DEPTH,
+                 telemetry: Optional[TelemetryLog] = None):
+        self.server = AnovaServer(host, port, pipeline_depth)
+        self.devices = {}
+        self.scheduler = HeartbeatScheduler(self._handle_poll_error)
+        self.telemetry = telemetry
+        self.generation = 0  # bumped whenever a device connects, disconnects or changes state
+
+        self.device_connected_callbacks = []
+        self.device_disconnected_callbacks = {}
+        self.device_state_change_callbacks = {}
+        self.device_event_callbacks = {}
 
     async def start(self) -> None:
         """
@@ -31,6 +46,9 @@ class AnovaManager:
         :return:
         """
         self.server.on_connection(self._handle_new_connection)
+        self.scheduler.start()
+        if self.telemetry:
+            self.telemetry.start()
         await self.server.start()
         logger.info(f"AsyncAnovaManager started on {self.server.host}:{self.server.port}")
 
@@ -39,25 +57,25 @@ class AnovaManager:
         Stop the AnovaManager and close all devices
         :return:
         """
-        await self._stop_all_monitoring_tasks()
+        await self.scheduler.stop()
         await self._close_all_devices()
         await self.server.stop()
+        if self.telemetry:
+            await self.telemetry.stop()
 
-        logger.info("AsyncAnovaManager stopped")
+        self.device_connected_callbacks.clear()
+        self.device_disconnected_callbacks.clear()
+        self.device_state_change_callbacks.clear()
+        self.device_event_callbacks.clear()
 
-    async def _stop_all_monitoring_tasks(self) -> None:
-        for device_id, task in self._monitoring_tasks.items():
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                pass
-        self._monitoring_tasks.clear()
+        logger.info("AsyncAnovaManager stopped")
 
     async def _close_all_devices(self) -> None:
-        for device in self.devices.values():
-            await device.close()
+        # Cleared first, as a cooker hanging up meanwhile drops its device from `devices` through the close callback
+        devices = list(self.devices.values())
         self.devices.clear()
+        for device in devices:
+            await device.close()
 
     def get_devices(self) -> List[AnovaDevice]:
         """
@@ -74,6 +92,13 @@ class AnovaManager:
         """
         return self.devices.get(device_id)
 
+    def get_command_rates(self) -> Dict[str, float]:
+        """
+        Get the rate at which commands are sent to each device
+        :return: Commands per second, by device ID
+        """
+        return self.scheduler.command_rates()
+
     def on_device_connected(self, callback: Callable[[AnovaDevice], Coroutine[Any, Any, None]]) -> int:
         """
         Register a callback for when a new device is connected
@@ -109,11 +134,14 @@ class AnovaManager:
         self.device_disconnected_callbacks[device_id] = None
 
     def on_device_state_change(self, device_id: str,
-                               callback: Callable[[str, DeviceState], Coroutine[Any, Any, None]]) -> None:
+                               callback: Callable[[str, DeviceState, DeviceStateDelta], Coroutine[Any, Any, None]]
+                               ) -> None:
         """
         Register a callback for when a device's state changes
+        Only called when at least one field actually changed; `delta` holds just the changed fields.
         :param device_id: The device ID (use "*" for all devices)
-        :param callback: The callback function of the form `async def callback(device_id: str, state: DeviceState)`
+        :param callback: The callback function of the form
+            `async def callback(device_id: str, state: DeviceState, delta: DeviceStateDelta)`
         :return:
         """
         self.device_state_change_callbacks[device_id] = callback
@@ -156,10 +184,14 @@ class AnovaManager:
             await self._handle_device_disconnection(device_id)
 
         self.devices[device_id] = device
+        self.generation += 1
         device.add_state_change_callback(self._handle_device_state_change)
         device.add_event_callback(self._handle_device_event)
+        device.connection.set_close_callback(partial(self._handle_connection_lost, device))
+        if self.telemetry:
+            device.add_sample_callback(self.telemetry.record_sample)
 
-        self._monitoring_tasks[device_id] = asyncio.create_task(self._monitor_device(device))
+        self.scheduler.add(device_id, device)
 
         logger.info(f"New device connected: {device}")
 
@@ -167,30 +199,24 @@ class AnovaManager:
             if callback:
                 await callback(device)
 
-    async def _monitor_device(self, device: AnovaDevice) -> None:
-        while True:
-            try:
-                await device.heartbeat()
-                await asyncio.sleep(HEARTBEAT_INTERVAL)
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                if device.id_card is None:
-                    logger.error(f"Device ID is None, closing connection: {e}")
-                    await device.close()
-                    break
-                logger.error(f"Error monitoring device {device.id_card}: {e}")
-                await self._handle_device_disconnection(device.id_card)
-                raise
+    async def _handle_poll_error(self, device_id: str, error: Exception) -> None:
+        logger.error(f"Error monitoring device {device_id}: {error!r}")
+        await self._handle_device_disconnection(device_id)
+
+    async def _handle_connection_lost(self, device: AnovaDevice) -> None:
+        # A cooker that reconnected has already replaced this device under the same ID
+        device_id = device.id_card
+        if device_id is not None and self.devices.get(device_id) is device:
+            logger.warning(f"Lost connection to device {device_id}")
+            await self._handle_device_disconnection(device_id)
 
     async def _handle_device_disconnection(self, device_id: str) -> None:
         if device_id in self.devices:
             device = self.devices.pop(device_id)
+            self.generation += 1
             logger.info(f"Device disconnected: {device}")
 
-            if device_id in self._monitoring_tasks:
-                self._monitoring_tasks[device_id].cancel()
-                del self._monitoring_tasks[device_id]
+            self.scheduler.remove(device_id)
 
             await device.close()
             await self._handle_callback(device_id, self.device_disconnected_callbacks, device_id)
@@ -202,10 +228,14 @@ class AnovaManager:
             if device_id in self.device_event_callbacks:
                 del self.device_event_callbacks[device_id]
 
-    async def _handle_device_state_change(self, device_id: str, state: DeviceState) -> None:
-        await self._handle_callback(device_id, self.device_state_change_callbacks, device_id, state)
+    async def _handle_device_state_change(self, device_id: str, state: DeviceState, delta: DeviceStateDelta) -> None:
+        self.generation += 1
+        await self._handle_callback(device_id, self.device_state_change_callbacks, device_id, state, delta)
 
     async def _handle_device_event(self, device_id: str, event: AnovaEvent) -> None:
+        self.scheduler.handle_event(device_id, event)
+        if self.telemetry:
+            self.telemetry.record_event(device_id, time.time(), event)
         await self._handle_callback(device_id, self.device_event_callbacks, device_id, event)
 
     @staticmethod
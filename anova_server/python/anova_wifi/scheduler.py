@@ -0,0 +1,190 @@
+import asyncio
+import logging
+from typing import Callable, Coroutine, Dict, Iterable, List, Optional, Set, Tuple
+
+from commands import DeviceStatus
+from .device import AnovaDevice, DeviceState, POLL_COMMANDS
+from .event import AnovaEvent, EventType
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 3  # seconds, the fastest any field is polled
+WHEEL_TICK = 0.5  # seconds per wheel slot
+WHEEL_SLOTS = 128
+
+# How far the current temperature may be from the target before the cooker counts as heating
+HEATING_THRESHOLD = 0.5
+
+# Fields worth refreshing right away after an event, on top of what the event itself tells us
+EVENT_REFRESH: Dict[EventType, Tuple[str, ...]] = {
+    EventType.START: ("status", "current_temperature"),
+    EventType.STOP: ("status",),
+    EventType.LOW_WATER: ("status",),
+    EventType.TEMP_REACHED: ("current_temperature",),
+    EventType.ChangeParam: ("status", "target_temperature", "unit", "timer"),
+    EventType.TIME_START: ("timer",),
+    EventType.TIME_STOP: ("timer",),
+    EventType.TIME_FINISH: ("timer", "status"),
+}
+
+
+def poll_interval(field: str, state: DeviceState) -> float:
+    """
+    Default poll policy: how long until `field` should be read again, given the latest state.
+    Fields that only change through API calls (which update the state themselves) or through pushed events are
+    polled slowly as a safety net; the current temperature is followed closely while the cooker is heating.
+    """
+    running = state.status == DeviceStatus.RUNNING
+    if field == "current_temperature":
+        if running and abs(state.target_temperature - state.current_temperature) > HEATING_THRESHOLD:
+            return HEARTBEAT_INTERVAL
+        return 10 if running else 30
+    if field == "timer":
+        return 10 if state.timer_running else 60
+    if field == "status":
+        return 10 if running else 30
+    if field == "target_temperature":
+        return 30
+    return 60
+
+
+class HeartbeatScheduler:
+    """
+    Polls every connected device from a single task.
+    Each (device, field) pair has a due tick on a hashed timer wheel; every tick the due fields are collected per
+    device and polled together, after which each field is rescheduled according to the poll policy. Events and
+    explicit requests can pull a field forward with `poke`.
+    """
+    devices: Dict[str, AnovaDevice]
+    _wheel: List[List[Tuple[int, str, str]]]
+    _due: Dict[Tuple[str, str], int]
+    _polling: Dict[str, asyncio.Task[None]]
+    _task: Optional[asyncio.Task[None]]
+
+    def __init__(
+            self,
+            on_error: Callable[[str, Exception], Coroutine[None, None, None]],
+            policy: Callable[[str, DeviceState], float] = poll_interval,
+            tick: float = WHEEL_TICK,
+            slots: int = WHEEL_SLOTS,
+    ):
+        self.on_error = on_error
+        self.policy = policy
+        self.tick = tick
+        self.devices = {}
+        self._wheel = [[] for _ in range(slots)]
+        self._now = 0
+        self._due = {}
+        self._polling = {}
+        self._task = None
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        tasks = list(self._polling.values())
+        if self._task:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._polling.clear()
+
+    def add(self, device_id: str, device: AnovaDevice) -> None:
+        """
+        Start polling a device; every field is polled on the next tick
+        :param device_id: The device ID
+        :param device: The device
+        :return:
+        """
+        self.devices[device_id] = device
+        self.poke(device_id, POLL_COMMANDS.keys())
+
+    def remove(self, device_id: str) -> None:
+        """
+        Stop polling a device
+        :param device_id: The device ID
+        :return:
+        """
+        self.devices.pop(device_id, None)
+        for field in POLL_COMMANDS:
+            self._due.pop((device_id, field), None)
+        task = self._polling.pop(device_id, None)
+        if task and task is not asyncio.current_task():
+            task.cancel()
+
+    def poke(self, device_id: str, fields: Iterable[str]) -> None:
+        """
+        Poll fields of a device on the next tick, regardless of when they were due
+        :param device_id: The device ID
+        :param fields: Keys of `POLL_COMMANDS`
+        :return:
+        """
+        for field in fields:
+            self._schedule(device_id, field, 1)
+
+    def handle_event(self, device_id: str, event: AnovaEvent) -> None:
+        self.poke(device_id, EVENT_REFRESH.get(event.type, ()))
+
+    def command_rates(self) -> Dict[str, float]:
+        """Commands per second sent to each device, by device ID."""
+        return {device_id: device.connection.command_rate for device_id, device in self.devices.items()}
+
+    def _schedule(self, device_id: str, field: str, ticks: int) -> None:
+        due = self._now + max(1, ticks)
+        self._due[(device_id, field)] = due
+        self._wheel[due % len(self._wheel)].append((due, device_id, field))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while True:
+            # Sleep until the next tick boundary, so slow ticks do not make the wheel drift
+            await asyncio.sleep(max(0.0, start + (self._now + 1) * self.tick - loop.time()))
+            self._now += 1
+            self._advance()
+
+    def _advance(self) -> None:
+        slot = self._now % len(self._wheel)
+        bucket = self._wheel[slot]
+        self._wheel[slot] = []
+
+        due_fields: Dict[str, Set[str]] = {}
+        for entry in bucket:
+            due, device_id, field = entry
+            if due > self._now:
+                self._wheel[slot].append(entry)  # comes around again on a later rotation
+            elif self._due.get((device_id, field)) == due:  # otherwise it was rescheduled or removed
+                del self._due[(device_id, field)]
+                due_fields.setdefault(device_id, set()).add(field)
+
+        for device_id, fields in due_fields.items():
+            if device_id in self._polling:
+                # The previous poll hasn't finished yet, try again on the next tick
+                for field in fields:
+                    self._schedule(device_id, field, 1)
+            else:
+                self._polling[device_id] = asyncio.create_task(self._poll(device_id, fields))
+
+    async def _poll(self, device_id: str, fields: Set[str]) -> None:
+        device = self.devices.get(device_id)
+        if device is None:
+            return
+        try:
+            await device.snapshot(fields)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error polling device {device_id}: {e!r}")
+            self._polling.pop(device_id, None)
+            await self.on_error(device_id, e)
+            return
+
+        self._polling.pop(device_id, None)
+        if self.devices.get(device_id) is not device:
+            return
+        for field in fields:
+            if (device_id, field) not in self._due:  # not poked while we were polling
+                self._schedule(device_id, field, round(self.policy(field, device.state) / self.tick))
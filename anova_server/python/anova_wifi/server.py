@@ -2,7 +2,7 @@ import asyncio
 import logging
 from typing import Callable, Coroutine
 
-from .connection import AnovaConnection
+from .connection import AnovaConnection, PIPELINE_DEPTH
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -15,9 +15,10 @@ class AnovaServer:
     server: asyncio.Server
     connection_callback: Callable[[AnovaConnection], Coroutine[None, None, None]]
 
-    def __init__(self, host: str = "0.0.0.0", port: int = 8080):
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080, pipeline_depth: int = PIPELINE_DEPTH):
         self.host = host
         self.port = port
+        self.pipeline_depth = pipeline_depth
 
     async def start(self) -> None:
         self.server = await asyncio.start_server(
@@ -37,7 +38,7 @@ class AnovaServer:
         self.connection_callback = callback
 
     async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
-        connection = AnovaConnection(reader, writer)
+        connection = AnovaConnection(reader, writer, self.pipeline_depth)
         logger.info(f'New connection from {writer.transport.get_extra_info("peername")}')
         connection.start_listening()
         if self.connection_callback:  # type: ignore
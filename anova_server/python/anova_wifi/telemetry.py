@@ -0,0 +1,324 @@
+import asyncio
+import bisect
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+from commands import DeviceStatus
+from .event import AnovaEvent, EventType, EventOriginator
+from .history import TemperatureSample
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_RECORDS = 65536  # records per segment file, a few days of samples for a cooking device
+INDEX_INTERVAL = 256  # records between entries of the sparse time index
+QUEUE_SIZE = 10000  # records waiting to be written before new ones are dropped
+
+# Fixed-width little-endian records, each starting with its timestamp
+_SAMPLE = struct.Struct("<dddB7x")  # timestamp, current temperature, target temperature, status
+_EVENT = struct.Struct("<dBB6x")  # timestamp, event type, originator
+_TIMESTAMP = struct.Struct("<d")
+
+# Codes stored on disk. They must never change or be reused, so members added to the enums get new codes here
+# instead of depending on their declaration order.
+_STATUS_CODES = {
+    DeviceStatus.RUNNING: 0,
+    DeviceStatus.STOPPED: 1,
+    DeviceStatus.LOW_WATER: 2,
+    DeviceStatus.HEATER_ERROR: 3,
+    DeviceStatus.POWER_LOSS: 4,
+    DeviceStatus.USER_CHANGE_PARAMETER: 5,
+}
+_STATUSES = {code: status for status, code in _STATUS_CODES.items()}
+_EVENT_TYPE_CODES = {
+    EventType.TEMP_REACHED: 0,
+    EventType.LOW_WATER: 1,
+    EventType.START: 2,
+    EventType.STOP: 3,
+    EventType.CHANGE_TEMP: 4,
+    EventType.TIME_START: 5,
+    EventType.TIME_STOP: 6,
+    EventType.TIME_FINISH: 7,
+    EventType.ChangeParam: 8,
+}
+_EVENT_TYPES = {code: kind for kind, code in _EVENT_TYPE_CODES.items()}
+_ORIGINATOR_CODES = {
+    EventOriginator.WIFI: 0,
+    EventOriginator.BLE: 1,
+    EventOriginator.Device: 2,
+}
+_ORIGINATORS = {code: originator for originator, code in _ORIGINATOR_CODES.items()}
+
+_SEGMENT_SUFFIX = ".seg"
+
+Record = Tuple[Union[int, float], ...]
+
+
+class _Segment:
+    def __init__(self, path: str, records: int = 0):
+        self.path = path
+        self.records = records
+        self.first_timestamp = math.inf
+        # Timestamp of every INDEX_INTERVAL-th record, None until the segment is first read
+        self.index: Optional[List[float]] = None
+
+
+class _Stream:
+    """
+    One append-only series of fixed-width records, split over numbered segment files.
+    Appends only ever touch the newest segment. Reads map just the segments overlapping the requested range and
+    use the sparse index to find where the range starts without scanning.
+    All methods block and are meant to run in a worker thread.
+    """
+
+    def __init__(self, directory: str, record: struct.Struct, segment_records: int):
+        self.directory = directory
+        self.record = record
+        self.segment_records = segment_records
+        self._lock = threading.Lock()
+        self._file: Optional[BinaryIO] = None
+        self._segments: List[_Segment] = []
+
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(n for n in os.listdir(directory) if n.endswith(_SEGMENT_SUFFIX)):
+            path = os.path.join(directory, name)
+            segment = _Segment(path, os.path.getsize(path) // record.size)
+            if segment.records:
+                with open(path, "rb") as f:
+                    segment.first_timestamp = _TIMESTAMP.unpack(f.read(_TIMESTAMP.size))[0]
+            self._segments.append(segment)
+
+    def append(self, records: List[bytes]) -> None:
+        with self._lock:
+            if self._file is None and self._segments and self._segments[-1].records < self.segment_records:
+                self._reopen(self._segments[-1])
+            for data in records:
+                if self._file is None or self._segments[-1].records >= self.segment_records:
+                    self._roll()
+                assert self._file
+                segment = self._segments[-1]
+                timestamp = _TIMESTAMP.unpack_from(data)[0]
+                if segment.records == 0:
+                    segment.first_timestamp = timestamp
+                if segment.index is not None and segment.records % INDEX_INTERVAL == 0:
+                    segment.index.append(timestamp)
+                self._file.write(data)
+                segment.records += 1
+            if self._file:
+                self._file.flush()
+
+    def _reopen(self, segment: _Segment) -> None:
+        # Drop a partially written record left behind by a crash, so records stay aligned
+        with open(segment.path, "r+b") as f:
+            f.truncate(segment.records * self.record.size)
+        self._file = open(segment.path, "ab")
+
+    def _roll(self) -> None:
+        if self._file:
+            self._file.close()
+        number = int(os.path.basename(self._segments[-1].path)[:-len(_SEGMENT_SUFFIX)]) + 1 if self._segments else 0
+        segment = _Segment(os.path.join(self.directory, f"{number:08d}{_SEGMENT_SUFFIX}"))
+        segment.index = []
+        self._segments.append(segment)
+        self._file = open(segment.path, "ab")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def read(self, start: Optional[float], end: Optional[float], max_points: Optional[int] = None) -> List[Record]:
+        """
+        Read the records in a time range, oldest first, taking every n-th record to return at most `max_points`.
+        Only the records returned, plus a few timestamps for the binary search, are read from the mapped files.
+        """
+        with self._lock:
+            selected: List[Tuple[_Segment, int, List[float]]] = []
+            for i, segment in enumerate(self._segments):
+                next_first = self._segments[i + 1].first_timestamp if i + 1 < len(self._segments) else math.inf
+                if segment.records == 0 or (end is not None and segment.first_timestamp > end) or \
+                        (start is not None and next_first < start):
+                    continue
+                if segment.index is None:
+                    segment.index = self._build_index(segment)
+                selected.append((segment, segment.records, segment.index))
+
+        ranges: List[Tuple[mmap.mmap, int, int]] = []
+        try:
+            for segment, records, index in selected:
+                with open(segment.path, "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), records * self.record.size, access=mmap.ACCESS_READ)
+                lo = 0 if start is None else self._bisect(mapped, index, records, start, right=False)
+                hi = records if end is None else self._bisect(mapped, index, records, end, right=True)
+                ranges.append((mapped, lo, hi))
+
+            total = sum(max(0, hi - lo) for _, lo, hi in ranges)
+            step = max(1, math.ceil(total / max_points)) if max_points else 1
+            result = []
+            offset = 0  # where the next record to take lies, relative to the start of the current range
+            for mapped, lo, hi in ranges:
+                if hi <= lo:
+                    continue
+                for r in range(lo + offset, hi, step):
+                    result.append(self.record.unpack_from(mapped, r * self.record.size))
+                offset = (offset - (hi - lo)) % step
+            return result
+        finally:
+            for mapped, _, _ in ranges:
+                mapped.close()
+
+    def _build_index(self, segment: _Segment) -> List[float]:
+        with open(segment.path, "rb") as f:
+            with mmap.mmap(f.fileno(), segment.records * self.record.size, access=mmap.ACCESS_READ) as mapped:
+                return [_TIMESTAMP.unpack_from(mapped, r * self.record.size)[0]
+                        for r in range(0, segment.records, INDEX_INTERVAL)]
+
+    def _bisect(self, mapped: mmap.mmap, index: List[float], records: int, timestamp: float, right: bool) -> int:
+        # The sparse index narrows the search down to one block of INDEX_INTERVAL records
+        block = (bisect.bisect_right(index, timestamp) if right else bisect.bisect_left(index, timestamp)) - 1
+        lo = min(records, max(0, block * INDEX_INTERVAL))
+        hi = min(records, (block + 1) * INDEX_INTERVAL + 1)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            ts = _TIMESTAMP.unpack_from(mapped, mid * self.record.size)[0]
+            if ts < timestamp or (right and ts == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+class TelemetryLog:
+    """
+    Durable, append-only log of per-device temperature samples and events.
+    Every device gets a directory with one stream of fixed-width records for samples and one for events.
+    Recording only queues the record; a background task writes whatever is queued in batches from a worker thread,
+    so disk I/O never blocks the event loop. Queries also run in a worker thread, on memory-mapped segments.
+    """
+
+    def __init__(self, directory: str, segment_records: int = SEGMENT_RECORDS):
+        self.directory = directory
+        self.segment_records = segment_records
+        self._streams: Dict[Tuple[str, str], _Stream] = {}
+        self._streams_lock = threading.Lock()
+        self._queue: asyncio.Queue[Tuple[str, str, bytes]] = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._task: Optional[asyncio.Task[None]] = None
+        self._stopping = False
+        self._writing = False  # a batch is being written by a worker thread
+
+    def start(self) -> None:
+        if not self._task:
+            self._stopping = False
+            self._task = asyncio.create_task(self._write_loop())
+
+    async def stop(self) -> None:
+        """Write everything still queued and close the segment files."""
+        if self._task:
+            self._stopping = True
+            # Cancelling is only safe while the loop waits for records: a cancelled batch would still be written by
+            # its thread, possibly after the files were closed. The loop finishes that batch and then exits by itself.
+            if not self._writing:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush([])
+        with self._streams_lock:
+            for stream in self._streams.values():
+                stream.close()
+
+    def record_sample(self, device_id: str, sample: TemperatureSample) -> None:
+        self._enqueue(device_id, "samples", _SAMPLE.pack(
+            sample.timestamp, sample.current_temperature, sample.target_temperature, _STATUS_CODES[sample.status]
+        ))
+
+    def record_event(self, device_id: str, timestamp: float, event: AnovaEvent) -> None:
+        self._enqueue(device_id, "events", _EVENT.pack(
+            timestamp, _EVENT_TYPE_CODES[event.type], _ORIGINATOR_CODES[event.originator]
+        ))
+
+    async def query_samples(self, device_id: str, start: Optional[float] = None, end: Optional[float] = None,
+                            max_points: Optional[int] = None) -> List[TemperatureSample]:
+        """
+        Get the logged samples of a device in a time range, oldest first
+        :param device_id: The device ID
+        :param start: Only samples at or after this timestamp
+        :param end: Only samples at or before this timestamp
+        :param max_points: Downsample by taking every n-th sample so that at most this many are returned
+        :return: The samples
+        """
+        if max_points is not None and max_points < 1:
+            raise ValueError("max_points must be at least 1")
+        records = await asyncio.to_thread(self._read, device_id, "samples", start, end, max_points)
+        return [TemperatureSample(float(ts), float(current), float(target), _STATUSES[int(status)])
+                for ts, current, target, status in records]
+
+    async def query_events(self, device_id: str, start: Optional[float] = None,
+                           end: Optional[float] = None) -> List[Tuple[float, AnovaEvent]]:
+        """
+        Get the logged events of a device in a time range, oldest first
+        :param device_id: The device ID
+        :param start: Only events at or after this timestamp
+        :param end: Only events at or before this timestamp
+        :return: Pairs of timestamp and event
+        """
+        records = await asyncio.to_thread(self._read, device_id, "events", start, end, None)
+        return [(float(ts), AnovaEvent(type=_EVENT_TYPES[int(kind)], originator=_ORIGINATORS[int(originator)]))
+                for ts, kind, originator in records]
+
+    def _enqueue(self, device_id: str, kind: str, data: bytes) -> None:
+        try:
+            self._queue.put_nowait((device_id, kind, data))
+        except asyncio.QueueFull:
+            logger.warning(f"Telemetry queue full, dropping {kind} record of device {device_id}")
+
+    async def _write_loop(self) -> None:
+        while not self._stopping:
+            item = await self._queue.get()
+            self._writing = True
+            try:
+                await self._flush([item])
+            finally:
+                self._writing = False
+
+    async def _flush(self, items: List[Tuple[str, str, bytes]]) -> None:
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        batches: Dict[Tuple[str, str], List[bytes]] = {}
+        for device_id, kind, data in items:
+            batches.setdefault((device_id, kind), []).append(data)
+        if batches:
+            try:
+                await asyncio.to_thread(self._write, batches)
+            except OSError as e:
+                logger.error(f"Failed to write telemetry: {e}")
+
+    def _write(self, batches: Dict[Tuple[str, str], List[bytes]]) -> None:
+        for (device_id, kind), records in batches.items():
+            self._stream(device_id, kind).append(records)
+
+    def _read(self, device_id: str, kind: str, start: Optional[float], end: Optional[float],
+              max_points: Optional[int]) -> List[Record]:
+        if (device_id, kind) not in self._streams and not os.path.isdir(self._stream_directory(device_id, kind)):
+            return []
+        return self._stream(device_id, kind).read(start, end, max_points)
+
+    def _stream(self, device_id: str, kind: str) -> _Stream:
+        with self._streams_lock:
+            stream = self._streams.get((device_id, kind))
+            if stream is None:
+                record = _SAMPLE if kind == "samples" else _EVENT
+                stream = _Stream(self._stream_directory(device_id, kind), record, self.segment_records)
+                self._streams[(device_id, kind)] = stream
+            return stream
+
+    def _stream_directory(self, device_id: str, kind: str) -> str:
+        # Hex keeps every device ID distinct, even on case-insensitive file systems, and can never form a path like ".."
+        return os.path.join(self.directory, device_id.encode().hex(), kind)
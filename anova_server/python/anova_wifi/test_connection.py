@@ -0,0 +1,174 @@
+import asyncio
+import time
+from typing import List
+
+import pytest
+
+from . import connection as connection_module
+from .event import AnovaEvent, EventType
+from .testing import FakeCooker, RESPONSES, connect, disconnect
+
+
+def test_replies_are_matched_in_order() -> None:
+    async def run() -> None:
+        cooker = FakeCooker(delay=0.01)
+        connection, server = await connect(cooker)
+        commands = ["status", "read set temp", "read temp", "read unit", "read timer", "speaker status"]
+        replies = await asyncio.gather(*(connection.send_command(c) for c in commands))
+        assert replies == [RESPONSES[c] for c in commands]
+        assert connection.in_flight == 0
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
+
+
+def test_independent_commands_share_round_trips() -> None:
+    async def run() -> None:
+        delay = 0.1
+        cooker = FakeCooker(delay=delay)
+        connection, server = await connect(cooker, pipeline_depth=6)
+
+        start = time.monotonic()
+        await asyncio.gather(*(connection.send_command(c) for c in ["read temp", "read unit", "read timer"]))
+        elapsed = time.monotonic() - start
+
+        assert cooker.max_outstanding == 3
+        assert elapsed < 2 * delay
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
+
+
+def test_pipeline_depth_is_respected() -> None:
+    async def run() -> None:
+        cooker = FakeCooker(delay=0.02)
+        connection, server = await connect(cooker, pipeline_depth=2)
+        await asyncio.gather(*(connection.send_command("read temp") for _ in range(7)))
+        assert cooker.max_outstanding == 2
+        assert len(cooker.received) == 7
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
+
+
+def test_invalid_command_fails_only_that_command() -> None:
+    async def run() -> None:
+        cooker = FakeCooker(delay=0.01)
+        connection, server = await connect(cooker)
+        bad, good = await asyncio.gather(
+            connection.send_command("bogus"), connection.send_command("read temp"), return_exceptions=True
+        )
+        assert isinstance(bad, ValueError)
+        assert good == RESPONSES["read temp"]
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
+
+
+def test_event_and_response_in_one_segment() -> None:
+    async def run() -> None:
+        cooker = FakeCooker(answer=False)
+        connection, server = await connect(cooker)
+        events: List[AnovaEvent] = []
+
+        async def on_event(event: AnovaEvent) -> None:
+            events.append(event)
+
+        connection.set_event_callback(on_event)
+
+        pending = asyncio.create_task(connection.send_command("read temp"))
+        while not cooker.received:
+            await asyncio.sleep(0.001)
+        cooker.send("event wifi stop", "28.6")
+
+        assert await pending == "28.6"
+        assert [e.type for e in events] == [EventType.STOP]
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
+
+
+def test_close_fails_outstanding_commands() -> None:
+    async def run() -> None:
+        cooker = FakeCooker(answer=False)
+        connection, server = await connect(cooker)
+        pending = asyncio.create_task(connection.send_command("read temp"))
+        while not cooker.received:
+            await asyncio.sleep(0.001)
+        await disconnect(connection, server, cooker)
+        with pytest.raises(ConnectionResetError):
+            await pending
+
+    asyncio.run(run())
+
+
+def test_lost_reply_drops_the_connection(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(connection_module, "COMMAND_TIMEOUT", 0.1)
+
+    async def run() -> None:
+        cooker = FakeCooker(answer=False)
+        connection, server = await connect(cooker)
+        lost = asyncio.create_task(connection.send_command("read temp"))
+        await asyncio.sleep(0.05)
+        queued = asyncio.create_task(connection.send_command("read unit"))
+        while len(cooker.received) < 2:
+            await asyncio.sleep(0.001)
+
+        # The reply to "read temp" never comes, so every later reply would be matched to the command before it
+        with pytest.raises(TimeoutError):
+            await lost
+        with pytest.raises(ConnectionResetError):
+            await queued
+        assert connection.in_flight == 0
+        assert connection.writer.is_closing()
+
+        with pytest.raises(ConnectionResetError):
+            await connection.send_command("status")
+        assert cooker.received == ["read temp", "read unit"]
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
+
+
+def test_remote_close_fails_later_commands_at_once() -> None:
+    async def run() -> None:
+        cooker = FakeCooker()
+        connection, server = await connect(cooker)
+        lost = asyncio.Event()
+
+        async def on_close() -> None:
+            lost.set()
+
+        connection.set_close_callback(on_close)
+        assert await connection.send_command("read temp") == "28.6"
+
+        await cooker.close()
+        await asyncio.wait_for(lost.wait(), 1)
+        assert connection.closed
+
+        # Without the closed flag this would be written into the dead socket and wait out COMMAND_TIMEOUT
+        start = time.monotonic()
+        with pytest.raises(ConnectionResetError):
+            await connection.send_command("read unit")
+        assert time.monotonic() - start < 0.1
+        await disconnect(connection, server)
+
+    asyncio.run(run())
+
+
+def test_close_does_not_report_a_lost_connection() -> None:
+    async def run() -> None:
+        cooker = FakeCooker()
+        connection, server = await connect(cooker)
+        calls = []
+
+        async def on_close() -> None:
+            calls.append(True)
+
+        connection.set_close_callback(on_close)
+        await disconnect(connection, server, cooker)
+        await asyncio.sleep(0.01)
+        assert calls == []
+        assert connection.closed
+
+    asyncio.run(run())
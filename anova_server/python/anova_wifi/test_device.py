@@ -0,0 +1,149 @@
+import asyncio
+import time
+from typing import List
+
+import pytest
+
+from commands import DeviceStatus, TemperatureUnit
+from .device import AnovaDevice, DeviceState, DeviceStateDelta
+from .history import TemperatureSample
+from .testing import FakeCooker, RESPONSES, connect, disconnect
+
+
+def test_snapshot_costs_one_round_trip() -> None:
+    async def run() -> None:
+        delay = 0.1
+        cooker = FakeCooker(delay=delay)
+        connection, server = await connect(cooker)
+        device = AnovaDevice(connection)
+        device.id_card = "f56-0123456789"
+
+        notifications: List[DeviceStateDelta] = []
+
+        async def on_change(device_id: str, state: DeviceState, delta: DeviceStateDelta) -> None:
+            notifications.append(delta)
+
+        device.add_state_change_callback(on_change)
+        recorded: List[TemperatureSample] = []
+        device.add_sample_callback(lambda device_id, sample: recorded.append(sample))
+
+        start = time.monotonic()
+        state = await device.snapshot()
+        elapsed = time.monotonic() - start
+
+        assert elapsed < 2 * delay
+        assert cooker.max_outstanding == 6
+        assert state.status == DeviceStatus.RUNNING
+        assert state.target_temperature == 57.5
+        assert state.current_temperature == 28.6
+        assert state.unit == TemperatureUnit.CELSIUS
+        assert (state.timer_value, state.timer_running) == (0, False)
+        assert state.speaker_status is True
+        assert len(notifications) == 1
+        assert notifications[0].changes == {
+            "status": "running", "target_temperature": 57.5, "current_temperature": 28.6, "unit": "c",
+            "speaker_status": True,
+        }
+
+        # Nothing changed, so nobody is told about it
+        await device.snapshot()
+        assert len(notifications) == 1
+
+        cooker.responses["read temp"] = "29.1"
+        await device.snapshot()
+        assert notifications[-1] == DeviceStateDelta(revision=state.revision, changes={"current_temperature": 29.1})
+        assert [sample.current_temperature for sample in device.history.query()] == [28.6, 28.6, 29.1]
+        assert recorded == device.history.query()
+
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
+
+
+def test_snapshot_applies_partial_results_before_raising() -> None:
+    async def run() -> None:
+        cooker = FakeCooker({**RESPONSES, "read unit": "kelvin"})
+        connection, server = await connect(cooker)
+        device = AnovaDevice(connection)
+
+        with pytest.raises(ValueError):
+            await device.snapshot(["current_temperature", "unit"])
+        assert device.state.current_temperature == 28.6
+        assert device.state.unit is None
+
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
+
+
+def test_failed_temperature_read_is_not_sampled() -> None:
+    async def run() -> None:
+        responses = {**RESPONSES}
+        del responses["read temp"]
+        cooker = FakeCooker(responses)
+        connection, server = await connect(cooker)
+        device = AnovaDevice(connection)
+        device.id_card = "f56-0123456789"
+        recorded: List[TemperatureSample] = []
+        device.add_sample_callback(lambda device_id, sample: recorded.append(sample))
+
+        # The cooker rejects "read temp", so there is no new temperature to record
+        with pytest.raises(ValueError):
+            await device.snapshot()
+        assert device.state.target_temperature == 57.5
+        assert device.history.query() == []
+        assert recorded == []
+
+        cooker.responses["read temp"] = "28.6"
+        await device.snapshot(["current_temperature"])
+        assert [sample.current_temperature for sample in device.history.query()] == [28.6]
+        assert recorded == device.history.query()
+
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
+
+def test_refresh_reads_only_stale_fields() -> None:
+    async def run() -> None:
+        cooker = FakeCooker()
+        connection, server = await connect(cooker)
+        device = AnovaDevice(connection)
+        assert device.state_age("unit") is None
+
+        await device.snapshot(["current_temperature", "unit"])
+        assert 0 <= device.state_age("unit") < 1  # type: ignore
+        sent = len(cooker.received)
+        await device.refresh(60, ["current_temperature", "unit"])
+        assert len(cooker.received) == sent
+
+        await device.refresh(60, ["current_temperature", "unit", "timer"])
+        assert cooker.received[sent:] == ["read timer"]
+        await device.refresh(0, ["unit"])
+        assert cooker.received[-1] == "read unit"
+
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
+
+
+def test_state_tracks_changes() -> None:
+    state = DeviceState()
+    assert state.revision == 0
+    assert state.take_delta() is None
+
+    state.current_temperature = 0.0
+    assert state.revision == 0
+    assert not state.dirty
+
+    state.current_temperature = 40.5
+    state.status = DeviceStatus.RUNNING
+    assert state.revision == 2
+    assert state.field_version("current_temperature") == 1
+    assert state.field_version("status") == 2
+    assert state.field_version("unit") == 0
+    assert state.dirty == {"current_temperature", "status"}
+
+    delta = state.take_delta()
+    assert delta == DeviceStateDelta(revision=2, changes={"current_temperature": 40.5, "status": "running"})
+    assert not state.dirty
+    assert state.take_delta() is None
@@ -1,10 +1,14 @@
 import csv
+import os
+import random
+import string
+import time
 from os.path import dirname, realpath, join
 from typing import List, Tuple
 
 import pytest
 
-from .encoding import Encoder
+from .encoding import Encoder, FrameDecoder
 
 
 # Helper function to load test cases from CSV
@@ -34,3 +38,198 @@ def test_async_encoder_decode(original_bytes: bytes, expected_length: int, expec
 def test_async_encoder_encode(original_bytes: bytes, expected_length: int, expected_decoded: str) -> None:
     re_encoded = Encoder.encode(expected_decoded)
     assert re_encoded == original_bytes, f"Expected: {original_bytes!r}, Got: {re_encoded!r}"
+
+
+def _reference_encode(message: str) -> bytes:
+    """The original byte-at-a-time encoder, kept as an oracle for the table driven one."""
+    if not message.endswith('\r'):
+        message += '\r'
+    message_bytes = message.encode('utf-8')
+    result = bytearray([ord('h'), len(message_bytes)])
+    checksum = 0
+    for i, byte in enumerate(message_bytes):
+        encoded_byte = Encoder.roll_shift(byte, (i + 1) % 7)
+        result.append(encoded_byte)
+        checksum += encoded_byte
+    result.append(checksum & 0xFF)
+    return bytes(result)
+
+
+def _reference_decode(data: bytes) -> str:
+    """The original byte-at-a-time decoder, kept as an oracle for the table driven one."""
+    if data[-1:] == b'\x16':
+        data = data[:-1]
+    if data[0] != ord('h'):
+        raise ValueError(f"Invalid header byte: {data[0]:02X}")
+    length = data[1]
+    payload = data[2:2 + length + 1]
+    chars = []
+    checksum = 0
+    for i, byte in enumerate(payload[:-1]):
+        checksum += byte
+        chars.append(chr(Encoder.reverse_roll_shift(byte, (i + 1) % 7)))
+    if payload[-1] != checksum & 0xFF:
+        raise ValueError("Checksum mismatch")
+    return ''.join(chars).rstrip('\r')
+
+
+def _random_messages(count: int, seed: int = 42) -> List[str]:
+    rng = random.Random(seed)
+    alphabet = string.printable + "°é"
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 80))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("message", _random_messages(200))
+def test_encoder_matches_reference(message: str) -> None:
+    encoded = Encoder.encode(message)
+    assert encoded == _reference_encode(message)
+    assert Encoder.decode(encoded + b'\x16') == _reference_decode(encoded + b'\x16')
+
+
+def test_encoder_decode_bad_checksum() -> None:
+    encoded = bytearray(Encoder.encode("status"))
+    encoded[-1] ^= 0xFF
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        Encoder.decode(bytes(encoded))
+
+
+def test_encoder_decode_bad_header() -> None:
+    with pytest.raises(ValueError, match="Invalid header byte"):
+        Encoder.decode(b'x\x01\x00\x00')
+
+
+def test_encoder_checksum_equal_to_syn() -> None:
+    frame = Encoder.encode("2106 running")
+    assert frame[-1] == 0x16
+
+    assert Encoder.decode(frame) == "2106 running"
+    assert Encoder.decode(frame + b'\x16') == "2106 running"
+    assert Encoder.decode_many([frame, frame + b'\x16']) == ["2106 running"] * 2
+    assert FrameDecoder().feed(frame + b'\x16' + frame + Encoder.encode("c")) == ["2106 running"] * 2 + ["c"]
+    with pytest.raises(ValueError, match="Truncated frame"):
+        Encoder.decode(frame[:-1])
+
+
+def test_encoder_batch_roundtrip() -> None:
+    cases = load_test_cases()
+    messages = [decoded for _, _, decoded in cases]
+    frames = [original for original, _, _ in cases]
+
+    assert Encoder.encode_many(messages) == frames
+    assert Encoder.decode_many(frames) == messages
+    assert Encoder.decode_many([f + b'\x16' for f in frames]) == messages
+    assert Encoder.encode_many([]) == []
+    assert Encoder.decode_many([]) == []
+
+
+@pytest.mark.parametrize("count", [3, 30])  # below and above the size at which the NumPy path takes over
+def test_encoder_batch_bad_checksum(count: int) -> None:
+    frames = Encoder.encode_many(["status", "read temp", "read unit"] * (count // 3))
+    corrupted = bytearray(frames[1])
+    corrupted[-1] ^= 0xFF
+    frames[1] = bytes(corrupted)
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        Encoder.decode_many(frames)
+
+
+def test_frame_decoder_coalesced_frames() -> None:
+    messages = ["event wifi stop", "stopped", "57.5"]
+    stream = b''.join(Encoder.encode(m) + b'\x16' for m in messages)
+
+    decoder = FrameDecoder()
+    assert decoder.feed(stream) == messages
+    assert len(decoder) == 0
+
+
+def test_frame_decoder_split_frames() -> None:
+    messages = [decoded for _, _, decoded in load_test_cases()[:20]]
+    stream = b''.join(Encoder.encode(m) + b'\x16' for m in messages)
+
+    decoder = FrameDecoder()
+    received = []
+    for i in range(0, len(stream), 5):
+        received.extend(decoder.feed(stream[i:i + 5]))
+    assert received == messages
+
+    received = []
+    for i in range(len(stream)):
+        received.extend(decoder.feed(stream[i:i + 1]))
+    assert received == messages
+    assert len(decoder) == 0
+
+
+def test_frame_decoder_without_syn() -> None:
+    decoder = FrameDecoder()
+    assert decoder.feed(Encoder.encode("running") + Encoder.encode("28.6")) == ["running", "28.6"]
+
+
+def test_frame_decoder_resyncs_after_garbage() -> None:
+    corrupt = bytearray(Encoder.encode("read temp"))
+    corrupt[-1] ^= 0xFF
+    stream = b'\x00\x01' + bytes(corrupt) + b'\x16' + Encoder.encode("28.6") + b'\x16'
+
+    decoder = FrameDecoder()
+    assert decoder.feed(stream) == ["28.6"]
+    assert len(decoder) == 0
+
+
+
+def test_frame_decoder_resyncs_after_bogus_length() -> None:
+    messages = [f"{57 + i / 10:.1f}" for i in range(16)]
+    replies = b''.join(Encoder.encode(m) + b'\x16' for m in messages)
+
+    # A stray header byte whose length claims more than everything behind it
+    decoder = FrameDecoder()
+    assert decoder.feed(b'h\xf0\x01\x02\x16' + replies) == messages
+    assert len(decoder) == 0
+
+    # Arriving in pieces, the frames are released as soon as the first one is complete
+    received = []
+    for i in range(0, len(replies), 7):
+        received.extend(decoder.feed((b'h\xf0\x01\x02\x16' if i == 0 else b'') + replies[i:i + 7]))
+    assert received == messages
+
+def test_frame_decoder_keeps_partial_frame() -> None:
+    frame = Encoder.encode("speaker is on")
+    decoder = FrameDecoder()
+    assert decoder.feed(frame[:-3]) == []
+    assert len(decoder) == len(frame) - 3
+    decoder.reset()
+    assert len(decoder) == 0
+    assert decoder.feed(frame) == ["speaker is on"]
+
+
+def test_encoder_implementations_agree() -> None:
+    messages = [decoded for _, _, decoded in load_test_cases()] * 20
+    frames = [_reference_encode(m) for m in messages]
+
+    assert [Encoder.encode(m) for m in messages] == frames
+    assert Encoder.encode_many(messages) == frames
+    assert [Encoder.decode(f) for f in frames] == [_reference_decode(f) for f in frames]
+    assert Encoder.decode_many(frames) == messages
+    assert FrameDecoder().feed(b''.join(f + b'\x16' for f in frames)) == messages
+
+
+@pytest.mark.skipif(not os.environ.get("ANOVA_BENCHMARK"), reason="set ANOVA_BENCHMARK=1 to run, with -s to see it")
+@pytest.mark.parametrize("count", [6, 24, 200])  # a heartbeat, the NumPy threshold, a large batch
+def test_encoder_throughput(count: int) -> None:
+    messages = ([decoded for _, _, decoded in load_test_cases()] * (count // 202 + 1))[:count]
+    frames = [_reference_encode(m) for m in messages]
+    stream = b''.join(f + b'\x16' for f in frames)
+
+    implementations = {
+        "reference": lambda: [_reference_decode(_reference_encode(m)) for m in messages],
+        "table": lambda: [Encoder.decode(Encoder.encode(m)) for m in messages],
+        "batch": lambda: Encoder.decode_many(Encoder.encode_many(messages)),
+        "stream": lambda: FrameDecoder().feed(stream),
+    }
+    # Interleave the rounds and keep the best of each, so a noisy neighbour doesn't favour one implementation.
+    # Only reported, never asserted: wall-clock comparisons are too noisy on shared runners.
+    best = {name: float("inf") for name in implementations}
+    for _ in range(5):
+        for name, run in implementations.items():
+            start = time.perf_counter()
+            for _ in range(20):
+                run()
+            best[name] = min(best[name], (time.perf_counter() - start) / 20)
+    print(f"\n{count} frames encode+decode: " + ", ".join(f"{name} {t * 1e6:,.1f} µs" for name, t in best.items()))
@@ -0,0 +1,49 @@
+import pytest
+
+from commands import DeviceStatus
+from .history import TemperatureHistory, TemperatureSample
+
+
+def filled(capacity: int, count: int) -> TemperatureHistory:
+    history = TemperatureHistory(capacity)
+    for i in range(count):
+        history.append(float(i), 20.0 + i, 57.5, DeviceStatus.RUNNING if i % 2 else DeviceStatus.STOPPED)
+    return history
+
+
+def test_history_appends_and_queries() -> None:
+    history = filled(10, 4)
+    assert len(history) == 4
+    assert history.query() == [
+        TemperatureSample(0.0, 20.0, 57.5, DeviceStatus.STOPPED),
+        TemperatureSample(1.0, 21.0, 57.5, DeviceStatus.RUNNING),
+        TemperatureSample(2.0, 22.0, 57.5, DeviceStatus.STOPPED),
+        TemperatureSample(3.0, 23.0, 57.5, DeviceStatus.RUNNING),
+    ]
+    assert history.latest() == TemperatureSample(3.0, 23.0, 57.5, DeviceStatus.RUNNING)
+    assert TemperatureHistory(3).latest() is None
+
+
+def test_history_wraps_around() -> None:
+    history = filled(10, 25)
+    assert len(history) == 10
+    assert [s.timestamp for s in history.query()] == [float(i) for i in range(15, 25)]
+
+
+def test_history_time_range() -> None:
+    history = filled(10, 25)
+    assert [s.timestamp for s in history.query(start=17.5, end=20)] == [18.0, 19.0, 20.0]
+    assert [s.timestamp for s in history.query(start=23)] == [23.0, 24.0]
+    assert [s.timestamp for s in history.query(end=15)] == [15.0]
+    assert history.query(start=30) == []
+    assert history.query(start=20, end=19) == []
+
+
+def test_history_downsamples() -> None:
+    history = filled(1000, 1500)
+    samples = history.query(max_points=100)
+    assert len(samples) == 100
+    assert samples[0].timestamp == 500.0
+    assert [s.timestamp for s in history.query(start=600, end=609, max_points=4)] == [600.0, 603.0, 606.0, 609.0]
+    with pytest.raises(ValueError):
+        history.query(max_points=0)
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from .manager import AnovaManager
+from .testing import make_cooker, start_manager, stop_manager
+
+
+def test_managers_do_not_share_state() -> None:
+    first = AnovaManager()
+    second = AnovaManager()
+    assert first.devices is not second.devices
+    assert first.scheduler is not second.scheduler
+    assert first.device_connected_callbacks is not second.device_connected_callbacks
+    assert first.device_state_change_callbacks is not second.device_state_change_callbacks
+
+
+def test_cookers_progress_in_parallel() -> None:
+    count = 10
+    delay = 0.05
+
+    async def run() -> None:
+        manager, task, port = await start_manager()
+        cookers = [make_cooker(i, delay) for i in range(count)]
+        await asyncio.gather(*(cooker.connect(port) for cooker in cookers))
+        while len(manager.get_devices()) < count:
+            await asyncio.sleep(0.01)
+
+        devices = manager.get_devices()
+        start = time.monotonic()
+        await asyncio.gather(*(device.heartbeat() for device in devices))
+        elapsed = time.monotonic() - start
+
+        # A heartbeat is a single round trip; a shared lock or queue would make this take count * delay
+        assert elapsed < 4 * delay
+        assert len({id(device.state) for device in devices}) == count
+        for device in devices:
+            i = int(device.id_card.split("-")[1])  # type: ignore[union-attr]
+            assert device.state.current_temperature == 20 + i + 0.5
+
+        await stop_manager(manager, task, cookers)
+
+    asyncio.run(run())
+
+
+def test_cooker_hanging_up_is_dropped_at_once() -> None:
+    async def run() -> None:
+        manager, task, port = await start_manager()
+        cookers = [make_cooker(i, 0.0) for i in range(2)]
+        await asyncio.gather(*(cooker.connect(port) for cooker in cookers))
+        while len(manager.get_devices()) < 2:
+            await asyncio.sleep(0.01)
+        generation = manager.generation
+
+        # Long before the next heartbeat would notice
+        await cookers[0].close()
+        for _ in range(100):
+            if len(manager.get_devices()) == 1:
+                break
+            await asyncio.sleep(0.01)
+        assert [device.id_card for device in manager.get_devices()] == ["f56-0000000001"]
+        assert manager.generation > generation
+
+        await stop_manager(manager, task, cookers[1:])
+
+    asyncio.run(run())
@@ -0,0 +1,125 @@
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+
+from commands import DeviceStatus
+from .device import DeviceState, POLL_COMMANDS
+from .event import AnovaEvent, EventType
+from .scheduler import HeartbeatScheduler, poll_interval, HEARTBEAT_INTERVAL
+
+
+class PolledDevice:
+    """Stands in for an AnovaDevice, recording which fields get polled."""
+
+    def __init__(self, error: Optional[Exception] = None):
+        self.state = DeviceState()
+        self.polls: List[Set[str]] = []
+        self.error = error
+
+    async def snapshot(self, fields: Set[str]) -> DeviceState:
+        self.polls.append(set(fields))
+        if self.error:
+            raise self.error
+        return self.state
+
+    def count(self, field: str) -> int:
+        return sum(field in fields for fields in self.polls)
+
+
+def make_scheduler(errors: List[Tuple[str, Exception]], fast: str = "current_temperature") -> HeartbeatScheduler:
+    async def on_error(device_id: str, error: Exception) -> None:
+        errors.append((device_id, error))
+
+    return HeartbeatScheduler(on_error, policy=lambda field, state: 0.05 if field == fast else 10, tick=0.01)
+
+
+def add(scheduler: HeartbeatScheduler, device_id: str, device: PolledDevice) -> None:
+    scheduler.add(device_id, device)  # type: ignore[arg-type]
+
+
+def test_poll_interval_follows_state() -> None:
+    state = DeviceState(status=DeviceStatus.RUNNING, current_temperature=30.0, target_temperature=57.5)
+    assert poll_interval("current_temperature", state) == HEARTBEAT_INTERVAL
+
+    state.current_temperature = 57.4
+    assert HEARTBEAT_INTERVAL < poll_interval("current_temperature", state)
+
+    stopped = DeviceState(status=DeviceStatus.STOPPED)
+    assert poll_interval("current_temperature", stopped) > poll_interval("current_temperature", state)
+    assert poll_interval("status", stopped) > poll_interval("status", state)
+    assert poll_interval("timer", DeviceState(timer_running=True)) < poll_interval("timer", stopped)
+
+
+def test_fields_are_polled_at_their_own_rate() -> None:
+    async def run() -> None:
+        errors: List[Tuple[str, Exception]] = []
+        scheduler = make_scheduler(errors)
+        devices: Dict[str, PolledDevice] = {f"device-{i}": PolledDevice() for i in range(5)}
+        for device_id, device in devices.items():
+            add(scheduler, device_id, device)
+
+        scheduler.start()
+        await asyncio.sleep(0.3)
+        await scheduler.stop()
+
+        for device in devices.values():
+            assert device.polls[0] == set(POLL_COMMANDS)
+            assert device.count("current_temperature") >= 3
+            assert device.count("unit") == 1
+        assert not errors
+
+    asyncio.run(run())
+
+
+def test_poke_and_events_pull_fields_forward() -> None:
+    async def run() -> None:
+        errors: List[Tuple[str, Exception]] = []
+        scheduler = make_scheduler(errors, fast="none")
+        device = PolledDevice()
+        add(scheduler, "device", device)
+
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        assert device.count("timer") == 1
+
+        scheduler.handle_event("device", AnovaEvent(type=EventType.TIME_START))
+        await asyncio.sleep(0.05)
+        assert device.count("timer") == 2
+
+        scheduler.poke("device", ["speaker_status"])
+        await asyncio.sleep(0.05)
+        assert device.polls[-1] == {"speaker_status"}
+        await scheduler.stop()
+
+    asyncio.run(run())
+
+
+def test_removed_devices_are_no_longer_polled() -> None:
+    async def run() -> None:
+        errors: List[Tuple[str, Exception]] = []
+        scheduler = make_scheduler(errors)
+        device = PolledDevice()
+        add(scheduler, "device", device)
+
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        scheduler.remove("device")
+        polls = len(device.polls)
+        await asyncio.sleep(0.15)
+        assert len(device.polls) == polls
+        await scheduler.stop()
+
+    asyncio.run(run())
+
+
+def test_poll_errors_are_reported() -> None:
+    async def run() -> None:
+        errors: List[Tuple[str, Exception]] = []
+        scheduler = make_scheduler(errors)
+        add(scheduler, "device", PolledDevice(error=ConnectionResetError("gone")))
+
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+        assert [device_id for device_id, _ in errors] == ["device"]
+
+    asyncio.run(run())
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from commands import DeviceStatus
+from .event import AnovaEvent, EventType, EventOriginator
+from .history import TemperatureSample
+from .telemetry import TelemetryLog, INDEX_INTERVAL, _EVENT_TYPE_CODES, _ORIGINATOR_CODES, _STATUS_CODES
+
+DEVICE_ID = "anova f56-0123456789"
+
+
+def sample(i: int) -> TemperatureSample:
+    return TemperatureSample(1000.0 + i, 20.0 + i / 10, 57.5, DeviceStatus.RUNNING if i % 2 else DeviceStatus.STOPPED)
+
+
+async def write(log: TelemetryLog, count: int) -> None:
+    log.start()
+    for i in range(count):
+        log.record_sample(DEVICE_ID, sample(i))
+    await log.stop()
+
+
+def test_samples_round_trip_across_segments(tmp_path: Path) -> None:
+    async def run() -> None:
+        log = TelemetryLog(str(tmp_path), segment_records=100)
+        await write(log, 1000)
+        segments = os.listdir(tmp_path / DEVICE_ID.encode().hex() / "samples")
+        assert len(segments) == 10
+
+        assert await log.query_samples(DEVICE_ID) == [sample(i) for i in range(1000)]
+        assert await log.query_samples(DEVICE_ID, 1150, 1420) == [sample(i) for i in range(150, 421)]
+        assert await log.query_samples(DEVICE_ID, 1999.5) == []
+        assert await log.query_samples("unknown") == []
+
+    asyncio.run(run())
+
+
+def test_range_queries_use_the_sparse_index(tmp_path: Path) -> None:
+    async def run() -> None:
+        count = INDEX_INTERVAL * 5 + 17
+        log = TelemetryLog(str(tmp_path))
+        await write(log, count)
+        for start, end in [(1000, 1000), (1255, 1257), (1256, 1256), (1000 + count - 1, 5000), (900, 1003)]:
+            expected = [sample(i) for i in range(count) if start <= 1000 + i <= end]
+            assert await log.query_samples(DEVICE_ID, start, end) == expected
+
+    asyncio.run(run())
+
+
+def test_downsampling_spans_segments(tmp_path: Path) -> None:
+    async def run() -> None:
+        log = TelemetryLog(str(tmp_path), segment_records=64)
+        await write(log, 1000)
+        samples = await log.query_samples(DEVICE_ID, 1100, 1899, max_points=100)
+        assert [s.timestamp for s in samples] == [1100.0 + i for i in range(0, 800, 8)]
+
+    asyncio.run(run())
+
+
+def test_log_survives_restart(tmp_path: Path) -> None:
+    async def run() -> None:
+        await write(TelemetryLog(str(tmp_path), segment_records=100), 150)
+
+        # A torn record at the end of the last segment is dropped when appending resumes
+        segment = sorted((tmp_path / DEVICE_ID.encode().hex() / "samples").iterdir())[-1]
+        with open(segment, "ab") as f:
+            f.write(b"\x00" * 5)
+
+        log = TelemetryLog(str(tmp_path), segment_records=100)
+        assert await log.query_samples(DEVICE_ID) == [sample(i) for i in range(150)]
+        log.start()
+        for i in range(150, 300):
+            log.record_sample(DEVICE_ID, sample(i))
+        await log.stop()
+        assert await log.query_samples(DEVICE_ID) == [sample(i) for i in range(300)]
+
+    asyncio.run(run())
+
+
+def test_events_round_trip(tmp_path: Path) -> None:
+    async def run() -> None:
+        log = TelemetryLog(str(tmp_path))
+        log.start()
+        events: List[AnovaEvent] = [
+            AnovaEvent(type=EventType.START, originator=EventOriginator.WIFI),
+            AnovaEvent(type=EventType.TEMP_REACHED),
+            AnovaEvent(type=EventType.STOP, originator=EventOriginator.BLE),
+        ]
+        for i, event in enumerate(events):
+            log.record_event(DEVICE_ID, 10.0 * i, event)
+        await log.stop()
+
+        assert await log.query_events(DEVICE_ID) == [(10.0 * i, e) for i, e in enumerate(events)]
+        assert await log.query_events(DEVICE_ID, 5, 15) == [(10.0, events[1])]
+        assert await log.query_samples(DEVICE_ID) == []
+
+    asyncio.run(run())
+
+
+def test_device_ids_get_distinct_directories(tmp_path: Path) -> None:
+    async def run() -> None:
+        log = TelemetryLog(str(tmp_path / "log"))
+        log.start()
+        device_ids = ["a/b", "a_b", "A_B", "..", "../escape"]
+        for i, device_id in enumerate(device_ids):
+            log.record_sample(device_id, sample(i))
+        await log.stop()
+
+        for i, device_id in enumerate(device_ids):
+            assert await log.query_samples(device_id) == [sample(i)]
+        assert os.listdir(tmp_path) == ["log"]
+        assert len(os.listdir(tmp_path / "log")) == len(device_ids)
+
+    asyncio.run(run())
+
+
+def test_every_enum_member_has_a_code() -> None:
+    for codes, enum in ((_STATUS_CODES, DeviceStatus), (_EVENT_TYPE_CODES, EventType),
+                        (_ORIGINATOR_CODES, EventOriginator)):
+        assert set(codes) == set(enum)
+        assert len(set(codes.values())) == len(codes)
+
+def test_records_are_written_in_the_background(tmp_path: Path) -> None:
+    async def run() -> None:
+        log = TelemetryLog(str(tmp_path))
+        log.start()
+        log.record_sample(DEVICE_ID, sample(0))
+        for _ in range(100):
+            if await log.query_samples(DEVICE_ID):
+                break
+            await asyncio.sleep(0.01)
+        assert await log.query_samples(DEVICE_ID) == [sample(0)]
+        await log.stop()
+
+    asyncio.run(run())
+
+
+def test_stop_waits_for_the_batch_being_written(tmp_path: Path) -> None:
+    async def run() -> None:
+        log = TelemetryLog(str(tmp_path))
+        writing, release = threading.Event(), threading.Event()
+        write_batches = log._write
+
+        def slow_write(batches: Dict[Tuple[str, str], List[bytes]]) -> None:
+            if not writing.is_set():
+                writing.set()
+                release.wait(5)
+            write_batches(batches)
+
+        log._write = slow_write  # type: ignore
+        log.start()
+        log.record_sample(DEVICE_ID, sample(0))
+        while not writing.is_set():
+            await asyncio.sleep(0.001)
+        log.record_sample(DEVICE_ID, sample(1))
+
+        stopping = asyncio.create_task(log.stop())
+        await asyncio.sleep(0.05)
+        assert not stopping.done()
+        release.set()
+        await stopping
+
+        assert all(stream._file is None for stream in log._streams.values())
+        assert await log.query_samples(DEVICE_ID) == [sample(0), sample(1)]
+
+    asyncio.run(run())
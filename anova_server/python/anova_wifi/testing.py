@@ -0,0 +1,113 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .connection import AnovaConnection
+from .encoding import Encoder, FrameDecoder
+from .manager import AnovaManager
+
+RESPONSES = {
+    "get id card": "anova f56-0123456789",
+    "version": "ver 2.7.7",
+    "get number": "abcdefghij",
+    "status": "running",
+    "read set temp": "57.5",
+    "read temp": "28.6",
+    "read unit": "c",
+    "read timer": "0 stopped",
+    "speaker status": "speaker is on",
+}
+
+
+class FakeCooker:
+    """
+    Simulates a cooker on the other end of the TCP connection.
+    Every command is answered `delay` seconds after it arrived, in arrival order, like the real device.
+    With `answer=False` nothing is answered automatically and the test sends replies itself.
+    """
+
+    def __init__(self, responses: Optional[Dict[str, str]] = None, delay: float = 0.0, answer: bool = True):
+        self.responses = dict(RESPONSES if responses is None else responses)
+        self.delay = delay
+        self.answer = answer
+        self.received: List[str] = []
+        self.max_outstanding = 0
+        self._outstanding = 0
+        self._replies: asyncio.Queue[Tuple[float, str]] = asyncio.Queue()
+        self._tasks: List[asyncio.Task[None]] = []
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self, port: int) -> None:
+        reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        self._tasks = [asyncio.create_task(self._read(reader)), asyncio.create_task(self._reply())]
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        decoder = FrameDecoder()
+        while data := await reader.read(1024):
+            for msg in decoder.feed(data):
+                self.received.append(msg)
+                if not self.answer:
+                    continue
+                self._outstanding += 1
+                self.max_outstanding = max(self.max_outstanding, self._outstanding)
+                reply = self.responses.get(msg, "invalid command")
+                await self._replies.put((time.monotonic() + self.delay, reply))
+
+    async def _reply(self) -> None:
+        assert self.writer
+        while True:
+            due, reply = await self._replies.get()
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            self._outstanding -= 1
+            self.send(reply)
+
+    def send(self, *messages: str) -> None:
+        """Write messages in a single TCP segment."""
+        assert self.writer
+        self.writer.write(b''.join(Encoder.encode(m) + b'\x16' for m in messages))
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self.writer:
+            self.writer.close()
+
+
+async def connect(cooker: FakeCooker, pipeline_depth: int = 6) -> Tuple[AnovaConnection, asyncio.Server]:
+    """Start a listening socket, connect the fake cooker to it and return the server side connection."""
+    accepted: asyncio.Future[AnovaConnection] = asyncio.get_running_loop().create_future()
+
+    async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connection = AnovaConnection(reader, writer, pipeline_depth)
+        connection.start_listening()
+        accepted.set_result(connection)
+
+    server = await asyncio.start_server(on_connection, "127.0.0.1", 0)
+    await cooker.connect(server.sockets[0].getsockname()[1])
+    return await accepted, server
+
+
+async def disconnect(connection: AnovaConnection, server: asyncio.Server, *cookers: FakeCooker) -> None:
+    for cooker in cookers:
+        await cooker.close()
+    await connection.close()
+    server.close()
+
+
+async def start_manager() -> tuple[AnovaManager, asyncio.Task[None], int]:
+    manager = AnovaManager(host="127.0.0.1", port=0)
+    task = asyncio.create_task(manager.start())
+    while not getattr(manager.server, "server", None):
+        await asyncio.sleep(0.001)
+    return manager, task, manager.server.server.sockets[0].getsockname()[1]
+
+
+async def stop_manager(manager: AnovaManager, task: asyncio.Task[None], cookers: List[FakeCooker]) -> None:
+    for cooker in cookers:
+        await cooker.close()
+    await manager.stop()
+    task.cancel()
+
+
+def make_cooker(i: int, delay: float) -> FakeCooker:
+    return FakeCooker({**RESPONSES, "get id card": f"anova f56-{i:010d}", "read temp": f"{20 + i}.5"}, delay=delay)
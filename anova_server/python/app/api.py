@@ -1,27 +1,32 @@
-import asyncio
-import os
 import random
 import socket
 import string
 from functools import cache
-from typing import List, Optional, AsyncIterator, Annotated
+from typing import Any, List, Optional, AsyncIterator, Annotated, Dict, Callable, Awaitable, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Request, Body, Security
-from fastapi.responses import StreamingResponse
-import httpx
+from fastapi import APIRouter, Depends, HTTPException, Body, Security, Query, Header, WebSocket
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
 
-from anova_ble.client import AnovaBluetoothClient
-from anova_wifi.device import DeviceState, AnovaDevice
+from anova_ble.proxy import BLEProxy
+from anova_wifi.device import DeviceState, AnovaDevice, POLL_COMMANDS
 from anova_wifi.manager import AnovaManager
-from commands import SetWifiCredentials, SetServerInfo, GetIDCard, GetVersion, GetTemperatureUnit, GetSpeakerStatus, \
-    SetSecretKey, SetTemperatureUnit, SetTargetTemperature, GetCurrentTemperature, SetTimer, StopTimer, ClearAlarm, \
-    GetTimerStatus, GetTargetTemperature, TemperatureUnit, StartTimer
-from .deps import get_device_manager, get_sse_manager, get_authenticated_device, get_settings, admin_auth
-from .models import DeviceInfo, SetTemperatureResponse, SetTimerResponse, UnitResponse, SpeakerStatusResponse, \
+from commands import AnovaCommand, SetWifiCredentials, SetServerInfo, GetIDCard, GetVersion, GetTemperatureUnit, \
+    GetSpeakerStatus, SetSecretKey, SetTemperatureUnit, SetTargetTemperature, SetTimer, StopTimer, ClearAlarm, \
+    TemperatureUnit, StartTimer
+from .cache import FleetStateCache, ResponseCache
+from .deps import get_device_manager, get_sse_manager, get_authenticated_device, get_websocket_device, get_settings, \
+    get_state_cache, get_response_cache, get_session_store, get_secret_key, authenticate_device, get_ble_proxy, \
+    admin_auth
+from .models import DeviceInfo, DeviceMetrics, SetTemperatureResponse, SetTimerResponse, UnitResponse, SpeakerStatusResponse, \
     TimerResponse, BLEDevice, OkResponse, GetTargetTemperatureResponse, TemperatureResponse, NewSecretResponse, \
-    BLEDeviceInfo, SSEEvent, SSEEventType, ServerInfo
+    BLEDeviceInfo, SSEEvent, SSEEventType, ServerInfo, TemperatureHistoryResponse, TemperatureHistorySample, \
+    DeviceStateInfo, BatchRequest, BatchResponse, SessionResponse
+from .operations import OPERATIONS, BATCH_CONCURRENCY, run_batch
+from .sessions import SessionStore
 from .settings import Settings
-from .sse import SSEManager, event_stream
+from .sse import SSEManager, SSEFilter, SSEListener
+from .ws import DeviceSocket
 
 import logging
 
@@ -30,6 +35,10 @@ logging.basicConfig(level=logging.INFO)
 
 router = APIRouter()
 
+MaxAge = Annotated[Optional[float], Query(
+    ge=0, description="Read the value from the device if the one in the state is older than this many seconds",
+)]
+
 # ----------- Normal Anova WiFi endpoints -----------
 @router.get("/devices")
 async def get_devices(
@@ -47,12 +56,104 @@ async def get_devices(
     ]
 
 
+@router.get("/devices/states", response_model=List[DeviceStateInfo], responses={304: {"description": "Not modified"}})
+async def get_device_states(
+        state_cache: Annotated[FleetStateCache, Depends(get_state_cache)],
+        admin: Annotated[Optional[bool], Security(admin_auth)],
+        if_none_match: Annotated[Optional[str], Header()] = None,
+) -> Response:
+    body, etag = state_cache.get()
+    if if_none_match and (if_none_match.strip() == "*" or etag in (
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(","))):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+@router.post("/devices/batch")
+async def run_batch_operations(
+        batch: BatchRequest,
+        manager: Annotated[AnovaManager, Depends(get_device_manager)],
+        settings: Annotated[Settings, Depends(get_settings)],
+        admin: Annotated[Optional[bool], Security(admin_auth)],
+) -> BatchResponse:
+    unknown = {operation.command for operation in batch.operations} - set(OPERATIONS)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown commands: {', '.join(sorted(unknown))}")
+    logger.info(f"Running {len(batch.operations)} operations on {len(batch.device_ids)} devices")
+    return BatchResponse(devices=await run_batch(
+        manager, batch.device_ids, batch.operations, settings.batch_concurrency or BATCH_CONCURRENCY
+    ))
+
+
+@router.get("/metrics")
+async def get_metrics(
+        manager: Annotated[AnovaManager, Depends(get_device_manager)],
+        admin: Annotated[Optional[bool], Security(admin_auth)],
+) -> Dict[str, DeviceMetrics]:
+    return {
+        device_id: DeviceMetrics(command_rate=rate, commands_in_flight=manager.devices[device_id].connection.in_flight)
+        for device_id, rate in manager.get_command_rates().items()
+    }
+
+
+@router.get("/devices/sse", response_model=SSEEvent, response_class=StreamingResponse)
+async def fleet_sse_endpoint(
+        sse_manager: Annotated[SSEManager, Depends(get_sse_manager)],
+        admin: Annotated[Optional[bool], Security(admin_auth)],
+        device_id: Annotated[Optional[List[str]], Query(description="Only these devices")] = None,
+        event_type: Annotated[Optional[List[SSEEventType]], Query(description="Only these event types")] = None,
+        field: Annotated[Optional[List[str]], Query(
+            description="Only state changes touching these fields, and only these fields of them")] = None,
+) -> StreamingResponse:
+    unknown = set(field or ()) - set(DeviceState.model_fields)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown state fields: {', '.join(sorted(unknown))}")
+    selection = SSEFilter(
+        device_ids=frozenset(device_id) if device_id else None,
+        event_types=frozenset(event_type) if event_type else None,
+        fields=frozenset(field) if field else None,
+    )
+    listener_id, listener = await sse_manager.connect_fleet(selection)
+
+    async def on_close() -> None:
+        await sse_manager.disconnect_fleet(listener_id)
+
+    logger.info("Fleet SSE started")
+    return StreamingResponse(stream_listener(listener, on_close), media_type="text/event-stream")
+
+
 @router.get("/devices/{device_id}/state")
-async def get_device_state(device: Annotated[AnovaDevice, Security(get_authenticated_device)]) -> DeviceState:
-    logger.info(f"Get state for device {device.id_card}")
+async def get_device_state(device: Annotated[AnovaDevice, Security(get_authenticated_device)], response: Response,
+                           max_age: MaxAge = None) -> DeviceState:
+    logger.debug(f"Get state for device {device.id_card}")
+    if max_age is not None:
+        await device.refresh(max_age)
+    # The state is as old as its oldest part, and has no age until every part has been read
+    ages = [device.state_age(field) for field in POLL_COMMANDS]
+    if None not in ages:
+        response.headers["X-State-Age"] = f"{max(ages):.3f}"  # type: ignore[type-var]
     return device.state
 
 
+@router.post("/devices/{device_id}/session")
+async def open_session(device_id: str, secret_key: Annotated[str, Security(get_secret_key)],
+                       manager: Annotated[AnovaManager, Depends(get_device_manager)],
+                       sessions: Annotated[SessionStore, Depends(get_session_store)]) -> SessionResponse:
+    """Trade the secret key for a session token, which authenticates requests for this device in its place."""
+    device = authenticate_device(manager, device_id, secret_key)
+    logger.info(f"Open session for device {device.id_card}")
+    token, expires_in = sessions.issue(device)
+    return SessionResponse(token=token, expires_in=expires_in)
+
+
+@router.delete("/devices/{device_id}/session")
+async def close_sessions(device: Annotated[AnovaDevice, Security(get_authenticated_device)],
+                         sessions: Annotated[SessionStore, Depends(get_session_store)]) -> OkResponse:
+    logger.info(f"Close sessions for device {device.id_card}")
+    sessions.revoke(device.id_card)  # type: ignore
+    return "ok"
+
+
 @router.post("/devices/{device_id}/target_temperature")
 async def set_temperature(temperature: Annotated[float, Body(embed=True)],
                           device: Annotated[AnovaDevice, Security(get_authenticated_device)]) -> SetTemperatureResponse:
@@ -113,31 +214,58 @@ async def clear_alarm(device: Annotated[AnovaDevice, Security(get_authenticated_
     return "ok"
 
 
-@router.get("/devices/{device_id}/temperature")
+class JSONBytesResponse(Response):
+    """A response whose body is already serialized JSON."""
+    media_type = "application/json"
+
+
+# Reads from state are polled frequently, so they log at debug level and are answered from the response cache
+async def read_state(device: AnovaDevice, response_cache: ResponseCache, field: str, state_fields: Tuple[str, ...],
+                     build: Callable[[DeviceState], BaseModel], from_state: bool,
+                     max_age: Optional[float]) -> Response:
+    """
+    Answer a read from the device state, which the heartbeat keeps up to date, unless it is older than `max_age`.
+    The age of the value is sent in the `X-State-Age` header.
+    :param field: The key of `POLL_COMMANDS` that refreshes the value
+    :param state_fields: The state fields the response is built from
+    :param from_state: False to always read the value from the device, same as a `max_age` of 0
+    """
+    if not from_state:
+        max_age = 0
+    if max_age is not None:
+        await device.refresh(max_age, [field])
+    body = response_cache.get(device, field, state_fields, build)
+    age = device.state_age(field)
+    return JSONBytesResponse(body, headers={} if age is None else {"X-State-Age": f"{age:.3f}"})
+
+
+@router.get("/devices/{device_id}/temperature", response_model=TemperatureResponse)
 async def get_temperature(device: Annotated[AnovaDevice, Security(get_authenticated_device)],
-                          from_state: bool = True) -> TemperatureResponse:
-    logger.info(f"Get temperature for device {device.id_card}")
-    if from_state:
-        return TemperatureResponse(temperature=device.state.current_temperature)
-    return TemperatureResponse(temperature=await device.send_command(GetCurrentTemperature()))
+                          response_cache: Annotated[ResponseCache, Depends(get_response_cache)],
+                          from_state: bool = True, max_age: MaxAge = None) -> Response:
+    logger.debug(f"Get temperature for device {device.id_card}")
+    return await read_state(device, response_cache, "current_temperature", ("current_temperature",),
+                            lambda state: TemperatureResponse(temperature=state.current_temperature),
+                            from_state, max_age)
 
 
-@router.get("/devices/{device_id}/target_temperature")
+@router.get("/devices/{device_id}/target_temperature", response_model=GetTargetTemperatureResponse)
 async def get_target_temperature(device: Annotated[AnovaDevice, Security(get_authenticated_device)],
-                                 from_state: bool = True) -> GetTargetTemperatureResponse:
-    logger.info(f"Get target temperature for device {device.id_card}")
-    if from_state:
-        return GetTargetTemperatureResponse(temperature=device.state.target_temperature)
-    return GetTargetTemperatureResponse(temperature=await device.send_command(GetTargetTemperature()))
+                                 response_cache: Annotated[ResponseCache, Depends(get_response_cache)],
+                                 from_state: bool = True, max_age: MaxAge = None) -> Response:
+    logger.debug(f"Get target temperature for device {device.id_card}")
+    return await read_state(device, response_cache, "target_temperature", ("target_temperature",),
+                            lambda state: GetTargetTemperatureResponse(temperature=state.target_temperature),
+                            from_state, max_age)
 
 
-@router.get("/devices/{device_id}/unit")
+@router.get("/devices/{device_id}/unit", response_model=UnitResponse)
 async def get_unit(device: Annotated[AnovaDevice, Security(get_authenticated_device)],
-                   from_state: bool = True) -> UnitResponse:
-    logger.info(f"Get unit for device {device.id_card}")
-    if from_state:
-        return UnitResponse(unit=device.state.unit)
-    return UnitResponse(unit=await device.send_command(GetTemperatureUnit()))
+                   response_cache: Annotated[ResponseCache, Depends(get_response_cache)],
+                   from_state: bool = True, max_age: MaxAge = None) -> Response:
+    logger.debug(f"Get unit for device {device.id_card}")
+    return await read_state(device, response_cache, "unit", ("unit",),
+                            lambda state: UnitResponse(unit=state.unit), from_state, max_age)
 
 
 @router.post("/devices/{device_id}/unit")
@@ -148,46 +276,81 @@ async def set_unit(unit: Annotated[TemperatureUnit, Body(embed=True)],
     return "ok"
 
 
-@router.get("/devices/{device_id}/timer")
+@router.get("/devices/{device_id}/timer", response_model=TimerResponse)
 async def get_timer(device: Annotated[AnovaDevice, Security(get_authenticated_device)],
-                    from_state: bool = True) -> TimerResponse:
-    logger.info(f"Get timer for device {device.id_card}")
-    if from_state:
-        return TimerResponse(timer=device.state.timer_value)
-    return TimerResponse(timer=await device.send_command(GetTimerStatus()))
+                    response_cache: Annotated[ResponseCache, Depends(get_response_cache)],
+                    from_state: bool = True, max_age: MaxAge = None) -> Response:
+    logger.debug(f"Get timer for device {device.id_card}")
+    return await read_state(device, response_cache, "timer", ("timer_value",),
+                            lambda state: TimerResponse(timer=state.timer_value), from_state, max_age)
 
 
-@router.get("/devices/{device_id}/speaker_status")
+@router.get("/devices/{device_id}/speaker_status", response_model=SpeakerStatusResponse)
 async def get_speaker_status(device: Annotated[AnovaDevice, Security(get_authenticated_device)],
-                             from_state: bool = True) -> SpeakerStatusResponse:
-    logger.info(f"Get speaker status for device {device.id_card}")
-    return SpeakerStatusResponse(speaker_status=await device.send_command(GetSpeakerStatus()))
+                             response_cache: Annotated[ResponseCache, Depends(get_response_cache)],
+                             from_state: bool = True, max_age: MaxAge = None) -> Response:
+    logger.debug(f"Get speaker status for device {device.id_card}")
+    return await read_state(device, response_cache, "speaker_status", ("speaker_status",),
+                            lambda state: SpeakerStatusResponse(speaker_status=state.speaker_status),
+                            from_state, max_age)
+
+
+@router.get("/devices/{device_id}/history")
+async def get_history(device: Annotated[AnovaDevice, Security(get_authenticated_device)],
+                      manager: Annotated[AnovaManager, Depends(get_device_manager)],
+                      start: Annotated[Optional[float], Query(description="Unix timestamp of the oldest sample")] = None,
+                      end: Annotated[Optional[float], Query(description="Unix timestamp of the newest sample")] = None,
+                      max_points: Annotated[int, Query(ge=1, le=5000)] = 500) -> TemperatureHistoryResponse:
+    logger.debug(f"Get history for device {device.id_card}")
+    oldest = device.history.oldest()
+    if manager.telemetry and start is not None and (oldest is None or start < oldest.timestamp):
+        # Older than what is kept in memory, read it from the telemetry log instead
+        samples = await manager.telemetry.query_samples(device.id_card, start, end, max_points)  # type: ignore
+    else:
+        samples = device.history.query(start, end, max_points)
+    return TemperatureHistoryResponse(samples=[
+        TemperatureHistorySample(
+            timestamp=sample.timestamp,
+            current_temperature=sample.current_temperature,
+            target_temperature=sample.target_temperature,
+            status=sample.status,
+        )
+        for sample in samples
+    ])
 
 
 @router.get("/devices/{device_id}/sse", response_model=SSEEvent, response_class=StreamingResponse)
 async def sse_endpoint(
-        request: Request,
         device: Annotated[AnovaDevice, Security(get_authenticated_device)],
         sse_manager: Annotated[SSEManager, Depends(get_sse_manager)],
+        last_event_id: Annotated[Optional[str], Header(description="Resume after this event")] = None,
 ) -> StreamingResponse:
-    listener_id, queue = await sse_manager.connect(device.id_card)  # type: ignore
-
-    async def event_generator() -> AsyncIterator[SSEEvent]:
-        try:
-            while True:
-                if await request.is_disconnected():
-                    break
-                try:
-                    async with asyncio.timeout(1.0):
-                        event = await queue.get()
-                        yield event
-                except asyncio.TimeoutError:
-                    yield SSEEvent(event_type=SSEEventType.ping)
-        finally:
-            await sse_manager.disconnect(device.id_card, listener_id)  # type: ignore
+    listener_id, listener = await sse_manager.connect(device.id_card, last_event_id)  # type: ignore
+
+    async def on_close() -> None:
+        await sse_manager.disconnect(device.id_card, listener_id)  # type: ignore
 
     logger.info(f"SSE started for device {device.id_card}")
-    return StreamingResponse(event_stream(event_generator()), media_type="text/event-stream")
+    return StreamingResponse(stream_listener(listener, on_close), media_type="text/event-stream")
+
+
+async def stream_listener(listener: SSEListener, on_close: Callable[[], Awaitable[None]]) -> AsyncIterator[bytes]:
+    # The response cancels this generator as soon as the client disconnects, which runs the cleanup below
+    try:
+        while True:
+            frame = await listener.get()
+            yield frame.data
+    finally:
+        await on_close()
+
+
+@router.websocket("/devices/{device_id}/ws")
+async def device_websocket(
+        websocket: WebSocket,
+        device: Annotated[AnovaDevice, Depends(get_websocket_device)],
+        sse_manager: Annotated[SSEManager, Depends(get_sse_manager)],
+) -> None:
+    await DeviceSocket(websocket, device, sse_manager).run()
 
 
 @cache
@@ -211,59 +374,34 @@ async def get_server_info(
 
 # ---- BLE PROXY ADAPTER ----
 
-def get_ble_proxy_url():
-    base = os.environ.get("BLE_PROXY_URL", "http://localhost:5000")
-    url = base.rstrip("/")
-    if not url.endswith("/scan"):
-        url += "/scan"
-    return url
-
-def get_ble_proxy_write_url():
-    base = os.environ.get("BLE_PROXY_URL", "http://localhost:5000")
-    url = base.rstrip("/")
-    if not url.endswith("/write"):
-        url += "/write"
-    return url
-
-async def proxy_ble_scan():
-    url = get_ble_proxy_url()
-    logger.info(f"Scanning BLE proxy: {url}")
+async def proxy_ble_scan(proxy: BLEProxy, max_age: Optional[float] = None):
+    logger.info(f"Scanning BLE proxy: {proxy.url}")
     try:
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, timeout=15)
-            r.raise_for_status()
-            data = r.json()
-            if not data:
-                logger.error("No BLE device found in proxy BLE scan.")
-                return None, None
-            dev = type('BLEDev', (), {})()
-            adv = type('BLEAdv', (), {})()
-            dev.address = data[0].get("address")
-            adv.local_name = data[0].get("name")
-            logger.info(f"Found BLE device at {dev.address} ({adv.local_name})")
-            return dev, adv
+        data = await proxy.scan(max_age)
+        if not data:
+            logger.error("No BLE device found in proxy BLE scan.")
+            return None, None
+        dev = type('BLEDev', (), {})()
+        adv = type('BLEAdv', (), {})()
+        dev.address = data[0].get("address")
+        adv.local_name = data[0].get("name")
+        logger.info(f"Found BLE device at {dev.address} ({adv.local_name})")
+        return dev, adv
     except Exception as e:
         logger.error(f"BLE-proxy not reachable: {e}")
         raise HTTPException(status_code=503, detail=f"BLE-proxy niet bereikbaar: {str(e)}")
 
-async def proxy_ble_write(address, command) -> str:
-    url = get_ble_proxy_write_url()
-    logger.info(f"Proxy BLE write: address={address}, command={command!r}, url={url}")
+async def proxy_ble_write(proxy: BLEProxy, address, command) -> str:
+    logger.info(f"Proxy BLE write: address={address}, command={command!r}, url={proxy.url}")
     try:
-        async with httpx.AsyncClient() as client:
-            r = await client.post(url, json={
-                "address": address,
-                "command": command
-            }, timeout=15)
-            r.raise_for_status()
-            data = r.json()
-            logger.info(f"Proxy BLE write result: {data}")
-            return data.get("result") or data.get("response", "")
+        result = await proxy.write(address, command)
+        logger.info(f"Proxy BLE write result: {result!r}")
+        return result
     except Exception as e:
         logger.error(f"BLE-proxy write failed: {e}")
         raise HTTPException(status_code=503, detail=f"BLE-proxy write failed: {str(e)}")
 
-async def _ble_proxy_command(dev, command):
+async def _ble_proxy_command(proxy: BLEProxy, dev, command):
     try:
         if hasattr(command, "encode"):
             command_str = command.encode()
@@ -273,7 +411,7 @@ async def _ble_proxy_command(dev, command):
             logger.error("Unsupported command type for BLE proxy")
             raise HTTPException(status_code=500, detail="Unsupported command type for BLE proxy")
         logger.info(f"BLE proxy command: device={getattr(dev, 'address', None)}, command={command_str!r}")
-        response = await proxy_ble_write(dev.address, command_str)
+        response = await proxy_ble_write(proxy, dev.address, command_str)
         logger.info(f"BLE proxy command response: {response!r}")
         return response.strip()
     except HTTPException:
@@ -282,11 +420,31 @@ async def _ble_proxy_command(dev, command):
         logger.error(f"Internal BLE proxy error: {e}")
         raise HTTPException(status_code=500, detail=f"Internal BLE proxy error: {str(e)}")
 
+async def _ble_proxy_session(proxy: BLEProxy, dev, commands: List[AnovaCommand]) -> List[Any]:
+    # All commands share one BLE connection on the proxy, and the responses are decoded like WiFi ones
+    logger.info(f"BLE proxy session: device={getattr(dev, 'address', None)}, commands={commands}")
+    try:
+        responses = await proxy.run(dev.address, [command.encode() for command in commands])
+    except Exception as e:
+        logger.error(f"BLE-proxy batch failed: {e}")
+        raise HTTPException(status_code=503, detail=f"BLE-proxy batch failed: {str(e)}")
+    try:
+        return [command.decode(response) for command, response in zip(commands, responses)]
+    except ValueError as e:
+        logger.error(f"Invalid BLE proxy response: {e}")
+        raise HTTPException(status_code=502, detail=f"Invalid BLE proxy response: {str(e)}")
+
 # BLE endpoints via BLE proxy
 
+ScanMaxAge = Annotated[Optional[float], Query(
+    ge=0, description="Have the proxy scan again unless it saw a device within this many seconds",
+)]
+
 @router.get("/ble/device")
-async def get_ble_device(admin: Annotated[Optional[bool], Security(admin_auth)]) -> BLEDevice:
-    dev, adv = await proxy_ble_scan()
+async def get_ble_device(admin: Annotated[Optional[bool], Security(admin_auth)],
+                         proxy: Annotated[BLEProxy, Depends(get_ble_proxy)],
+                         max_age: ScanMaxAge = None) -> BLEDevice:
+    dev, adv = await proxy_ble_scan(proxy, max_age)
     if not dev or not adv or not dev.address:
         logger.error("No BLE device found (get_ble_device)")
         raise HTTPException(status_code=404, detail="No BLE device found")
@@ -295,13 +453,14 @@ async def get_ble_device(admin: Annotated[Optional[bool], Security(admin_auth)])
 @router.post("/ble/connect_wifi")
 async def ble_connect_wifi(
         ssid: Annotated[str, Body(embed=True)],
-        password: Annotated[str, Body(embed=True)]
+        password: Annotated[str, Body(embed=True)],
+        proxy: Annotated[BLEProxy, Depends(get_ble_proxy)],
 ) -> OkResponse:
-    dev, adv = await proxy_ble_scan()
+    dev, adv = await proxy_ble_scan(proxy)
     if not dev or not dev.address:
         logger.error("No BLE device found (connect_wifi)")
         raise HTTPException(status_code=404, detail="No BLE device found")
-    await _ble_proxy_command(dev, SetWifiCredentials(ssid, password))
+    await _ble_proxy_command(proxy, dev, SetWifiCredentials(ssid, password))
     return 'ok'
 
 @router.post("/ble/config_wifi_server")
@@ -309,6 +468,7 @@ async def patch_ble_device(
         admin: Annotated[Optional[bool], Security(admin_auth)],
         manager: Annotated[AnovaManager, Depends(get_device_manager)],
         settings: Annotated[Settings, Depends(get_settings)],
+        proxy: Annotated[BLEProxy, Depends(get_ble_proxy)],
         host: Annotated[Optional[str], Body(
             embed=True,
             description="The IP address of the server."
@@ -319,35 +479,37 @@ async def patch_ble_device(
             description="The port of the server. If not provided, port of the server will be used"
         )] = None
 ) -> OkResponse:
-    dev, adv = await proxy_ble_scan()
+    dev, adv = await proxy_ble_scan(proxy)
     if not dev or not dev.address:
         logger.error("No BLE device found (config_wifi_server)")
         raise HTTPException(status_code=404, detail="No BLE device found")
     host = host or settings.server_host or get_local_host()
     port = port or manager.server.port
     logger.info(f"Configuring BLE wifi server: host={host}, port={port}")
-    await _ble_proxy_command(dev, SetServerInfo(host, port))
+    await _ble_proxy_command(proxy, dev, SetServerInfo(host, port))
     return 'ok'
 
 @router.post("/ble/restore_wifi_server")
-async def restore_ble_device(admin: Annotated[Optional[bool], Security(admin_auth)]) -> OkResponse:
-    dev, adv = await proxy_ble_scan()
+async def restore_ble_device(admin: Annotated[Optional[bool], Security(admin_auth)],
+                             proxy: Annotated[BLEProxy, Depends(get_ble_proxy)]) -> OkResponse:
+    dev, adv = await proxy_ble_scan(proxy)
     if not dev or not dev.address:
         logger.error("No BLE device found (restore_wifi_server)")
         raise HTTPException(status_code=404, detail="No BLE device found")
-    await _ble_proxy_command(dev, SetServerInfo())
+    await _ble_proxy_command(proxy, dev, SetServerInfo())
     return 'ok'
 
 @router.get("/ble/")
-async def ble_get_info(admin: Annotated[Optional[bool], Security(admin_auth)]) -> BLEDeviceInfo:
-    dev, adv = await proxy_ble_scan()
+async def ble_get_info(admin: Annotated[Optional[bool], Security(admin_auth)],
+                       proxy: Annotated[BLEProxy, Depends(get_ble_proxy)],
+                       max_age: ScanMaxAge = None) -> BLEDeviceInfo:
+    dev, adv = await proxy_ble_scan(proxy, max_age)
     if not dev or not dev.address:
         logger.error("No BLE device found (ble_get_info)")
         raise HTTPException(status_code=404, detail="No BLE device found")
-    id_card = await _ble_proxy_command(dev, GetIDCard())
-    ver = await _ble_proxy_command(dev, GetVersion())
-    unit = await _ble_proxy_command(dev, GetTemperatureUnit())
-    speaker = await _ble_proxy_command(dev, GetSpeakerStatus())
+    id_card, ver, unit, speaker = await _ble_proxy_session(
+        proxy, dev, [GetIDCard(), GetVersion(), GetTemperatureUnit(), GetSpeakerStatus()]
+    )
     return BLEDeviceInfo(
         ble_address=dev.address,
         ble_name=getattr(adv, "local_name", None),
@@ -358,13 +520,14 @@ async def ble_get_info(admin: Annotated[Optional[bool], Security(admin_auth)]) -
     )
 
 @router.post("/ble/secret_key")
-async def ble_new_secret_key(admin: Annotated[Optional[bool], Security(admin_auth)]) -> NewSecretResponse:
-    dev, adv = await proxy_ble_scan()
+async def ble_new_secret_key(admin: Annotated[Optional[bool], Security(admin_auth)],
+                             proxy: Annotated[BLEProxy, Depends(get_ble_proxy)]) -> NewSecretResponse:
+    dev, adv = await proxy_ble_scan(proxy)
     if not dev or not dev.address:
         logger.error("No BLE device found (secret_key)")
         raise HTTPException(status_code=404, detail="No BLE device found")
     characters = string.ascii_lowercase + string.digits
     secret_key = ''.join(random.choice(characters) for _ in range(10))
     logger.info(f"Setting new BLE secret key: {secret_key}")
-    await _ble_proxy_command(dev, SetSecretKey(secret_key))
+    await _ble_proxy_command(proxy, dev, SetSecretKey(secret_key))
     return NewSecretResponse(secret_key=secret_key)
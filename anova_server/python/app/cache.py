@@ -0,0 +1,83 @@
+import hashlib
+from typing import Callable, Dict, List, Tuple
+
+from pydantic import BaseModel, TypeAdapter
+
+from anova_wifi.device import AnovaDevice, DeviceState
+from anova_wifi.manager import AnovaManager
+from .models import DeviceStateInfo
+
+_DEVICE_STATES = TypeAdapter(List[DeviceStateInfo])
+
+
+class FleetStateCache:
+    """
+    The serialized state of every connected device, rebuilt only after the manager's generation has moved on, i.e.
+    after a device connected, disconnected or changed state. The ETag is a hash of the body, so it stays valid
+    across restarts as long as nothing changed.
+    """
+
+    def __init__(self, manager: AnovaManager):
+        self.manager = manager
+        self._generation = -1
+        self._body = b""
+        self._etag = ""
+
+    def get(self) -> Tuple[bytes, str]:
+        """
+        :return: The JSON body and its ETag
+        """
+        if self._generation != self.manager.generation:
+            generation = self.manager.generation
+            self._body = _DEVICE_STATES.dump_json([
+                DeviceStateInfo(id=device.id_card, version=device.version, state=device.state)
+                for device in self.manager.get_devices() if device.id_card
+            ])
+            self._etag = f'"{hashlib.sha1(self._body).hexdigest()}"'
+            self._generation = generation
+        return self._body, self._etag
+
+
+class ResponseCache:
+    """
+    JSON bodies of responses built from device state, per device and endpoint.
+    An entry remains valid as long as the fields it was built from keep the versions they had then, so repeated
+    reads of an unchanged value skip building and serializing the response model. Entries of devices that are no
+    longer connected are dropped on the first rebuild after the manager's generation has moved on.
+    """
+
+    def __init__(self, manager: AnovaManager):
+        self.manager = manager
+        self._generation = manager.generation
+        self._entries: Dict[Tuple[str, str], Tuple[DeviceState, Tuple[int, ...], bytes]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, device: AnovaDevice, name: str, fields: Tuple[str, ...],
+            build: Callable[[DeviceState], BaseModel]) -> bytes:
+        """
+        Get the JSON body of a response, building it only if the fields it depends on changed
+        :param device: The device
+        :param name: Identifies the response among those of the device
+        :param fields: The state fields the response is built from
+        :param build: Builds the response from the state
+        :return: The JSON body
+        """
+        state = device.state
+        versions = tuple(state.field_version(field) for field in fields)
+        key = (device.id_card or "", name)
+        entry = self._entries.get(key)
+        # A reconnected device starts over with a new state, whose versions may repeat those of the old one
+        if entry is not None and entry[0] is state and entry[1] == versions:
+            return entry[2]
+        if self._generation != self.manager.generation:
+            self._prune()
+        body = build(state).model_dump_json().encode()
+        self._entries[key] = (state, versions, body)
+        return body
+
+    def _prune(self) -> None:
+        self._generation = self.manager.generation
+        live = {device.id_card: device.state for device in self.manager.get_devices()}
+        self._entries = {key: entry for key, entry in self._entries.items() if live.get(key[0]) is entry[0]}
@@ -2,28 +2,56 @@ import ipaddress
 import secrets
 from typing import Annotated, Optional
 
-from fastapi import Request, Depends, Security, HTTPException, status
+from fastapi import Request, Depends, Security, HTTPException, WebSocket, WebSocketException, status
+from starlette.requests import HTTPConnection
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, APIKeyQuery, HTTPBasic, HTTPBasicCredentials
 
+from anova_ble.proxy import BLEProxy
 from anova_wifi.device import AnovaDevice
 from anova_wifi.manager import AnovaManager
+from .cache import FleetStateCache, ResponseCache
+from .sessions import SessionStore
 from .settings import Settings
 from .sse import SSEManager
 
 
-async def get_device_manager(request: Request) -> AnovaManager:
+async def get_device_manager(request: HTTPConnection) -> AnovaManager:
     if request.app.state.anova_manager is None:
         raise RuntimeError("Manager not initialized. Please wait for application startup to complete.")
     return request.app.state.anova_manager
 
 
-def get_sse_manager(request: Request) -> SSEManager:
+def get_sse_manager(request: HTTPConnection) -> SSEManager:
     if request.app.state.sse_manager is None:
         raise RuntimeError("SSE Manager not initialized. Please wait for application startup to complete.")
     return request.app.state.sse_manager
 
 
-def get_settings(request: Request) -> Settings:
+def get_state_cache(request: HTTPConnection) -> FleetStateCache:
+    if request.app.state.state_cache is None:
+        raise RuntimeError("State cache not initialized. Please wait for application startup to complete.")
+    return request.app.state.state_cache
+
+
+def get_response_cache(request: HTTPConnection) -> ResponseCache:
+    if request.app.state.response_cache is None:
+        raise RuntimeError("Response cache not initialized. Please wait for application startup to complete.")
+    return request.app.state.response_cache
+
+
+def get_session_store(request: HTTPConnection) -> SessionStore:
+    if request.app.state.session_store is None:
+        raise RuntimeError("Session store not initialized. Please wait for application startup to complete.")
+    return request.app.state.session_store
+
+
+def get_ble_proxy(request: HTTPConnection) -> BLEProxy:
+    if request.app.state.ble_proxy is None:
+        raise RuntimeError("BLE proxy not initialized. Please wait for application startup to complete.")
+    return request.app.state.ble_proxy
+
+
+def get_settings(request: HTTPConnection) -> Settings:
     if request.app.state.settings is None:
         raise RuntimeError("Settings not initialized. Please wait for application startup to complete.")
     return request.app.state.settings
@@ -47,11 +75,7 @@ def get_secret_key(
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
 
-async def get_authenticated_device(
-        device_id: str,
-        secret_key: Annotated[str, Security(get_secret_key)],
-        manager: Annotated[AnovaManager, Depends(get_device_manager)]
-) -> AnovaDevice:
+def authenticate_device(manager: AnovaManager, device_id: str, secret_key: str) -> AnovaDevice:
     device = manager.get_device(device_id)
     if not device:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found.")
@@ -62,6 +86,45 @@ async def get_authenticated_device(
     return device
 
 
+def authenticate_credential(manager: AnovaManager, sessions: SessionStore, device_id: str,
+                            credential: str) -> AnovaDevice:
+    """Authenticate with either the secret key of the device or a session token, which contains a dot."""
+    if "." not in credential:
+        return authenticate_device(manager, device_id, credential)
+    device = sessions.authenticate(device_id, credential)
+    if device is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    return device
+
+
+async def get_authenticated_device(
+        device_id: str,
+        secret_key: Annotated[str, Security(get_secret_key)],
+        manager: Annotated[AnovaManager, Depends(get_device_manager)],
+        sessions: Annotated[SessionStore, Depends(get_session_store)],
+) -> AnovaDevice:
+    return authenticate_credential(manager, sessions, device_id, secret_key)
+
+
+async def get_websocket_device(
+        websocket: WebSocket,
+        device_id: str,
+        manager: Annotated[AnovaManager, Depends(get_device_manager)],
+        sessions: Annotated[SessionStore, Depends(get_session_store)],
+        secret_key: Optional[str] = None,
+) -> AnovaDevice:
+    """Authenticate a WebSocket handshake, with the `secret_key` query parameter or a bearer token."""
+    authorization = websocket.headers.get("authorization", "")
+    if not secret_key and authorization.lower().startswith("bearer "):
+        secret_key = authorization[len("bearer "):]
+    if not secret_key:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Unauthorized")
+    try:
+        return authenticate_credential(manager, sessions, device_id, secret_key)
+    except HTTPException as e:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+
+
 async def admin_auth(
         request: Request,
         credentials: Annotated[HTTPBasicCredentials|None, Security(basic_auth_scheme)],
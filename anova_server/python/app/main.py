@@ -10,11 +10,17 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 
+from anova_ble.proxy import BLEProxy, BLE_PROXY_URL, BLE_PROXY_TIMEOUT, BLE_PROXY_SCAN_TIMEOUT
+from anova_wifi.connection import PIPELINE_DEPTH
 from anova_wifi.manager import AnovaManager
+from anova_wifi.telemetry import TelemetryLog
 from app.deps import get_settings
+from app.models import SSEQueuePolicy
 from app.settings import Settings
 from .api import router as anova_router
-from .sse import SSEManager
+from .cache import FleetStateCache, ResponseCache
+from .sessions import SessionStore, SESSION_TTL
+from .sse import SSEManager, SSE_QUEUE_SIZE, SSE_KEEPALIVE_INTERVAL
 
 
 @asynccontextmanager
@@ -26,14 +32,36 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, Never]:
         app.mount('/static', StaticFiles(directory=settings.frontend_dist_dir), name='static')
 
     # Startup
-    app.state.anova_manager = AnovaManager(host="0.0.0.0", port=settings.anova_server_port or 8080)
-    app.state.sse_manager = SSEManager(app.state.anova_manager)
+    app.state.anova_manager = AnovaManager(
+        host="0.0.0.0",
+        port=settings.anova_server_port or 8080,
+        pipeline_depth=settings.anova_pipeline_depth or PIPELINE_DEPTH,
+        telemetry=TelemetryLog(settings.telemetry_dir) if settings.telemetry_dir else None,
+    )
+    app.state.sse_manager = SSEManager(
+        app.state.anova_manager,
+        queue_size=settings.sse_queue_size or SSE_QUEUE_SIZE,
+        queue_policy=settings.sse_queue_policy or SSEQueuePolicy.coalesce,
+        keepalive_interval=settings.sse_keepalive_interval or SSE_KEEPALIVE_INTERVAL,
+    )
+    app.state.sse_manager.register_callbacks()
+    app.state.state_cache = FleetStateCache(app.state.anova_manager)
+    app.state.response_cache = ResponseCache(app.state.anova_manager)
+    app.state.session_store = SessionStore(app.state.anova_manager, settings.session_ttl or SESSION_TTL)
+    app.state.ble_proxy = BLEProxy(
+        settings.ble_proxy_url or BLE_PROXY_URL,
+        timeout=settings.ble_proxy_timeout or BLE_PROXY_TIMEOUT,
+        scan_timeout=settings.ble_proxy_scan_timeout or BLE_PROXY_SCAN_TIMEOUT,
+    )
+    app.state.sse_manager.start()
     startup_task = asyncio.create_task(app.state.anova_manager.start())
     print("Starting up... Manager initialization started in background.")
 
     yield  # The FastAPI application runs here
 
     # Shutdown
+    await app.state.sse_manager.stop()
+    await app.state.ble_proxy.close()
     if app.state.anova_manager:
         await app.state.anova_manager.stop()
     startup_task.cancel()
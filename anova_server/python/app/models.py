@@ -1,11 +1,11 @@
 import enum
-from typing import Optional, Union, Literal
+from typing import Optional, Union, Literal, List, Dict, Any
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
-from anova_wifi.device import DeviceState
+from anova_wifi.device import DeviceState, DeviceStateDelta
 from anova_wifi.event import AnovaEvent
-from commands import TemperatureUnit
+from commands import TemperatureUnit, DeviceStatus
 
 OkResponse = Literal['ok']
 
@@ -20,13 +20,52 @@ class SSEEventType(enum.StrEnum):
     device_disconnected = "device_disconnected"
     state_changed = "state_changed"
     event = "event"
+    snapshot = "snapshot"
     ping = "ping"
 
 
+class SSEQueuePolicy(enum.StrEnum):
+    drop_oldest = "drop_oldest"  # a full queue drops its oldest message
+    coalesce = "coalesce"  # pending state changes of a device are merged into one, then drop oldest
+
+
 class SSEEvent(BaseModel):
     event_type: SSEEventType
     device_id: Optional[str] = None
-    payload: Optional[Union[AnovaEvent, DeviceState]] = None
+    payload: Optional[Union[AnovaEvent, DeviceStateDelta, DeviceState]] = None
+
+
+class AnovaOperation(BaseModel):
+    """A command named after its class in `commands`, e.g. `{"command": "SetTimer", "args": {"minutes": 90}}`."""
+    command: str
+    args: Dict[str, Any] = {}
+
+
+class WSCommand(AnovaOperation):
+    """An operation sent over a device WebSocket, with an id to match it to its `WSResult`."""
+    id: Optional[Union[int, str]] = None
+
+
+class WSResult(BaseModel):
+    """The outcome of a `WSCommand`, with the same `id`."""
+    id: Optional[Union[int, str]] = None
+    result: Any = None
+    error: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    device_ids: List[str] = Field(min_length=1)
+    operations: List[AnovaOperation] = Field(min_length=1)
+
+
+class BatchDeviceResult(BaseModel):
+    """Results of the operations that ran on one device, in order; they stop at the first error."""
+    results: List[Any] = []
+    error: Optional[str] = None
+
+
+class BatchResponse(BaseModel):
+    devices: Dict[str, BatchDeviceResult]
 
 
 class DeviceInfo(BaseModel):
@@ -34,6 +73,15 @@ class DeviceInfo(BaseModel):
     version: Optional[str]
 
 
+class DeviceStateInfo(DeviceInfo):
+    state: DeviceState
+
+
+class DeviceMetrics(BaseModel):
+    command_rate: float
+    commands_in_flight: int
+
+
 class TemperatureResponse(BaseModel):
     temperature: float
 
@@ -63,11 +111,27 @@ class TimerResponse(BaseModel):
     timer: int
 
 
+class TemperatureHistorySample(BaseModel):
+    timestamp: float
+    current_temperature: float
+    target_temperature: float
+    status: DeviceStatus
+
+
+class TemperatureHistoryResponse(BaseModel):
+    samples: List[TemperatureHistorySample]
+
+
 class BLEDevice(BaseModel):
     address: str
     name: str
 
 
+class SessionResponse(BaseModel):
+    token: str
+    expires_in: float
+
+
 class NewSecretResponse(BaseModel):
     secret_key: str
 
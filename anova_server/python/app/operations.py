@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Type
+
+from anova_wifi.manager import AnovaManager
+from anova_wifi.device import AnovaDevice
+from commands import AnovaCommand, SetTargetTemperature, SetTimer, SetTemperatureUnit, StartDevice, StopDevice, \
+    StartTimer, StopTimer, ClearAlarm, GetCurrentTemperature, GetTargetTemperature, GetTemperatureUnit, \
+    GetTimerStatus, GetDeviceStatus, GetSpeakerStatus, TemperatureUnit
+from .models import AnovaOperation, BatchDeviceResult
+
+logger = logging.getLogger("anova_operations")
+
+BATCH_CONCURRENCY = 16  # devices a batch works on at the same time
+
+# Commands a client may send by name, over the WebSocket or in a batch
+OPERATIONS: Dict[str, Type[AnovaCommand]] = {command.__name__: command for command in (
+    SetTargetTemperature, SetTimer, SetTemperatureUnit, StartDevice, StopDevice, StartTimer, StopTimer, ClearAlarm,
+    GetCurrentTemperature, GetTargetTemperature, GetTemperatureUnit, GetTimerStatus, GetDeviceStatus,
+    GetSpeakerStatus,
+)}
+
+
+def build_command(device: AnovaDevice, operation: AnovaOperation) -> AnovaCommand:
+    """
+    Turn an operation into the command it names
+    :param device: The device the command is for
+    :param operation: The operation; `args` are the keyword arguments of the command class
+    :return: The command
+    """
+    command_class = OPERATIONS.get(operation.command)
+    if command_class is None:
+        raise ValueError(f"Unknown command: {operation.command}")
+    args: Dict[str, Any] = dict(operation.args)
+    if command_class is SetTargetTemperature:
+        args.setdefault("unit", device.state.unit)
+    if "unit" in args and args["unit"] is not None:
+        args["unit"] = TemperatureUnit(args["unit"])
+    try:
+        return command_class(**args)
+    except TypeError as e:
+        raise ValueError(f"Invalid arguments for {operation.command}: {e}")
+
+
+async def run_batch(manager: AnovaManager, device_ids: List[str], operations: List[AnovaOperation],
+                    concurrency: int = BATCH_CONCURRENCY) -> Dict[str, BatchDeviceResult]:
+    """
+    Run the same operations on many devices.
+    Each device runs the operations in order and stops at its first error. Up to `concurrency` devices are worked
+    on at the same time, so a batch of that many devices takes about as long as its slowest device.
+    :param manager: The device manager
+    :param device_ids: The devices to run the operations on
+    :param operations: The operations
+    :param concurrency: How many devices to work on at the same time
+    :return: The results by device ID
+    """
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run(device_id: str) -> BatchDeviceResult:
+        device = manager.get_device(device_id)
+        if device is None:
+            return BatchDeviceResult(error="Device not found.")
+        result = BatchDeviceResult()
+        async with limit:
+            for operation in operations:
+                try:
+                    result.results.append(await device.send_command(build_command(device, operation)))
+                except Exception as e:
+                    logger.warning(f"Batch command {operation.command} failed for device {device_id}: {e}")
+                    result.error = str(e) or type(e).__name__
+                    break
+        return result
+
+    unique_ids = list(dict.fromkeys(device_ids))
+    return dict(zip(unique_ids, await asyncio.gather(*(run(device_id) for device_id in unique_ids))))
@@ -0,0 +1,74 @@
+import secrets
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from anova_wifi.device import AnovaDevice
+from anova_wifi.manager import AnovaManager
+
+SESSION_TTL = 3600.0  # seconds a session token stays valid
+
+
+class _Session(NamedTuple):
+    secret: bytes
+    device_id: str
+    device: AnovaDevice
+    secret_key: str  # the device's key when the session was opened
+    expires: float
+
+
+class SessionStore:
+    """
+    Session tokens issued to clients that authenticated with the secret key of a device, valid for that device only.
+    A token is `<id>.<secret>`: the id finds the session and the secret is compared in constant time. A session ends
+    when it expires, when the device disconnects (a reconnecting device is a new `AnovaDevice`) or when the device's
+    secret key changes, whichever comes first; it is then dropped on its next use.
+    """
+    _sessions: Dict[str, _Session]
+
+    def __init__(self, manager: AnovaManager, ttl: float = SESSION_TTL):
+        self.manager = manager
+        self.ttl = ttl
+        self._sessions = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def issue(self, device: AnovaDevice) -> Tuple[str, float]:
+        """
+        Open a session for an authenticated device
+        :param device: The device
+        :return: The token and the number of seconds it is valid for
+        """
+        self._prune()
+        session_id, secret = secrets.token_urlsafe(9), secrets.token_urlsafe(24)
+        self._sessions[session_id] = _Session(
+            secret.encode(), device.id_card, device, device.secret_key, time.monotonic() + self.ttl  # type: ignore
+        )
+        return f"{session_id}.{secret}", self.ttl
+
+    def authenticate(self, device_id: str, token: str) -> Optional[AnovaDevice]:
+        """
+        Look up the device of a session
+        :param device_id: The device the request is for
+        :param token: The session token
+        :return: The device, or None if the token is not a valid session for it
+        """
+        session_id, _, secret = token.partition(".")
+        session = self._sessions.get(session_id)
+        if session is None or not secrets.compare_digest(session.secret, secret.encode()):
+            return None
+        if not self._valid(session):
+            del self._sessions[session_id]
+            return None
+        return session.device if session.device_id == device_id else None
+
+    def revoke(self, device_id: str) -> None:
+        """End all sessions of a device."""
+        self._sessions = {key: session for key, session in self._sessions.items() if session.device_id != device_id}
+
+    def _valid(self, session: _Session) -> bool:
+        return (session.expires > time.monotonic() and self.manager.get_device(session.device_id) is session.device
+                and session.device.secret_key == session.secret_key)
+
+    def _prune(self) -> None:
+        self._sessions = {key: session for key, session in self._sessions.items() if self._valid(session)}
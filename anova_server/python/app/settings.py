@@ -2,6 +2,8 @@ from typing import Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from .models import SSEQueuePolicy
+
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
@@ -14,6 +16,18 @@ class Settings(BaseSettings):
 
     server_host: Optional[str] = None
     anova_server_port: Optional[int] = None
+    anova_pipeline_depth: Optional[int] = None
+    telemetry_dir: Optional[str] = None
+    batch_concurrency: Optional[int] = None
+    session_ttl: Optional[float] = None
+
+    sse_queue_size: Optional[int] = None
+    sse_queue_policy: Optional[SSEQueuePolicy] = None
+    sse_keepalive_interval: Optional[float] = None
+
+    ble_proxy_url: Optional[str] = None
+    ble_proxy_timeout: Optional[float] = None
+    ble_proxy_scan_timeout: Optional[float] = None
 
     frontend_dist_dir: Optional[str] = None
 
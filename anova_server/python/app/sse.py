@@ -1,37 +1,215 @@
 import asyncio
 import uuid
-from typing import Dict, AsyncIterator
+from collections import deque
+from typing import Deque, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
 
-from pydantic import BaseModel
-
-from anova_wifi.device import AnovaDevice, DeviceState
+from anova_wifi.device import AnovaDevice, DeviceState, DeviceStateDelta
 from anova_wifi.event import AnovaEvent
 from anova_wifi.manager import AnovaManager
-from .models import SSEEvent, SSEEventType
+from .models import SSEEvent, SSEEventType, SSEQueuePolicy
+
+SSE_QUEUE_SIZE = 100  # messages waiting per listener before the queue policy kicks in
+SSE_KEEPALIVE_INTERVAL = 15.0  # seconds a stream may stay silent before it gets a ping
+SSE_REPLAY_SIZE = 256  # recent messages kept per device for clients that reconnect
+
+
+class SSEFrame(NamedTuple):
+    """
+    An event together with its encoded `id:`/`event:`/`data:` message and its JSON, shared by every listener it is
+    sent to.
+    """
+    event: SSEEvent
+    data: bytes
+    json: str
+    id: Optional[int] = None
+
+    @classmethod
+    def encode(cls, event: SSEEvent, event_id: Optional[int] = None) -> 'SSEFrame':
+        return cls.from_json(event, event.model_dump_json(), event_id)
+
+    @classmethod
+    def from_json(cls, event: SSEEvent, json: str, event_id: Optional[int] = None) -> 'SSEFrame':
+        id_line = "" if event_id is None else f"id: {event_id}\n"
+        return cls(event, f"{id_line}event: {event.event_type.value}\ndata: {json}\n\n".encode(), json, event_id)
+
+    def without_id(self) -> 'SSEFrame':
+        """The same frame with no `id:` line, reusing its JSON rather than serializing the event again."""
+        return self if self.id is None else SSEFrame.from_json(self.event, self.json)
+
+
+PING = SSEFrame.encode(SSEEvent(event_type=SSEEventType.ping))
+
+
+class SSEFilter(NamedTuple):
+    """Which events a fleet listener receives; None means no restriction."""
+    device_ids: Optional[FrozenSet[str]] = None
+    event_types: Optional[FrozenSet[SSEEventType]] = None
+    fields: Optional[FrozenSet[str]] = None  # state changes must touch one of these, and only they are sent
+
+    def matches(self, event: SSEEvent) -> bool:
+        if self.device_ids is not None and event.device_id not in self.device_ids:
+            return False
+        if self.event_types is not None and event.event_type not in self.event_types:
+            return False
+        if self.fields is not None and event.event_type == SSEEventType.state_changed:
+            assert isinstance(event.payload, DeviceStateDelta)
+            return not self.fields.isdisjoint(event.payload.changes)
+        return True
+
+
+class SSEListener:
+    """
+    Bounded queue of frames waiting to be sent to one client.
+    Putting never blocks: once `max_size` frames are waiting the oldest one is dropped. With the coalesce policy, a
+    state change first replaces any state change of the same device that the client hasn't received yet, merging
+    their deltas, so a slow client skips intermediate states instead of falling further behind.
+    """
+
+    def __init__(self, max_size: int = SSE_QUEUE_SIZE, policy: SSEQueuePolicy = SSEQueuePolicy.coalesce):
+        if max_size < 1:
+            raise ValueError("SSE queue size must be at least 1")
+        self.max_size = max_size
+        self.policy = policy
+        self.dropped = 0
+        self.idle = True  # nothing was sent since the last keepalive tick
+        self._frames: Deque[SSEFrame] = deque()
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._frames)
 
+    def put(self, frame: SSEFrame) -> None:
+        if self.policy == SSEQueuePolicy.coalesce and frame.event.event_type == SSEEventType.state_changed:
+            frame = self._coalesce(frame)
+        if len(self._frames) >= self.max_size:
+            self._frames.popleft()
+            self.dropped += 1
+        self._frames.append(frame)
+        self.idle = False
+        self._ready.set()
 
-async def event_stream(resp: AsyncIterator[BaseModel]) -> AsyncIterator[str]:
-    async for event in resp:
-        evnt = event.__class__.__name__
-        if hasattr(event, "event_type"):
-            evnt = event.event_type
-        yield f"event: {evnt}\ndata: {event.model_dump_json()}\n\n"
+    def replay(self, frames: List[SSEFrame]) -> None:
+        """Queue frames a reconnecting client missed, as they were sent; there must be room for all of them."""
+        assert len(self._frames) + len(frames) <= self.max_size
+        self._frames.extend(frames)
+        if frames:
+            self.idle = False
+            self._ready.set()
+
+    async def get(self) -> SSEFrame:
+        while not self._frames:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._frames.popleft()
+
+    def _coalesce(self, frame: SSEFrame) -> SSEFrame:
+        for i in range(len(self._frames) - 1, -1, -1):
+            pending = self._frames[i].event
+            if pending.event_type == SSEEventType.state_changed and pending.device_id == frame.event.device_id:
+                del self._frames[i]
+                assert isinstance(pending.payload, DeviceStateDelta)
+                assert isinstance(frame.event.payload, DeviceStateDelta)
+                merged = DeviceStateDelta(
+                    revision=frame.event.payload.revision,
+                    changes={**pending.payload.changes, **frame.event.payload.changes},
+                )
+                # Only a client that is behind pays for encoding its own merged frame
+                return SSEFrame.encode(frame.event.model_copy(update={"payload": merged}), frame.id)
+        return frame
 
 
 class SSEManager:
-    _listeners: Dict[str, Dict[str, asyncio.Queue[SSEEvent]]] = {}
+    """
+    Fans device events out to SSE listeners.
+    Every message about a device gets the next id in that device's sequence, and the last `replay_size` messages are
+    kept so that a client reconnecting with `Last-Event-ID` is sent exactly what it missed. When that is no longer
+    available the client gets a snapshot of the full state instead. Both are dropped when the device disconnects; a
+    sequence always starts after the highest id issued so far, so ids are never reused by a device that reconnects.
+    Fleet streams mix devices, whose sequences mean nothing to each other, so their messages carry no id.
+    Keepalives come from a single timer: every `keepalive_interval` seconds, each listener that was sent nothing since
+    the previous tick gets a ping, so idle streams cost one queue put per interval and no wakeups of their own.
+    """
+    _listeners: Dict[str, Dict[str, SSEListener]]
+    _fleet_listeners: Dict[str, Tuple[SSEFilter, SSEListener]]
+    _sequences: Dict[str, int]
+    _replay: Dict[str, Deque[SSEFrame]]
+    _keepalive_task: Optional[asyncio.Task[None]]
 
-    def __init__(self, device_manager: AnovaManager):
+    def __init__(self, device_manager: AnovaManager, queue_size: int = SSE_QUEUE_SIZE,
+                 queue_policy: SSEQueuePolicy = SSEQueuePolicy.coalesce,
+                 keepalive_interval: float = SSE_KEEPALIVE_INTERVAL, replay_size: int = SSE_REPLAY_SIZE):
         self.device_manager = device_manager
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.keepalive_interval = keepalive_interval
+        self.replay_size = replay_size
+        self._listeners = {}
+        self._fleet_listeners = {}
+        self._sequences = {}
+        self._last_id = 0
+        self._replay = {}
+        self._keepalive_task = None
+
+    def start(self) -> None:
+        if not self._keepalive_task:
+            self._keepalive_task = asyncio.create_task(self._keepalive())
+
+    async def stop(self) -> None:
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+            try:
+                await self._keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self._keepalive_task = None
 
-    async def connect(self, device_id: str) -> tuple[str, asyncio.Queue[SSEEvent]]:
+    async def _keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            listeners = [listener for device in self._listeners.values() for listener in device.values()]
+            listeners.extend(listener for _, listener in self._fleet_listeners.values())
+            for listener in listeners:
+                if listener.idle:
+                    listener.put(PING)
+                listener.idle = True
+
+    async def connect(self, device_id: str, last_event_id: Optional[str] = None) -> tuple[str, SSEListener]:
+        """
+        Listen to the events of a device
+        :param device_id: The device ID
+        :param last_event_id: The id of the last message a reconnecting client received
+        :return: The listener ID and the listener
+        """
         if device_id not in self._listeners:
             self._listeners[device_id] = {}
 
         listener_id = str(uuid.uuid4())
-        queue: asyncio.Queue[SSEEvent] = asyncio.Queue()
-        self._listeners[device_id][listener_id] = queue
-        return listener_id, queue
+        listener = SSEListener(self.queue_size, self.queue_policy)
+        if last_event_id is not None:
+            self._resume(device_id, listener, last_event_id)
+        self._listeners[device_id][listener_id] = listener
+        return listener_id, listener
+
+    def _resume(self, device_id: str, listener: SSEListener, last_event_id: str) -> None:
+        current = self._sequences.get(device_id, 0)
+        try:
+            last = int(last_event_id)
+        except ValueError:
+            last = -1
+        if last == current:
+            return
+
+        missed = [frame for frame in self._replay.get(device_id, ()) if (frame.id or 0) > last]
+        # Ids from before a restart may be ahead of the sequence, and a gap longer than the queue would be cut short
+        if 0 <= last < current and len(missed) == current - last and len(missed) <= listener.max_size:
+            listener.replay(missed)
+            return
+
+        device = self.device_manager.get_device(device_id)
+        listener.put(SSEFrame.encode(
+            SSEEvent(device_id=device_id, event_type=SSEEventType.snapshot, payload=device.state if device else None),
+            current or None,
+        ))
 
     async def disconnect(self, device_id: str, listener_id: str) -> None:
         if device_id in self._listeners and listener_id in self._listeners[device_id]:
@@ -39,11 +217,56 @@ class SSEManager:
             if not self._listeners[device_id]:
                 del self._listeners[device_id]
 
+    async def connect_fleet(self, selection: SSEFilter = SSEFilter()) -> tuple[str, SSEListener]:
+        """
+        Listen to the events of all devices on a single queue
+        :param selection: Which events to receive
+        :return: The listener ID and the listener
+        """
+        listener_id = str(uuid.uuid4())
+        listener = SSEListener(self.queue_size, self.queue_policy)
+        self._fleet_listeners[listener_id] = (selection, listener)
+        return listener_id, listener
+
+    async def disconnect_fleet(self, listener_id: str) -> None:
+        self._fleet_listeners.pop(listener_id, None)
+
     async def broadcast(self, event: SSEEvent) -> None:
         device_id = event.device_id
-        if device_id in self._listeners:
-            for queue in self._listeners[device_id].values():
-                await queue.put(event)
+        event_id = None
+        if device_id is not None:
+            event_id = self._sequences[device_id] = self._sequences.get(device_id, self._last_id) + 1
+            self._last_id = max(self._last_id, event_id)
+        frame = SSEFrame.encode(event, event_id)  # serialized once, whatever the number of listeners
+
+        if device_id is not None:
+            if device_id not in self._replay:
+                self._replay[device_id] = deque(maxlen=self.replay_size)
+            self._replay[device_id].append(frame)
+            for listener in self._listeners.get(device_id, {}).values():
+                listener.put(frame)
+
+        # Listeners with the same field selection share the same trimmed frame, and all others the same untrimmed one
+        fleet_frame: Optional[SSEFrame] = None
+        trimmed: Dict[FrozenSet[str], SSEFrame] = {}
+        for selection, listener in self._fleet_listeners.values():
+            if not selection.matches(event):
+                continue
+            fields = selection.fields if event.event_type == SSEEventType.state_changed else None
+            if fields is None:
+                if fleet_frame is None:
+                    fleet_frame = frame.without_id()
+                listener.put(fleet_frame)
+                continue
+            if fields not in trimmed:
+                trimmed[fields] = SSEFrame.encode(self._trim(event, fields))
+            listener.put(trimmed[fields])
+
+    @staticmethod
+    def _trim(event: SSEEvent, fields: FrozenSet[str]) -> SSEEvent:
+        assert isinstance(event.payload, DeviceStateDelta)
+        changes = {name: value for name, value in event.payload.changes.items() if name in fields}
+        return event.model_copy(update={"payload": DeviceStateDelta(revision=event.payload.revision, changes=changes)})
 
     async def device_connected_callback(self, device: AnovaDevice) -> None:
         event = SSEEvent(
@@ -58,12 +281,14 @@ class SSEManager:
             event_type=SSEEventType.device_disconnected,
         )
         await self.broadcast(event)
+        self._sequences.pop(device_id, None)
+        self._replay.pop(device_id, None)
 
-    async def device_state_change_callback(self, device_id: str, state: DeviceState) -> None:
+    async def device_state_change_callback(self, device_id: str, state: DeviceState, delta: DeviceStateDelta) -> None:
         event = SSEEvent(
             device_id=device_id,
             event_type=SSEEventType.state_changed,
-            payload=state
+            payload=delta
         )
         await self.broadcast(event)
 
@@ -0,0 +1,177 @@
+import json
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from anova_ble.proxy import BLEProxy
+from anova_ble.testing import batch_response
+from .api import router
+from .deps import admin_auth
+from .models import SpeakerStatusResponse
+from .testing import make_app, DEVICE_ID, SECRET
+
+
+def test_device_states_are_cached_with_an_etag() -> None:
+    app = make_app()
+    app.dependency_overrides[admin_auth] = lambda: "admin"
+    with TestClient(app) as client:
+        response = client.get("/api/devices/states")
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert response.json() == [{
+            "id": DEVICE_ID, "version": None,
+            "state": {
+                "status": "stopped", "current_temperature": 0.0, "target_temperature": 0.0, "timer_running": False,
+                "timer_value": 0, "unit": None, "speaker_status": False,
+            },
+        }]
+
+        cache = app.state.state_cache
+        body, _ = cache.get()
+        client.get("/api/devices/states")
+        assert cache.get()[0] is body  # not rebuilt while nothing changed
+
+        response = client.get("/api/devices/states", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert client.get("/api/devices/states", headers={"If-None-Match": f'"stale", W/{etag}'}).status_code == 304
+
+        client.post(f"/api/devices/{DEVICE_ID}/target_temperature", json={"temperature": 60},
+                    headers={"Authorization": f"Bearer {SECRET}"})
+        response = client.get("/api/devices/states", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+        assert response.json()[0]["state"]["target_temperature"] == 60.0
+
+
+def test_reads_from_state_are_cached_until_the_field_changes() -> None:
+    app = make_app()
+    headers = {"Authorization": f"Bearer {SECRET}"}
+    with TestClient(app) as client:
+        device = app.state.anova_manager.get_device(DEVICE_ID)
+        cache = app.state.response_cache
+        assert client.get(f"/api/devices/{DEVICE_ID}/target_temperature", headers=headers).json() == {
+            "temperature": 0.0
+        }
+        body = cache.get(device, "target_temperature", ("target_temperature",), None)
+
+        # Other fields changing leaves the entry alone
+        device.state.current_temperature = 30.0
+        assert client.get(f"/api/devices/{DEVICE_ID}/temperature", headers=headers).json() == {"temperature": 30.0}
+        assert client.get(f"/api/devices/{DEVICE_ID}/target_temperature", headers=headers).content == body
+        assert cache.get(device, "target_temperature", ("target_temperature",), None) is body  # nothing to rebuild
+
+        client.post(f"/api/devices/{DEVICE_ID}/target_temperature", json={"temperature": 60}, headers=headers)
+        assert client.get(f"/api/devices/{DEVICE_ID}/target_temperature", headers=headers).json() == {
+            "temperature": 60.0
+        }
+        assert client.get(f"/api/devices/{DEVICE_ID}/unit", headers=headers).json() == {"unit": None}
+        assert client.get(f"/api/devices/{DEVICE_ID}/timer", headers=headers).json() == {"timer": 0}
+        assert len(cache) == 4
+
+        # Once the device is gone, its entries go with the next rebuild
+        manager = app.state.anova_manager
+        del manager.devices[DEVICE_ID]
+        manager.generation += 1
+        cache.get(device, "speaker_status", ("speaker_status",),
+                  lambda state: SpeakerStatusResponse(speaker_status=state.speaker_status))
+        assert len(cache) == 1
+
+
+def test_reads_refresh_values_older_than_max_age() -> None:
+    app = make_app()
+    headers = {"Authorization": f"Bearer {SECRET}"}
+    with TestClient(app) as client:
+        url = f"/api/devices/{DEVICE_ID}/speaker_status"
+        # Never read yet: from state, without an age
+        response = client.get(url, headers=headers)
+        assert response.json() == {"speaker_status": False}
+        assert "x-state-age" not in response.headers
+
+        response = client.get(url, params={"max_age": 30}, headers=headers)
+        assert response.json() == {"speaker_status": True}
+        assert 0 <= float(response.headers["x-state-age"]) < 1
+
+        device = app.state.anova_manager.get_device(DEVICE_ID)
+        device.state.speaker_status = False  # stands in for a value that is fresh enough to be served as is
+        assert client.get(url, params={"max_age": 30}, headers=headers).json() == {"speaker_status": False}
+        assert client.get(url, params={"from_state": False}, headers=headers).json() == {"speaker_status": True}
+
+        assert client.get(f"/api/devices/{DEVICE_ID}/timer", params={"max_age": 0}, headers=headers).json() == {
+            "timer": 0
+        }
+        assert client.get(url, params={"max_age": -1}, headers=headers).status_code == 422
+
+        # Only some fields have been read so far, so the state as a whole has no age yet
+        response = client.get(f"/api/devices/{DEVICE_ID}/state", headers=headers)
+        assert "x-state-age" not in response.headers
+
+        response = client.get(f"/api/devices/{DEVICE_ID}/state", params={"max_age": 0}, headers=headers)
+        assert response.json()["target_temperature"] == 57.5
+        assert 0 <= float(response.headers["x-state-age"]) < 1
+
+
+def test_session_tokens_stand_in_for_the_secret_key() -> None:
+    app = make_app()
+    with TestClient(app) as client:
+        url = f"/api/devices/{DEVICE_ID}/session"
+        assert client.post(url, params={"secret_key": "wrong"}).status_code == 401
+        response = client.post(url, headers={"Authorization": f"Bearer {SECRET}"})
+        token = response.json()["token"]
+        assert response.json()["expires_in"] == 3600
+
+        headers = {"Authorization": f"Bearer {token}"}
+        assert client.get(f"/api/devices/{DEVICE_ID}/unit", headers=headers).status_code == 200
+        assert client.get(f"/api/devices/{DEVICE_ID}/unit", params={"secret_key": token}).status_code == 200
+        with client.websocket_connect(f"/api/devices/{DEVICE_ID}/ws", headers=headers) as ws:
+            ws.send_json({"command": "GetTargetTemperature"})
+            assert ws.receive_json()["result"] == 57.5
+
+        # Sessions can't be used to open more of them, and a forged secret doesn't pass
+        assert client.post(url, headers=headers).status_code == 401
+        session_id = token.partition(".")[0]
+        forged = {"Authorization": f"Bearer {session_id}.{'x' * 32}"}
+        assert client.get(f"/api/devices/{DEVICE_ID}/unit", headers=forged).status_code == 401
+
+        # Rotating the key ends the session
+        device = app.state.anova_manager.get_device(DEVICE_ID)
+        device.secret_key = "klmnopqrst"
+        assert client.get(f"/api/devices/{DEVICE_ID}/unit", headers=headers).status_code == 401
+        assert len(app.state.session_store) == 0
+        device.secret_key = SECRET
+
+        # So does closing the sessions, or the device disconnecting
+        token = client.post(url, params={"secret_key": SECRET}).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        assert client.delete(url, headers=headers).json() == "ok"
+        assert client.get(f"/api/devices/{DEVICE_ID}/unit", headers=headers).status_code == 401
+
+        token = client.post(url, params={"secret_key": SECRET}).json()["token"]
+        del app.state.anova_manager.devices[DEVICE_ID]
+        assert client.get(f"/api/devices/{DEVICE_ID}/unit", params={"secret_key": token}).status_code == 401
+        assert len(app.state.session_store) == 0
+
+
+def test_ble_info_is_read_in_one_proxy_session() -> None:
+    requests: List[str] = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.path)
+        if request.url.path == "/scan":
+            return httpx.Response(200, json=[{"address": "AA:BB", "name": "Anova"}])
+        replies = {"get id card": "anova f56-0123456789", "version": "VM 1.2", "read unit": "c",
+                   "speaker status": "speaker is off"}
+        return httpx.Response(200, json=batch_response(json.loads(request.content)["commands"], replies))
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    app.state.ble_proxy = BLEProxy(transport=httpx.MockTransport(handle))
+    app.dependency_overrides[admin_auth] = lambda: "admin"
+    with TestClient(app) as client:
+        assert client.get("/api/ble/").json() == {
+            "ble_address": "AA:BB", "ble_name": "Anova", "version": "VM 1.2", "id_card": "f56-0123456789",
+            "temperature_unit": "c", "speaker_status": False,
+        }
+    assert requests == ["/scan", "/batch"]
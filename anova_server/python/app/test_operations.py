@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from anova_wifi.testing import make_cooker, start_manager, stop_manager
+from .models import AnovaOperation
+from .operations import run_batch
+
+OPERATIONS = [
+    AnovaOperation(command="SetTargetTemperature", args={"temperature": 60}),
+    AnovaOperation(command="SetTimer", args={"minutes": 90}),
+]
+
+
+def test_batch_runs_devices_concurrently() -> None:
+    count = 10
+    delay = 0.05
+
+    async def run() -> None:
+        manager, task, port = await start_manager()
+        cookers = [make_cooker(i, delay) for i in range(count)]
+        for cooker in cookers:
+            cooker.responses.update({"set temp 60.0": "60.0", "set timer 90": "90"})
+        cookers[3].responses.pop("set temp 60.0")
+        await asyncio.gather(*(cooker.connect(port) for cooker in cookers))
+        while len(manager.get_devices()) < count:
+            await asyncio.sleep(0.01)
+
+        device_ids = [device.id_card for device in manager.get_devices()] + ["unknown"]
+        start = time.monotonic()
+        results = await run_batch(manager, device_ids, OPERATIONS)  # type: ignore[arg-type]
+        elapsed = time.monotonic() - start
+
+        # Two round trips per device, not per batch
+        assert elapsed < 4 * delay
+        assert results.pop("unknown").error == "Device not found."
+        failed = results.pop("f56-0000000003")
+        assert (failed.results, failed.error) == ([], "Invalid command: set temp 60.0")
+        for device_id, result in results.items():
+            assert (result.results, result.error) == ([60.0, 90], None)
+            assert manager.get_device(device_id).state.target_temperature == 60.0  # type: ignore[union-attr]
+
+        # The concurrency limit serializes devices beyond it
+        start = time.monotonic()
+        await run_batch(manager, device_ids[:4], OPERATIONS[1:], concurrency=1)
+        assert time.monotonic() - start >= 4 * delay
+
+        await stop_manager(manager, task, cookers)
+
+    asyncio.run(run())
@@ -0,0 +1,224 @@
+import asyncio
+import json
+from typing import List
+
+from anova_wifi.device import DeviceState, DeviceStateDelta
+from anova_wifi.event import AnovaEvent, EventType
+from anova_wifi.manager import AnovaManager
+from .models import SSEEvent, SSEEventType, SSEQueuePolicy
+from .api import stream_listener
+from .sse import PING, SSEFilter, SSEFrame, SSEListener, SSEManager
+
+DEVICE_ID = "anova f56-0123456789"
+
+
+def state_changed(revision: int, **changes: object) -> SSEFrame:
+    return SSEFrame.encode(SSEEvent(
+        device_id=DEVICE_ID, event_type=SSEEventType.state_changed,
+        payload=DeviceStateDelta(revision=revision, changes=changes),
+    ))
+
+
+def event(kind: EventType) -> SSEFrame:
+    return SSEFrame.encode(SSEEvent(device_id=DEVICE_ID, event_type=SSEEventType.event, payload=AnovaEvent(type=kind)))
+
+
+async def drain(listener: SSEListener) -> List[SSEFrame]:
+    return [await listener.get() for _ in range(len(listener))]
+
+
+def test_frame_encoding() -> None:
+    frame = state_changed(3, current_temperature=28.6)
+    name, data, end = frame.data.decode().split("\n", 2)
+    assert name == "event: state_changed"
+    assert json.loads(data.removeprefix("data: ")) == {
+        "event_type": "state_changed", "device_id": DEVICE_ID,
+        "payload": {"revision": 3, "changes": {"current_temperature": 28.6}},
+    }
+    assert end == "\n"
+
+
+def test_broadcast_serializes_once() -> None:
+    async def run() -> None:
+        sse = SSEManager(AnovaManager())
+        listeners = [(await sse.connect(DEVICE_ID))[1] for _ in range(5)]
+        other = (await sse.connect("other"))[1]
+
+        await sse.device_state_change_callback(DEVICE_ID, DeviceState(),
+                                               DeviceStateDelta(revision=1, changes={"status": "running"}))
+        frames = [await listener.get() for listener in listeners]
+        assert all(frame.data is frames[0].data for frame in frames)
+        assert len(other) == 0
+
+    asyncio.run(run())
+
+
+def test_drop_oldest_bounds_the_queue() -> None:
+    listener = SSEListener(max_size=3, policy=SSEQueuePolicy.drop_oldest)
+    for i in range(5):
+        listener.put(state_changed(i, current_temperature=20.0 + i))
+    assert listener.dropped == 2
+    assert [f.event.payload.revision for f in asyncio.run(drain(listener))] == [2, 3, 4]  # type: ignore
+
+
+def test_coalesce_merges_pending_state_changes() -> None:
+    listener = SSEListener(max_size=3, policy=SSEQueuePolicy.coalesce)
+    listener.put(state_changed(1, status="running", current_temperature=20.0))
+    listener.put(event(EventType.START))
+    listener.put(state_changed(2, current_temperature=21.0))
+    listener.put(state_changed(3, current_temperature=22.0))
+    assert listener.dropped == 0
+
+    start, merged = asyncio.run(drain(listener))
+    assert start.event.event_type == SSEEventType.event
+    assert merged.event.payload == DeviceStateDelta(
+        revision=3, changes={"status": "running", "current_temperature": 22.0}
+    )
+    assert b'"revision":3' in merged.data
+
+    # Events are never merged, so they are dropped oldest first once the queue is full
+    for kind in [EventType.START, EventType.TEMP_REACHED, EventType.LOW_WATER, EventType.STOP]:
+        listener.put(event(kind))
+    assert listener.dropped == 1
+    assert [f.event.payload.type for f in asyncio.run(drain(listener))] == [  # type: ignore
+        EventType.TEMP_REACHED, EventType.LOW_WATER, EventType.STOP
+    ]
+
+
+def test_fleet_listeners_filter_and_trim() -> None:
+    async def run() -> None:
+        sse = SSEManager(AnovaManager())
+        _, everything = await sse.connect_fleet()
+        _, temperatures = await sse.connect_fleet(SSEFilter(fields=frozenset({"current_temperature"})))
+        _, twin = await sse.connect_fleet(SSEFilter(fields=frozenset({"current_temperature"})))
+        _, events = await sse.connect_fleet(SSEFilter(device_ids=frozenset({"other"}),
+                                                      event_types=frozenset({SSEEventType.event})))
+        device_listener_id, device = await sse.connect(DEVICE_ID)
+
+        await sse.device_state_change_callback(DEVICE_ID, DeviceState(), DeviceStateDelta(
+            revision=1, changes={"status": "running", "current_temperature": 28.6}))
+        await sse.device_state_change_callback(DEVICE_ID, DeviceState(), DeviceStateDelta(
+            revision=2, changes={"status": "stopped"}))
+        await sse.device_event_callback(DEVICE_ID, AnovaEvent(type=EventType.STOP))
+        await sse.device_event_callback("other", AnovaEvent(type=EventType.START))
+
+        # The two state changes were still pending, so they were coalesced
+        fleet = await drain(everything)
+        assert [f.event.event_type for f in fleet] == [
+            SSEEventType.state_changed, SSEEventType.event, SSEEventType.event
+        ]
+        # Fleet streams mix the sequences of several devices, so their frames carry no id
+        assert all(f.id is None and not f.data.startswith(b"id:") for f in fleet)
+        first, stop = await drain(device)
+        assert stop.id == 3
+        # The id-less fleet frame reuses the JSON of the device frame rather than serializing the event again
+        assert fleet[1].json is stop.json
+        assert fleet[1].data == stop.data.split(b"\n", 1)[1]
+        trimmed, stop_too, other = await drain(temperatures)
+        assert trimmed.event.payload == DeviceStateDelta(revision=1, changes={"current_temperature": 28.6})
+        assert stop_too.data is fleet[1].data
+        assert [f.data for f in await drain(twin)] == [trimmed.data, stop_too.data, other.data]
+        assert [(f.event.device_id, f.event.payload.type) for f in await drain(events)] == [  # type: ignore
+            ("other", EventType.START)
+        ]
+
+        await sse.disconnect(DEVICE_ID, device_listener_id)
+        await sse.device_event_callback(DEVICE_ID, AnovaEvent(type=EventType.START))
+        assert len(device) == 0
+        assert len(everything) == 1
+
+    asyncio.run(run())
+
+
+def test_keepalive_pings_only_idle_listeners() -> None:
+    async def run() -> None:
+        sse = SSEManager(AnovaManager(), keepalive_interval=0.05)
+        _, idle = await sse.connect(DEVICE_ID)
+        _, busy = await sse.connect("other")
+        _, fleet = await sse.connect_fleet(SSEFilter(device_ids=frozenset({"nobody"})))
+        sse.start()
+        for _ in range(6):
+            await sse.device_event_callback("other", AnovaEvent(type=EventType.TEMP_REACHED))
+            await asyncio.sleep(0.025)
+        await sse.stop()
+
+        pings = await drain(idle)
+        assert len(pings) >= 2 and all(f.data is PING.data for f in pings)
+        assert [f.data for f in await drain(fleet)] == [f.data for f in pings]
+        assert all(f.event.event_type == SSEEventType.event for f in await drain(busy))
+
+    asyncio.run(run())
+
+
+def test_stream_closes_when_cancelled() -> None:
+    async def run() -> None:
+        sse = SSEManager(AnovaManager())
+        listener_id, listener = await sse.connect(DEVICE_ID)
+
+        async def on_close() -> None:
+            await sse.disconnect(DEVICE_ID, listener_id)
+
+        chunks: List[bytes] = []
+
+        async def consume() -> None:
+            async for chunk in stream_listener(listener, on_close):
+                chunks.append(chunk)
+
+        task = asyncio.create_task(consume())
+        await sse.device_event_callback(DEVICE_ID, AnovaEvent(type=EventType.START))
+        await asyncio.sleep(0)
+        task.cancel()  # what the response does when the client goes away
+        await asyncio.gather(task, return_exceptions=True)
+
+        assert len(chunks) == 1
+        assert sse._listeners == {}
+
+    asyncio.run(run())
+
+
+def test_reconnecting_listener_replays_missed_events() -> None:
+    async def run() -> None:
+        sse = SSEManager(AnovaManager(), replay_size=5)
+        for i in range(8):
+            await sse.device_state_change_callback(DEVICE_ID, DeviceState(), DeviceStateDelta(
+                revision=i, changes={"current_temperature": 20.0 + i}))
+        await sse.device_event_callback("other", AnovaEvent(type=EventType.START))
+
+        _, listener = await sse.connect(DEVICE_ID, last_event_id="5")
+        frames = await drain(listener)
+        assert [f.id for f in frames] == [6, 7, 8]
+        assert frames[0].data.startswith(b"id: 6\nevent: state_changed\n")
+
+        _, listener = await sse.connect(DEVICE_ID, last_event_id="8")
+        assert len(listener) == 0
+
+        # Too old for the replay buffer, from before a restart, or garbage: the client gets a snapshot instead
+        for last_event_id in ["2", "42", "yesterday"]:
+            _, listener = await sse.connect(DEVICE_ID, last_event_id=last_event_id)
+            frames = await drain(listener)
+            assert [(f.event.event_type, f.id) for f in frames] == [(SSEEventType.snapshot, 8)]
+
+        # Every device has its own sequence, which starts after the highest id issued so far
+        _, listener = await sse.connect("other", last_event_id="8")
+        assert [f.id for f in await drain(listener)] == [9]
+
+    asyncio.run(run())
+
+
+def test_disconnected_device_is_forgotten() -> None:
+    async def run() -> None:
+        sse = SSEManager(AnovaManager())
+        for i in range(3):
+            await sse.device_state_change_callback(DEVICE_ID, DeviceState(), DeviceStateDelta(
+                revision=i, changes={"current_temperature": 20.0 + i}))
+        await sse.device_disconnected_callback(DEVICE_ID)
+        assert DEVICE_ID not in sse._sequences
+        assert DEVICE_ID not in sse._replay
+
+        # The reconnected device must not reuse the ids a client saw before, or it would be replayed the wrong events
+        await sse.device_state_change_callback(DEVICE_ID, DeviceState(), DeviceStateDelta(
+            revision=0, changes={"current_temperature": 30.0}))
+        _, listener = await sse.connect(DEVICE_ID, last_event_id="2")
+        assert [(f.event.event_type, f.id) for f in await drain(listener)] == [(SSEEventType.snapshot, 5)]
+
+    asyncio.run(run())
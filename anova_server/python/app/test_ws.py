@@ -0,0 +1,101 @@
+import asyncio
+import json
+from typing import AsyncIterator, List
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from anova_wifi.device import AnovaDevice
+from anova_wifi.manager import AnovaManager
+from anova_wifi.testing import FakeCooker, connect, disconnect
+from .sse import SSEManager
+from .testing import DEVICE_ID, SECRET, make_app
+from .ws import DeviceSocket
+
+
+def test_websocket_runs_commands_and_streams_state() -> None:
+    with TestClient(make_app()) as client:
+        with client.websocket_connect(f"/api/devices/{DEVICE_ID}/ws?secret_key={SECRET}") as ws:
+            ws.send_json({"id": 1, "command": "SetTargetTemperature", "args": {"temperature": 60}})
+            messages = [ws.receive_json(), ws.receive_json()]
+            assert {"id": 1, "result": 60.0, "error": None} in messages
+            assert {
+                "event_type": "state_changed", "device_id": DEVICE_ID,
+                "payload": {"revision": 1, "changes": {"target_temperature": 60.0}},
+            } in messages
+
+            ws.send_json({"id": "a", "command": "GetTimerStatus"})
+            assert ws.receive_json() == {"id": "a", "result": [0, False], "error": None}
+
+            ws.send_json({"id": 2, "command": "GetSecretKey"})
+            assert ws.receive_json() == {"id": 2, "result": None, "error": "Unknown command: GetSecretKey"}
+
+            ws.send_json({"id": 3, "command": "SetTimer", "args": {"hours": 1}})
+            assert ws.receive_json()["error"].startswith("Invalid arguments for SetTimer")
+
+            ws.send_text("not json")
+            assert ws.receive_json()["error"].startswith("Invalid command frame")
+
+
+def test_websocket_requires_the_secret_key() -> None:
+    with TestClient(make_app()) as client:
+        for url in [f"/api/devices/{DEVICE_ID}/ws?secret_key=wrong", f"/api/devices/{DEVICE_ID}/ws",
+                    f"/api/devices/unknown/ws?secret_key={SECRET}"]:
+            with pytest.raises(WebSocketDisconnect) as e:
+                with client.websocket_connect(url):
+                    pass
+            assert e.value.code == 1008
+
+        headers = {"Authorization": f"Bearer {SECRET}"}
+        with client.websocket_connect(f"/api/devices/{DEVICE_ID}/ws", headers=headers) as ws:
+            ws.send_json({"command": "GetTargetTemperature"})
+            assert ws.receive_json() == {"id": None, "result": 57.5, "error": None}
+
+
+class FakeWebSocket:
+    """Delivers `frames` to a DeviceSocket, then stays open until `close` is called."""
+
+    def __init__(self, frames: List[str]):
+        self.frames = frames
+        self.sent: List[dict] = []
+        self.closed = asyncio.Event()
+
+    async def accept(self) -> None:
+        pass
+
+    async def iter_text(self) -> AsyncIterator[str]:
+        for frame in self.frames:
+            yield frame
+        await self.closed.wait()
+
+    async def send_text(self, text: str) -> None:
+        self.sent.append(json.loads(text))
+
+
+def test_websocket_bounds_commands_in_flight() -> None:
+    async def run() -> None:
+        cooker = FakeCooker(answer=False)
+        connection, server = await connect(cooker)
+        device = AnovaDevice(connection)
+        device.id_card = DEVICE_ID
+        websocket = FakeWebSocket([
+            json.dumps({"id": i, "command": "GetTargetTemperature"}) for i in range(3)
+        ])
+        socket = DeviceSocket(websocket, device, SSEManager(AnovaManager()), max_commands=2)  # type: ignore
+        session = asyncio.create_task(socket.run())
+
+        while len(cooker.received) < 2 or not websocket.sent:
+            await asyncio.sleep(0.001)
+        # The device has not answered the first two, so the third is turned away without reaching it
+        assert websocket.sent == [{"id": 2, "result": None, "error": "Too many commands in flight"}]
+        cooker.send("57.5", "57.5")
+        while len(websocket.sent) < 3:
+            await asyncio.sleep(0.001)
+        assert cooker.received == ["read set temp"] * 2
+
+        websocket.closed.set()
+        await session
+        await disconnect(connection, server, cooker)
+
+    asyncio.run(run())
@@ -0,0 +1,40 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from fastapi import FastAPI
+
+from anova_wifi.device import AnovaDevice
+from anova_wifi.manager import AnovaManager
+from anova_wifi.testing import FakeCooker, RESPONSES, connect, disconnect
+from .api import router
+from .cache import FleetStateCache, ResponseCache
+from .sessions import SessionStore
+from .sse import SSEManager
+
+DEVICE_ID = "f56-0123456789"
+SECRET = "abcdefghij"
+
+
+def make_app() -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        cooker = FakeCooker({**RESPONSES, "set temp 60.0": "60.0"})
+        connection, server = await connect(cooker)
+        device = AnovaDevice(connection)
+        device.id_card, device.secret_key = DEVICE_ID, SECRET
+
+        manager = AnovaManager()
+        manager.devices[DEVICE_ID] = device
+        sse = SSEManager(manager)
+        sse.register_callbacks()
+        device.add_state_change_callback(manager._handle_device_state_change)
+        app.state.anova_manager, app.state.sse_manager, app.state.settings = manager, sse, None
+        app.state.state_cache = FleetStateCache(manager)
+        app.state.response_cache = ResponseCache(manager)
+        app.state.session_store = SessionStore(manager)
+        yield
+        await disconnect(connection, server, cooker)
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router, prefix="/api")
+    return app
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from typing import Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from anova_wifi.device import AnovaDevice
+from .models import SSEEventType, WSCommand, WSResult
+from .operations import build_command
+from .sse import SSEListener, SSEManager
+
+logger = logging.getLogger("anova_ws")
+
+WS_MAX_COMMANDS = 16  # commands a socket may have running before further ones are rejected
+
+
+class DeviceSocket:
+    """
+    A WebSocket session with one device, authenticated once when it is opened.
+    Command frames are answered with a `WSResult` carrying the same id. Commands run concurrently, so they share the
+    connection's pipeline and are written to the device in the order they arrived. A command that arrives while
+    `max_commands` are still running is answered with an error straight away, so a client can't pile up unbounded work.
+    State changes and events of the device are forwarded as `SSEEvent` JSON, using the encoding shared with the SSE
+    listeners.
+    """
+
+    def __init__(self, websocket: WebSocket, device: AnovaDevice, sse_manager: SSEManager,
+                 max_commands: int = WS_MAX_COMMANDS):
+        if max_commands < 1:
+            raise ValueError("WebSocket command limit must be at least 1")
+        self.websocket = websocket
+        self.device = device
+        self.sse_manager = sse_manager
+        self.max_commands = max_commands
+        self._send_lock = asyncio.Lock()
+        self._commands: Set[asyncio.Task[None]] = set()
+
+    async def run(self) -> None:
+        await self.websocket.accept()
+        device_id: str = self.device.id_card  # type: ignore
+        listener_id, listener = await self.sse_manager.connect(device_id)
+        forward = asyncio.create_task(self._forward(listener))
+        logger.info(f"WebSocket opened for device {device_id}")
+        try:
+            async for text in self.websocket.iter_text():
+                try:
+                    frame = WSCommand.model_validate_json(text)
+                except ValidationError as e:
+                    await self._send(WSResult(error=f"Invalid command frame: {e.errors()[0]['msg']}").model_dump_json())
+                    continue
+                if len(self._commands) >= self.max_commands:
+                    await self._send(WSResult(id=frame.id, error="Too many commands in flight").model_dump_json())
+                    continue
+                task = asyncio.create_task(self._execute(frame))
+                self._commands.add(task)
+                task.add_done_callback(self._commands.discard)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            forward.cancel()
+            for task in list(self._commands):
+                task.cancel()
+            await asyncio.gather(forward, *self._commands, return_exceptions=True)
+            await self.sse_manager.disconnect(device_id, listener_id)
+            logger.info(f"WebSocket closed for device {device_id}")
+
+    async def _execute(self, frame: WSCommand) -> None:
+        try:
+            result = WSResult(id=frame.id, result=await self.device.send_command(build_command(self.device, frame)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"WebSocket command {frame.command} failed for device {self.device.id_card}: {e}")
+            result = WSResult(id=frame.id, error=str(e))
+        await self._send(result.model_dump_json())
+
+    async def _forward(self, listener: SSEListener) -> None:
+        while True:
+            frame = await listener.get()
+            if frame.event.event_type != SSEEventType.ping:  # WebSockets have their own keepalive
+                await self._send(frame.json)
+
+    async def _send(self, text: str) -> None:
+        async with self._send_lock:
+            try:
+                await self.websocket.send_text(text)
+            except (WebSocketDisconnect, RuntimeError) as e:
+                # The receive loop notices the disconnect and cleans up
+                logger.debug(f"Dropping message for closed WebSocket: {e}")
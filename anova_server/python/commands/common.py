@@ -60,6 +60,9 @@ class SetTargetTemperature(AnovaCommand):
     def encode(self) -> str:
         return f"set temp {self.temperature:.1f}"
 
+    def decode(self, response: str) -> float:
+        return float(response.strip())
+
 
 class SetTimer(AnovaCommand):
     def supports_wifi(self) -> bool: return True
@@ -74,6 +77,9 @@ class SetTimer(AnovaCommand):
     def encode(self) -> str:
         return f"set timer {self.minutes}"
 
+    def decode(self, response: str) -> int:
+        return int(response.strip())
+
 
 class SetTemperatureUnit(AnovaCommand):
     def supports_wifi(self) -> bool: return True
@@ -86,6 +92,12 @@ class SetTemperatureUnit(AnovaCommand):
     def encode(self) -> str:
         return f"set unit {self.unit.value}"
 
+    def decode(self, response: str) -> TemperatureUnit:
+        try:
+            return TemperatureUnit(response.strip().lower())
+        except ValueError:
+            raise ValueError(f"Unknown temperature unit: {response}")
+
 
 class GetTargetTemperature(AnovaCommand):
     def supports_wifi(self) -> bool: return True
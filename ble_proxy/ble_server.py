@@ -1,84 +1,418 @@
 import asyncio
 import logging
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from fastapi import FastAPI, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 from bleak import BleakClient, BleakScanner
+from bleak.backends.device import BLEDevice
+from bleak.backends.scanner import AdvertisementData
 from bleak.uuids import normalize_uuid_str
 
 # Constants
 ANOVA_SERVICE_UUID = "ffe0"
 ANOVA_CHARACTERISTIC_UUID = "ffe1"
+ANOVA_DEVICE_NAME = "Anova"
+SCAN_DURATION = 5.0  # seconds an on-demand scan listens for advertisements
+RESPONSE_TIMEOUT = 5.0  # seconds to wait for each notification of a response
+SCAN_TTL = float(os.environ.get("BLE_SCAN_TTL", 120))  # seconds a device stays in the index after it was last seen
+NOTIFICATION_QUEUE_SIZE = 100  # notifications or messages waiting per queue before the oldest is dropped
+NOTIFICATION_KEEPALIVE = 15.0  # seconds a notification stream may stay silent before it gets a comment
+GATT_IDLE_TIMEOUT = float(os.environ.get("BLE_IDLE_TIMEOUT", 60))  # seconds before an unused connection is closed
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("ble_proxy")
 
-app = FastAPI()
-
 class WriteRequest(BaseModel):
     address: str
     command: str  # Accept *any* string
 
-@app.get("/scan")
-async def scan_ble():
-    logger.info("Scanning for BLE devices...")
-    devices = await BleakScanner.discover(timeout=5, return_adv=True)
-    result = []
-    for d, adv in devices.values():
+class BatchRequest(BaseModel):
+    address: str
+    commands: List[str]
+    stop_on_error: bool = False
+
+async def exchange(connection: "GattConnection", command: str) -> str:
+    """
+    Write a command and collect the notifications of its response, up to the terminating \\r.
+    Raises TimeoutError when the response doesn't arrive in full: the rest of it could still come and be taken for the
+    response to the next command, so the connection must not be used again (`GattPool.session` closes it).
+    """
+    q = connection.queue
+    while not q.empty():  # anything left over belongs to an earlier command
+        q.get_nowait()
+
+    command_data = f"{command}\r".encode()
+    await connection.client.write_gatt_char(  # type: ignore
+        normalize_uuid_str(ANOVA_CHARACTERISTIC_UUID), command_data, response=True
+    )
+    logger.info(f"Wrote to characteristic: {command_data!r}")
+
+    # Wait for BLE response with a timeout
+    response = bytearray()
+    try:
+        while True:
+            chunk = await asyncio.wait_for(q.get(), timeout=RESPONSE_TIMEOUT)
+            response.extend(chunk)
+            if b"\r" in chunk:
+                break
+    except asyncio.TimeoutError:
+        logger.warning(f"BLE notification response timed out after {bytes(response)!r}")
+        raise TimeoutError(f"Incomplete response from device: {bytes(response)!r}" if response
+                           else "No response from device") from None
+
+    return response.decode(errors="ignore").strip()
+
+def is_anova(device: BLEDevice, adv: AdvertisementData) -> bool:
+    service_uuids = [uuid.lower() for uuid in adv.service_uuids or []]
+    return device.name == ANOVA_DEVICE_NAME or normalize_uuid_str(ANOVA_SERVICE_UUID) in service_uuids
+
+class ScanIndex:
+    """
+    Anova devices by address, kept up to date by a scanner that runs in the background, so that scans are answered
+    immediately. Devices that weren't seen for `ttl` seconds are dropped. When the background scanner can't run,
+    every scan falls back to scanning for `SCAN_DURATION` seconds.
+    """
+
+    def __init__(self, ttl: float = SCAN_TTL):
+        self.ttl = ttl
+        self.devices: Dict[str, Dict[str, Any]] = {}
+        self._scanner: Optional[BleakScanner] = None
+        self._lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        scanner = BleakScanner(detection_callback=self._on_advertisement)
+        try:
+            await scanner.start()
+            self._scanner = scanner
+            logger.info("Background BLE scanner started")
+        except Exception as e:
+            logger.warning(f"Background BLE scanner unavailable, scanning on demand: {e}")
+
+    async def stop(self) -> None:
+        scanner, self._scanner = self._scanner, None
+        if scanner is not None:
+            await scanner.stop()
+
+    async def scan(self, max_age: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        :param max_age: Scan now unless a device was seen within this many seconds
+        :return: The devices, most recently seen first
+        """
+        now = time.time()
+        self.devices = {address: d for address, d in self.devices.items() if now - d["last_seen"] <= self.ttl}
+        if self._scanner is None or (max_age is not None
+                                     and not any(now - d["last_seen"] <= max_age for d in self.devices.values())):
+            await self._discover()
+
+        now = time.time()
+        devices = sorted(self.devices.values(), key=lambda d: d["last_seen"], reverse=True)
+        return [{**d, "age": round(now - d["last_seen"], 3)} for d in devices]
+
+    async def _discover(self) -> None:
+        async with self._lock:
+            logger.info("Scanning for BLE devices...")
+            background = self._scanner
+            if background is not None:
+                await background.stop()
+            try:
+                devices = await BleakScanner.discover(timeout=SCAN_DURATION, return_adv=True)
+                for d, adv in devices.values():
+                    self._on_advertisement(d, adv)
+            finally:
+                # Unless `stop` ran meanwhile, which leaves the background scanner stopped for good
+                if background is not None and self._scanner is background:
+                    await background.start()
+
+    def _on_advertisement(self, device: BLEDevice, adv: AdvertisementData) -> None:
+        if not is_anova(device, adv):
+            return
         info = {
-            "address": d.address,
-            "name": getattr(d, "name", None),
-            "rssi": getattr(adv, "rssi", None),
-            "service_uuids": getattr(adv, "service_uuids", []),
+            "address": device.address,
+            "name": device.name,
+            "rssi": adv.rssi,
+            "service_uuids": adv.service_uuids or [],
+            "last_seen": time.time(),
         }
-        result.append(info)
-        logger.info(f"Scan found: {info}")  # NEW: log each device with all info
-    return result
+        if device.address not in self.devices:
+            logger.info(f"Scan found: {info}")
+        self.devices[device.address] = info
 
-@app.post("/write")
-async def ble_write(req: WriteRequest):
-    # Log the incoming request
-    logger.info(f"BLE PROXY /write POST: address={req.address!r}, command={req.command!r}")
 
-    try:
-        async with BleakClient(req.address) as client:
-            logger.info(f"Connected to BLE device: {req.address}")
+class GattConnection:
+    """
+    A connection to one device, with notifications subscribed, that is kept open between requests.
+    Commands take `lock` so that their writes and responses don't interleave. Notifications are also reassembled into
+    messages, which are sent to every subscriber; subscribers get None when the device disconnects.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.client: Optional[BleakClient] = None
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(NOTIFICATION_QUEUE_SIZE)
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.subscribers: Set[asyncio.Queue[Optional[str]]] = set()
+        self._message = bytearray()
 
-            # Prepare notification queue
-            q: asyncio.Queue[bytes] = asyncio.Queue()
+    @property
+    def connected(self) -> bool:
+        return self.client is not None and self.client.is_connected
 
-            def notification_handler(sender, data):
-                logger.info(f"Notification from {sender}: {data!r}")
-                q.put_nowait(data)
+    async def connect(self) -> None:
+        """(Re)connect, if the connection isn't open."""
+        if self.connected:
+            return
+        await self.close()
+        client = BleakClient(self.address, disconnected_callback=self._on_disconnect)
+        await client.connect()
+        logger.info(f"Connected to BLE device: {self.address}")
+        try:
+            await client.start_notify(normalize_uuid_str(ANOVA_CHARACTERISTIC_UUID), self._on_notification)
+        except Exception:
+            await client.disconnect()
+            raise
+        self.client = client
+
+    async def close(self) -> None:
+        client, self.client = self.client, None
+        if client is not None and client.is_connected:
+            try:
+                await client.disconnect()
+                logger.info(f"Disconnected from BLE device: {self.address}")
+            except Exception as e:
+                logger.warning(f"Disconnecting from {self.address} failed: {e}")
 
-            await client.start_notify(normalize_uuid_str(ANOVA_CHARACTERISTIC_UUID), notification_handler)
+    def subscribe(self) -> "asyncio.Queue[Optional[str]]":
+        subscriber: asyncio.Queue[Optional[str]] = asyncio.Queue(NOTIFICATION_QUEUE_SIZE)
+        self.subscribers.add(subscriber)
+        return subscriber
 
-            command_data = f"{req.command}\r".encode()
-            await client.write_gatt_char(normalize_uuid_str(ANOVA_CHARACTERISTIC_UUID), command_data, response=True)
-            logger.info(f"Wrote to characteristic: {command_data!r}")
+    def unsubscribe(self, subscriber: "asyncio.Queue[Optional[str]]") -> None:
+        self.subscribers.discard(subscriber)
+        self.last_used = time.monotonic()
 
-            # Wait for BLE response with a timeout
-            response = bytearray()
+    def _publish(self, message: Optional[str]) -> None:
+        for subscriber in self.subscribers:
+            if subscriber.full():  # a slow subscriber loses the oldest messages
+                subscriber.get_nowait()
+            subscriber.put_nowait(message)
+
+    def _on_notification(self, sender, data: bytearray) -> None:
+        logger.info(f"Notification from {sender}: {data!r}")
+        if self.queue.full():  # nobody waits for a response, e.g. while a stream keeps the connection open
+            self.queue.get_nowait()
+        self.queue.put_nowait(bytes(data))
+        self._message.extend(data)
+        while b"\r" in self._message:
+            message, _, rest = self._message.partition(b"\r")
+            self._message = bytearray(rest)
+            self._publish(message.decode(errors="ignore").strip())
+
+    def _on_disconnect(self, client: BleakClient) -> None:
+        if self.client not in (None, client):
+            return  # an old client, already replaced
+        logger.info(f"BLE device disconnected: {self.address}")
+        self._message.clear()
+        self._publish(None)
+
+
+class GattPool:
+    """
+    Open connections by address, so that back-to-back commands only cost the GATT round trip.
+    A connection is opened on first use, reopened when the device dropped it, closed after a command fails (the
+    next one reconnects) and closed once it has been idle for `idle_timeout` seconds.
+    """
+
+    def __init__(self, idle_timeout: float = GATT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.connections: Dict[str, GattConnection] = {}
+        self._evict_task: Optional[asyncio.Task[None]] = None
+
+    def start(self) -> None:
+        if not self._evict_task:
+            self._evict_task = asyncio.create_task(self._evict_idle())
+
+    async def stop(self) -> None:
+        if self._evict_task:
+            self._evict_task.cancel()
             try:
-                while True:
-                    chunk = await asyncio.wait_for(q.get(), timeout=5)
-                    response.extend(chunk)
-                    if b"\r" in chunk:
-                        break
-            except asyncio.TimeoutError:
-                logger.warning("BLE notification response timed out.")
-
-            await client.stop_notify(normalize_uuid_str(ANOVA_CHARACTERISTIC_UUID))
-
-            # Decode and log the BLE response
-            result_str = response.decode(errors="ignore").strip()
+                await self._evict_task
+            except asyncio.CancelledError:
+                pass
+            self._evict_task = None
+        for connection in list(self.connections.values()):
+            async with connection.lock:
+                await connection.close()
+        self.connections.clear()
+
+    @asynccontextmanager
+    async def session(self, address: str) -> AsyncIterator[GattConnection]:
+        """Get the connection to a device, connected, to use exclusively while the context lasts."""
+        if address not in self.connections:
+            self.connections[address] = GattConnection(address)
+        connection = self.connections[address]
+        async with connection.lock:
+            try:
+                await connection.connect()
+                yield connection
+            except BaseException:
+                await connection.close()
+                raise
+            finally:
+                connection.last_used = time.monotonic()
+
+    async def subscribe(self, address: str) -> Tuple[GattConnection, "asyncio.Queue[Optional[str]]"]:
+        """Connect to a device, if needed, and listen to its messages; the connection stays open until unsubscribed."""
+        async with self.session(address) as connection:
+            return connection, connection.subscribe()
+
+    async def _evict_idle(self) -> None:
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+            now = time.monotonic()
+            for address, connection in list(self.connections.items()):
+                if connection.lock.locked() or connection.subscribers:
+                    continue
+                if now - connection.last_used > self.idle_timeout:
+                    del self.connections[address]
+                    await connection.close()
+
+
+pool = GattPool()
+scan_index = ScanIndex()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    pool.start()
+    await scan_index.start()
+    yield
+    await scan_index.stop()
+    await pool.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/scan")
+async def scan_ble(max_age: Optional[float] = Query(None, ge=0)):
+    """Anova devices seen recently; with `max_age`, a fresh scan runs unless one was seen within that many seconds."""
+    return await scan_index.scan(max_age)
+
+@app.post("/write")
+async def ble_write(req: WriteRequest):
+    # Log the incoming request
+    logger.info(f"BLE PROXY /write POST: address={req.address!r}, command={req.command!r}")
+
+    try:
+        async with pool.session(req.address) as connection:
+            result_str = await exchange(connection, req.command)
             logger.info(f"BLE result for address={req.address}, command={req.command!r}: {result_str!r}")
             return {"result": result_str}
     except Exception as e:
         logger.error(f"BLE write failed: {e}")
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
+@app.post("/batch")
+async def ble_batch(req: BatchRequest):
+    """
+    Run several commands, in order, over a single BLE connection.
+    Every command gets its result or error and how long it took. A command fails when the device doesn't respond in
+    full or the connection breaks, in which case the connection is closed and the next command reconnects first. With
+    `stop_on_error`, the commands after the first failure are not run and have no entry in the results.
+    """
+    logger.info(f"BLE PROXY /batch POST: address={req.address!r}, commands={req.commands!r}")
+
+    started = time.monotonic()
+    try:
+        async with pool.session(req.address) as connection:
+            results = []
+            for command in req.commands:
+                command_started = time.monotonic()
+                result: Optional[str] = None
+                try:
+                    await connection.connect()  # only reconnects after a failed command dropped the connection
+                    result = await exchange(connection, command)
+                    error = None if result else "No response from device"
+                except Exception as e:
+                    await connection.close()
+                    error = str(e) or type(e).__name__
+                logger.info(f"BLE result for address={req.address}, command={command!r}: {result!r} {error or ''}")
+                results.append({
+                    "command": command,
+                    "result": result,
+                    "error": error,
+                    "elapsed": round(time.monotonic() - command_started, 4),
+                })
+                if error and req.stop_on_error:
+                    break
+            return {"results": results, "elapsed": round(time.monotonic() - started, 4)}
+    except Exception as e:
+        logger.error(f"BLE batch failed: {e}")
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
+@app.get("/notifications/{address}")
+async def notifications_sse(address: str):
+    """
+    Every message the device sends, responses to commands included, as `data:` lines of a server-sent event
+    stream. The stream ends when the device disconnects.
+    """
+    try:
+        connection, subscriber = await pool.subscribe(address)
+    except Exception as e:
+        logger.error(f"BLE notification stream failed: {e}")
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+    logger.info(f"BLE notification stream opened: address={address}")
+
+    async def stream() -> AsyncIterator[bytes]:
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.get(), NOTIFICATION_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if message is None:
+                    yield b"event: disconnected\ndata: \n\n"
+                    return
+                yield f"data: {message}\n\n".encode()
+        finally:
+            connection.unsubscribe(subscriber)
+            logger.info(f"BLE notification stream closed: address={address}")
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.websocket("/notifications/{address}")
+async def notifications_ws(websocket: WebSocket, address: str):
+    """The same messages as the event stream, one per text frame; the socket is closed when the device disconnects."""
+    await websocket.accept()
+    try:
+        connection, subscriber = await pool.subscribe(address)
+    except Exception as e:
+        logger.error(f"BLE notification stream failed: {e}")
+        await websocket.close(code=1011, reason=str(e)[:120])
+        return
+    logger.info(f"BLE notification socket opened: address={address}")
+
+    async def forward() -> None:
+        while (message := await subscriber.get()) is not None:
+            await websocket.send_text(message)
+        await websocket.close()
+
+    forwarding = asyncio.create_task(forward())
+    try:
+        async for _ in websocket.iter_text():  # clients don't send anything, but reading notices them going away
+            pass
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        forwarding.cancel()
+        await asyncio.gather(forwarding, return_exceptions=True)
+        connection.unsubscribe(subscriber)
+        logger.info(f"BLE notification socket closed: address={address}")
+
 @app.get("/")
 def root():
     return {"message": "BLE Proxy API running"}
\ No newline at end of file
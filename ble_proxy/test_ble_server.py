@@ -0,0 +1,406 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import ble_server
+from ble_server import NOTIFICATION_QUEUE_SIZE, GattPool, ScanIndex, exchange
+
+ADDRESS = "AA:BB:CC:DD:EE:FF"
+REPLIES = {
+    b"read temp": [b"28.6\r"],
+    b"read unit": [b"c\r"],
+    b"status": [b"runn", b"ing\r"],
+}
+
+
+class FakeBle:
+    """
+    Stands in for the devices around the proxy. Every `BleakClient` the proxy opens is a `FakeClient` connected to
+    this, which answers each command with the notifications in `replies`, `delay` seconds after it was written.
+    `on_subscribe` is called with every client once its notifications are subscribed.
+    """
+
+    def __init__(self) -> None:
+        self.replies: Dict[bytes, List[bytes]] = dict(REPLIES)
+        self.delay = 0.0
+        self.reachable = True
+        self.on_subscribe: Optional[Callable[["FakeClient"], None]] = None
+        self.clients: List["FakeClient"] = []
+        self.outstanding = 0
+        self.max_outstanding = 0
+
+
+class FakeClient:
+    def __init__(self, ble: FakeBle, address: str, disconnected_callback: Callable[["FakeClient"], None]):
+        self.ble = ble
+        self.address = address
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.written: List[bytes] = []
+        self.notify: Optional[Callable[[str, bytearray], None]] = None
+        ble.clients.append(self)
+
+    async def connect(self) -> None:
+        if not self.ble.reachable:
+            raise Exception(f"Device with address {self.address} was not found")
+        self.is_connected = True
+
+    async def disconnect(self) -> None:
+        if self.is_connected:
+            self.drop()
+
+    async def start_notify(self, uuid: str, callback: Callable[[str, bytearray], None]) -> None:
+        self.notify = callback
+        if self.ble.on_subscribe:
+            self.ble.on_subscribe(self)
+
+    async def write_gatt_char(self, uuid: str, data: bytes, response: bool = False) -> None:
+        assert self.is_connected
+        self.written.append(data)
+        chunks = self.ble.replies.get(data.rstrip(b"\r"))
+        if chunks is not None:
+            self.ble.outstanding += 1
+            self.ble.max_outstanding = max(self.ble.max_outstanding, self.ble.outstanding)
+            asyncio.get_running_loop().call_later(self.ble.delay, self.send, *chunks)
+
+    def send(self, *chunks: bytes) -> None:
+        """Deliver notifications, as if the device sent them."""
+        assert self.notify
+        for chunk in chunks:
+            self.notify("ffe1", bytearray(chunk))
+        self.ble.outstanding -= 1
+
+    def drop(self) -> None:
+        """Lose the connection, as if the device went out of range."""
+        self.is_connected = False
+        self.disconnected_callback(self)
+
+
+class FakeScanner:
+    """Stands in for `BleakScanner`, reporting `advertisements` when started and from `discover`."""
+    advertisements: List[SimpleNamespace] = []
+    discovering: Optional[asyncio.Event] = None  # when set, `discover` waits for it
+    instances: List["FakeScanner"] = []
+
+    def __init__(self, detection_callback: Callable[[SimpleNamespace, SimpleNamespace], None]):
+        self.detection_callback = detection_callback
+        self.running = False
+        self.starts = 0
+        FakeScanner.instances.append(self)
+
+    async def start(self) -> None:
+        self.running = True
+        self.starts += 1
+        for device in self.advertisements:
+            self.detection_callback(device, device.adv)
+
+    async def stop(self) -> None:
+        self.running = False
+
+    @classmethod
+    async def discover(cls, timeout: float, return_adv: bool) -> Dict[str, tuple]:
+        if cls.discovering is not None:
+            await cls.discovering.wait()
+        return {device.address: (device, device.adv) for device in cls.advertisements}
+
+
+def advertisement(address: str, name: Optional[str] = "Anova", uuids: Optional[List[str]] = None) -> SimpleNamespace:
+    adv = SimpleNamespace(rssi=-60, service_uuids=uuids or [])
+    return SimpleNamespace(address=address, name=name, adv=adv)
+
+
+@pytest.fixture
+def ble(monkeypatch: pytest.MonkeyPatch) -> FakeBle:
+    fake = FakeBle()
+    monkeypatch.setattr(ble_server, "BleakClient", lambda address, disconnected_callback: FakeClient(
+        fake, address, disconnected_callback
+    ))
+    monkeypatch.setattr(ble_server, "BleakScanner", FakeScanner)
+    monkeypatch.setattr(FakeScanner, "advertisements", [advertisement(ADDRESS), advertisement("11:22", "Other")])
+    monkeypatch.setattr(FakeScanner, "instances", [])
+    monkeypatch.setattr(FakeScanner, "discovering", None)
+    monkeypatch.setattr(ble_server, "RESPONSE_TIMEOUT", 0.05)
+    return fake
+
+
+async def command(pool: GattPool, text: str, address: str = ADDRESS) -> str:
+    async with pool.session(address) as connection:
+        return await exchange(connection, text)
+
+
+def test_exchange_reassembles_the_response(ble: FakeBle) -> None:
+    async def run() -> None:
+        pool = GattPool()
+        assert await command(pool, "status") == "running"
+        assert await command(pool, "read temp") == "28.6"
+        assert len(ble.clients) == 1  # the connection was kept open
+        assert ble.clients[0].written == [b"status\r", b"read temp\r"]
+        await pool.stop()
+        assert not ble.clients[0].is_connected
+        assert pool.connections == {}
+
+    asyncio.run(run())
+
+
+def test_missing_response_closes_the_connection(ble: FakeBle) -> None:
+    async def run() -> None:
+        pool = GattPool()
+        with pytest.raises(TimeoutError, match="No response from device"):
+            await command(pool, "bogus")
+        assert not ble.clients[0].is_connected
+
+        # The rest of a response could still arrive, so it must not be taken for the response to the next command
+        ble.replies[b"read temp"] = [b"28."]
+        with pytest.raises(TimeoutError, match="Incomplete response from device: b'28.'"):
+            await command(pool, "read temp")
+        assert not ble.clients[1].is_connected
+
+        ble.replies[b"read temp"] = [b"28.6\r"]
+        assert await command(pool, "read temp") == "28.6"
+        assert len(ble.clients) == 3
+        await pool.stop()
+
+    asyncio.run(run())
+
+
+def test_dropped_connection_is_reopened(ble: FakeBle) -> None:
+    async def run() -> None:
+        pool = GattPool()
+        assert await command(pool, "read unit") == "c"
+        ble.clients[0].drop()
+        assert await command(pool, "read unit") == "c"
+        assert len(ble.clients) == 2
+        assert pool.connections[ADDRESS].client is ble.clients[1]
+        await pool.stop()
+
+    asyncio.run(run())
+
+
+def test_commands_to_a_device_take_turns(ble: FakeBle) -> None:
+    async def run() -> None:
+        ble.delay = 0.01
+        pool = GattPool()
+        results = await asyncio.gather(command(pool, "read temp"), command(pool, "read unit"), command(pool, "status"),
+                                       command(pool, "read unit", "11:22"))
+        assert results == ["28.6", "c", "running", "c"]
+        # The other device's command overlapped, the ones to the same device didn't
+        assert ble.max_outstanding == 2
+        assert [client.address for client in ble.clients] == [ADDRESS, "11:22"]
+        await pool.stop()
+
+    asyncio.run(run())
+
+
+def test_idle_connections_are_evicted(ble: FakeBle) -> None:
+    async def run() -> None:
+        pool = GattPool(idle_timeout=0.05)
+        pool.start()
+        await command(pool, "read temp")
+        await command(pool, "read temp", "11:22")
+        async with pool.session("11:22"):
+            await asyncio.sleep(0.15)  # a connection in use is never idle
+            assert ADDRESS not in pool.connections
+            assert "11:22" in pool.connections
+        assert not ble.clients[0].is_connected
+        assert ble.clients[1].is_connected
+
+        await asyncio.sleep(0.15)
+        assert pool.connections == {}
+        assert not ble.clients[1].is_connected
+        await pool.stop()
+        assert pool._evict_task is None
+
+    asyncio.run(run())
+
+
+def test_scan_index_answers_from_the_background_scanner(ble: FakeBle) -> None:
+    async def run() -> None:
+        index = ScanIndex(ttl=60)
+        await index.start()
+        scanner = FakeScanner.instances[0]
+        assert scanner.running
+
+        devices = await index.scan()
+        assert [d["address"] for d in devices] == [ADDRESS]
+        assert devices[0]["rssi"] == -60 and devices[0]["age"] >= 0
+        assert len(FakeScanner.instances) == 1
+
+        # Nothing seen within max_age: the background scanner pauses for a scan of its own
+        index.devices[ADDRESS]["last_seen"] -= 30
+        FakeScanner.advertisements.append(advertisement("33:44", None, ["0000ffe0-0000-1000-8000-00805f9b34fb"]))
+        devices = await index.scan(max_age=10)
+        assert {d["address"] for d in devices} == {ADDRESS, "33:44"}
+        assert scanner.running and scanner.starts == 2
+
+        # Devices not seen for longer than the ttl are dropped
+        index.devices[ADDRESS]["last_seen"] = time.time() - 61
+        assert [d["address"] for d in await index.scan()] == ["33:44"]
+
+        await index.stop()
+        assert not scanner.running
+
+    asyncio.run(run())
+
+
+
+def test_scan_index_stopped_during_a_scan(ble: FakeBle) -> None:
+    async def run() -> None:
+        FakeScanner.discovering = asyncio.Event()
+        index = ScanIndex()
+        await index.start()
+        scanner = FakeScanner.instances[0]
+        scanning = asyncio.create_task(index.scan(max_age=0))
+        while scanner.running:
+            await asyncio.sleep(0.001)
+
+        await index.stop()
+        FakeScanner.discovering.set()
+        assert {d["address"] for d in await scanning} == {ADDRESS}
+        assert not scanner.running and scanner.starts == 1
+
+    asyncio.run(run())
+
+
+def test_batch_reports_every_command(ble: FakeBle) -> None:
+    ble.replies[b"read unit"] = [b"c"]  # cut short
+    with TestClient(ble_server.app) as client:
+        response = client.post("/batch", json={
+            "address": ADDRESS, "commands": ["read temp", "bogus", "read unit", "status"],
+        }).json()
+        assert [(r["command"], r["result"], r["error"]) for r in response["results"]] == [
+            ("read temp", "28.6", None),
+            ("bogus", None, "No response from device"),
+            ("read unit", None, "Incomplete response from device: b'c'"),
+            ("status", "running", None),
+        ]
+        assert all(r["elapsed"] >= 0 for r in response["results"]) and response["elapsed"] >= 0.1
+        # Every failure closed the connection, and the next command opened a new one
+        assert [client.written for client in ble.clients] == [
+            [b"read temp\r", b"bogus\r"], [b"read unit\r"], [b"status\r"]
+        ]
+        assert [c.is_connected for c in ble.clients] == [False, False, True]
+
+        response = client.post("/batch", json={
+            "address": ADDRESS, "commands": ["status", "bogus", "read temp"], "stop_on_error": True,
+        }).json()
+        assert [(r["command"], r["error"]) for r in response["results"]] == [
+            ("status", None), ("bogus", "No response from device")
+        ]
+        assert len(ble.clients) == 3
+
+def test_proxy_lifecycle(ble: FakeBle) -> None:
+    with TestClient(ble_server.app) as client:
+        assert FakeScanner.instances[0].running
+        assert client.get("/scan").json()[0]["address"] == ADDRESS
+        assert client.post("/write", json={"address": ADDRESS, "command": "read temp"}).json() == {"result": "28.6"}
+
+        response = client.post("/write", json={"address": ADDRESS, "command": "bogus"})
+        assert response.status_code == 500
+        assert response.json() == {"detail": "No response from device"}
+        assert client.post("/write", json={"address": ADDRESS, "command": "status"}).json() == {"result": "running"}
+    assert ble_server.pool.connections == {}
+    assert not any(c.is_connected for c in ble.clients)
+    assert not FakeScanner.instances[0].running
+
+
+def announce(client: FakeClient) -> None:
+    """Have the device send a few messages, split across notifications, and then go away."""
+    assert client.notify
+    loop = asyncio.get_running_loop()
+    loop.call_later(0.01, client.notify, "ffe1", bytearray(b"event wi"))
+    loop.call_later(0.02, client.notify, "ffe1", bytearray(b"fi stop\r28.6\r"))
+    loop.call_later(0.03, client.notify, "ffe1", bytearray(b"speaker"))
+    loop.call_later(0.04, client.drop)
+
+
+def test_notifications_are_published_as_messages(ble: FakeBle) -> None:
+    async def run() -> None:
+        pool = GattPool()
+        connection, subscriber = await pool.subscribe(ADDRESS)
+        notify = ble.clients[0].notify
+        assert notify
+
+        notify("ffe1", bytearray(b"run"))
+        assert subscriber.empty()
+        notify("ffe1", bytearray(b"ning\r57.5\rspeak"))
+        notify("ffe1", bytearray(b"er is on\r"))
+        assert [subscriber.get_nowait() for _ in range(3)] == ["running", "57.5", "speaker is on"]
+
+        # A subscriber that falls behind loses the oldest messages, and so does the raw queue of notifications
+        for i in range(NOTIFICATION_QUEUE_SIZE + 5):
+            notify("ffe1", bytearray(f"{i}\r".encode()))
+        assert subscriber.qsize() == connection.queue.qsize() == NOTIFICATION_QUEUE_SIZE
+        assert subscriber.get_nowait() == "5"
+        assert connection.queue.get_nowait() == b"5\r"
+
+        # Subscribers are told about a disconnect, and a message it cut short is not completed by the next connection
+        while not subscriber.empty():
+            subscriber.get_nowait()
+        notify("ffe1", bytearray(b"28."))
+        ble.clients[0].drop()
+        assert subscriber.get_nowait() is None
+        assert await command(pool, "read unit") == "c"
+        assert subscriber.get_nowait() == "c"
+
+        connection.unsubscribe(subscriber)
+        await pool.stop()
+
+    asyncio.run(run())
+
+
+def test_connection_stays_open_while_subscribed(ble: FakeBle) -> None:
+    async def run() -> None:
+        pool = GattPool(idle_timeout=0.05)
+        pool.start()
+        connection, subscriber = await pool.subscribe(ADDRESS)
+        await asyncio.sleep(0.15)
+        assert pool.connections[ADDRESS] is connection and connection.connected
+
+        connection.unsubscribe(subscriber)
+        await asyncio.sleep(0.15)
+        assert pool.connections == {}
+        assert not ble.clients[0].is_connected
+        await pool.stop()
+
+    asyncio.run(run())
+
+
+def test_notification_stream(ble: FakeBle) -> None:
+    ble.on_subscribe = announce
+    with TestClient(ble_server.app) as client:
+        response = client.get(f"/notifications/{ADDRESS}")
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.text == "data: event wifi stop\n\ndata: 28.6\n\nevent: disconnected\ndata: \n\n"
+        assert not ble_server.pool.connections[ADDRESS].subscribers
+
+        ble.reachable = False
+        response = client.get(f"/notifications/{ADDRESS}")
+        assert response.status_code == 500
+        assert response.json() == {"detail": f"Device with address {ADDRESS} was not found"}
+
+
+def test_notification_socket(ble: FakeBle) -> None:
+    ble.on_subscribe = announce
+    with TestClient(ble_server.app) as client:
+        with client.websocket_connect(f"/notifications/{ADDRESS}") as ws:
+            assert ws.receive_text() == "event wifi stop"
+            assert ws.receive_text() == "28.6"
+            with pytest.raises(WebSocketDisconnect):
+                ws.receive_text()
+        connection = ble_server.pool.connections[ADDRESS]
+        for _ in range(100):  # the socket's handler finishes on the server's own loop
+            if not connection.subscribers:
+                break
+            time.sleep(0.01)
+        assert not connection.subscribers
+
+        ble.reachable = False
+        with client.websocket_connect(f"/notifications/{ADDRESS}") as ws:
+            with pytest.raises(WebSocketDisconnect) as e:
+                ws.receive_text()
+            assert e.value.code == 1011